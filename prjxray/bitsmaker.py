@@ -27,13 +27,16 @@ def write(bits_fn, fnout, tags):
     # Everything relative to start of bitstream
     line("seg 00000000_000")
 
-    bitdata = bitstream.load_bitdata2(open(bits_fn, "r"))
-
-    for frame, words in bitdata.items():
-        for word, wbits in words.items():
-            for bitidx in sorted(list(wbits)):
-                # Are the names arbitrary? Lets just re-create
-                line("bit %08X_%03u_%02u" % (frame, word, bitidx))
+    with open(bits_fn, "r") as f:
+        frame_bits = bitstream.FrameBits.load(f)
+
+    for frame, bit in zip(frame_bits.bit_frames().tolist(),
+                          frame_bits.bits.tolist()):
+        # Are the names arbitrary? Lets just re-create
+        line(
+            "bit %08X_%03u_%02u" % (
+                frame, bit // bitstream.WORD_SIZE_BITS,
+                bit % bitstream.WORD_SIZE_BITS))
 
     for k, v in tags.items():
         line("tag %s %u" % (k, v))
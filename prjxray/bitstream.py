@@ -8,8 +8,13 @@
 # https://opensource.org/licenses/ISC
 #
 # SPDX-License-Identifier: ISC
+import abc
+from collections.abc import Mapping
 import json
 import os
+
+import numpy as np
+
 from prjxray import util
 
 # Break frames into WORD_SIZE bit words.
@@ -31,6 +36,172 @@ Where:
 '''
 
 
+class FrameBits(object):
+    """ Set bits of a bitstream, stored as columns of numpy arrays.
+
+    frames: Sorted frame addresses with any bit set.
+    starts: Bits of frames[i] are bits[starts[i]:starts[i + 1]].
+    bits: Bit index within the frame (word index * WORD_SIZE_BITS + bit
+          index in word), sorted within each frame.
+
+    Uses a few bytes per set bit, instead of the sets of load_bitdata /
+    load_bitdata2.  bitdata() and bitdata2() return the bits in those
+    formats, bitdata_view() and bitdata2_view() give read only views.
+
+    """
+
+    def __init__(self, frames, bits):
+        """ Create from the frame address and bit index of each set bit.
+
+        Pairs may be in any order and repeated.
+
+        """
+        frames = np.asarray(frames, dtype=np.int64)
+        bits = np.asarray(bits, dtype=np.int64)
+
+        order = np.lexsort((bits, frames))
+        frames = frames[order]
+        bits = bits[order]
+
+        keep = np.ones(len(frames), dtype=bool)
+        keep[1:] = (frames[1:] != frames[:-1]) | (bits[1:] != bits[:-1])
+        frames = frames[keep]
+
+        self.frames, first = np.unique(frames, return_index=True)
+        self.starts = np.append(first, len(frames)).astype(np.int64)
+        self.bits = bits[keep].astype(np.int32)
+
+    @staticmethod
+    def load(f):
+        """ Read bitread -y output lines, e.g. bit_0002000f_079_06. """
+        frames = []
+        bits = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            line = line.split("_")
+            frames.append(int(line[1], 16))
+            bits.append(int(line[2], 10) * WORD_SIZE_BITS + int(line[3], 10))
+
+        return FrameBits(frames, bits)
+
+    @staticmethod
+    def from_frame_words(addresses, data):
+        """ Create from an array of frame addresses and of their words.
+
+        data: Array of one row of words per frame address.
+
+        """
+        data = np.asarray(data, dtype=np.uint32)
+        bits = np.unpackbits(
+            data.astype('<u4').view(np.uint8), axis=1, bitorder='little')
+
+        frame_idx, bit_idx = np.nonzero(bits)
+        return FrameBits(np.asarray(addresses)[frame_idx], bit_idx)
+
+    def __len__(self):
+        """ Number of bits set. """
+        return len(self.bits)
+
+    def bit_frames(self):
+        """ Return the frame address of each bit of self.bits. """
+        return np.repeat(self.frames, np.diff(self.starts))
+
+    def select(self, base_address, frames, offset, words):
+        """ Return the bits in a range of frames and words.
+
+        Returns (frame offset from base_address, bit index from the start of
+        word offset) arrays of each bit set in frames base_address to
+        base_address + frames and words offset to offset + words.
+
+        """
+        first, last = np.searchsorted(
+            self.frames, [base_address, base_address + frames])
+        start, end = self.starts[first], self.starts[last]
+
+        bits = self.bits[start:end].astype(np.int64) - offset * WORD_SIZE_BITS
+        frame_offsets = np.repeat(
+            self.frames[first:last] - base_address,
+            np.diff(self.starts[first:last + 1]))
+
+        keep = (bits >= 0) & (bits < words * WORD_SIZE_BITS)
+        return frame_offsets[keep], bits[keep]
+
+    def bitdata(self):
+        """ Return the bits in the load_bitdata format. """
+        return dict(self.bitdata_view())
+
+    def bitdata2(self):
+        """ Return the bits in the load_bitdata2 format. """
+        return dict(self.bitdata2_view())
+
+    def bitdata_view(self):
+        """ Return a read only view in the load_bitdata format. """
+        return BitdataView(self)
+
+    def bitdata2_view(self):
+        """ Return a read only view in the load_bitdata2 format. """
+        return Bitdata2View(self)
+
+
+class FrameBitsView(Mapping):
+    """ Map of frame address to per frame value built from FrameBits.
+
+    Values are built on each access and not kept, so the view costs no more
+    memory than the FrameBits.  Code looking up frames repeatedly should use
+    FrameBits.bitdata / bitdata2 instead.
+
+    """
+
+    def __init__(self, frame_bits):
+        self.frame_bits = frame_bits
+        self.index = dict(
+            zip(frame_bits.frames.tolist(), range(len(frame_bits.frames))))
+
+    def __getitem__(self, frame):
+        idx = self.index[frame]
+        starts = self.frame_bits.starts
+        return self.make_value(
+            self.frame_bits.bits[starts[idx]:starts[idx + 1]])
+
+    def __contains__(self, frame):
+        return frame in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    @abc.abstractmethod
+    def make_value(self, bits):
+        """ Return the value of a frame from its array of bit indexes. """
+
+
+class BitdataView(FrameBitsView):
+    """ FrameBits as load_bitdata bitdata. """
+
+    def make_value(self, bits):
+        return set((bits // WORD_SIZE_BITS).tolist()), set(bits.tolist())
+
+
+class Bitdata2View(FrameBitsView):
+    """ FrameBits as load_bitdata2 bitdata. """
+
+    def make_value(self, bits):
+        words = {}
+        for bit in bits.tolist():
+            wordidx = bit // WORD_SIZE_BITS
+            if wordidx not in words:
+                words[wordidx] = set()
+
+            words[wordidx].add(bit % WORD_SIZE_BITS)
+
+        return words
+
+
 def load_bitdata(f):
     """ Read bit file and return bitdata map.
     Similar to segbits file
@@ -40,57 +211,25 @@ def load_bitdata(f):
     The first sets are the word columns that have any bits set.
     Word columsn are WORD_SIZE_BITS wide.
     The second sets are bit index within the frame and word if it is set.
-    """
-    bitdata = dict()
-
-    for line in f:
-        line = line.split("_")
-        frame = int(line[1], 16)
-        wordidx = int(line[2], 10)
-        bitidx = int(line[3], 10)
-
-        if frame not in bitdata:
-            bitdata[frame] = set(), set()
 
-        bitdata[frame][0].add(wordidx)
-        bitdata[frame][1].add(wordidx * WORD_SIZE_BITS + bitidx)
-
-    return bitdata
+    See FrameBits for a compact form.
+    """
+    return FrameBits.load(f).bitdata()
 
 
 # used by segprint
-# TODO: merge these
 def load_bitdata2(f):
     '''
     return as bitdata[frame][wordidx].add(bitidx)
     ie indexed by frame, word index, and then a set with bit indexes
     Similar to .bits file: bit_00020012_014_20
-    '''
-
-    bitdata = dict()
-
-    for lineraw in f:
-        lineraw = lineraw.strip()
-        line = lineraw.split("_")
-        try:
-            frame = int(line[1], 16)
-            wordidx = int(line[2], 10)
-            bitidx = int(line[3], 10)
-        except:
-            print("Invalid line %s" % lineraw)
-            raise
 
-        if frame not in bitdata:
-            bitdata[frame] = dict()
-
-        if wordidx not in bitdata[frame]:
-            bitdata[frame][wordidx] = set()
-
-        bitdata[frame][wordidx].add(bitidx)
-    return bitdata
+    See FrameBits for a compact form.
+    '''
+    return FrameBits.load(f).bitdata2()
 
 
-def gen_part_base_addrs():
+def gen_part_base_addrs(part_json=None):
     """
     Return (block_type, top_bottom, cfg_row, cfg_col, frame_count)
     Where:
@@ -104,10 +243,15 @@ def gen_part_base_addrs():
     ('CLB_IO_CLK', 'bottom', 0, 3, 36)
     ('BLOCK_RAM', 'top', 0, 1, 128)
     ('CLB_IO_CLK', 'top', 1, 34, 28)
+
+    part_json is the decoded part.json, read from $XRAY_PART_YAML if None.
     """
-    fn = os.getenv("XRAY_PART_YAML").replace(".yaml", ".json")
-    j = json.load(open(fn, "r"))
-    for tbk, tbv in j["global_clock_regions"].items():
+    if part_json is None:
+        fn = os.getenv("XRAY_PART_YAML").replace(".yaml", ".json")
+        with open(fn, "r") as f:
+            part_json = json.load(f)
+
+    for tbk, tbv in part_json["global_clock_regions"].items():
         for rowk, rowv in tbv["rows"].items():
             for busk, busv in rowv["configuration_buses"].items():
                 for colk, colv in busv["configuration_columns"].items():
@@ -125,3 +269,58 @@ def addr_bits2word(block_type, top_bottom, cfg_row, cfg_col, minor_addr):
     ret |= cfg_col << 7
     ret |= minor_addr
     return ret
+
+
+class PartDataError(Exception):
+    pass
+
+
+class Part(object):
+    """ IDCODE and configuration frame addresses of a part. """
+
+    def __init__(self, idcode, frame_addresses):
+        self.idcode = idcode
+        self.frame_addresses = np.unique(
+            np.array(list(frame_addresses), dtype=np.int64))
+
+    @staticmethod
+    def from_json(part_json):
+        """ Create from a decoded part.json (see utils/xyaml.py). """
+        if not all(key in part_json
+                   for key in ('idcode', 'global_clock_regions')):
+            raise PartDataError(
+                'part.json has no idcode / global_clock_regions')
+
+        frame_addresses = []
+        for block_type, top_bottom, cfg_row, cfg_col, frame_count in \
+                gen_part_base_addrs(part_json):
+            base_address = addr_bits2word(
+                block_type, top_bottom, cfg_row, cfg_col, 0)
+            frame_addresses.extend(
+                range(base_address, base_address + frame_count))
+
+        return Part(part_json['idcode'], frame_addresses)
+
+    def row_ends(self):
+        """ Return a bool array over frame_addresses.
+
+        True for frames followed by a frame in another block type, half or
+        row.  In FDRI writes, two zero frames follow each of these frames.
+
+        """
+        row_end = np.zeros(len(self.frame_addresses), dtype=bool)
+        row_end[:-1] = (self.frame_addresses[1:] >> 17) != (
+            self.frame_addresses[:-1] >> 17)
+        return row_end
+
+
+def read_part(db_root, part):
+    """ Read Part from the part.json of part in the database. """
+    fname = os.path.join(db_root, part, 'part.json')
+    with open(fname) as f:
+        part_json = json.load(f)
+
+    try:
+        return Part.from_json(part_json)
+    except PartDataError as e:
+        raise PartDataError('{}: {}'.format(fname, e))
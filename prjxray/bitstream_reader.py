@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+""" Read Series-7 bitstreams (.bit / .bin) into frame data.
+
+This is the part of bitread used by bit2fasm in Python: the configuration
+packets after the sync word are decoded and the FDRI writes are replayed
+like Configuration::InitWithPackets does, following FAR auto increment over
+the frames of the part.
+
+read_bitstream returns frames in the format of FasmAssembler.get_frames(),
+and frames_to_bitdata converts them to the bitdata of
+bitstream.load_bitdata, without going through the ASCII .bits format.
+
+"""
+import numpy as np
+
+from prjxray import bitstream
+from prjxray.bitstream_writer import (
+    CMD_WCFG, ECC_MASK, ECC_WORD, OPCODE_WRITE, REG_CMD, REG_CRC, REG_CTL1,
+    REG_FAR, REG_FDRI, REG_IDCODE, REG_MASK)
+
+SYNC_WORD = b'\xaa\x99\x55\x66'
+
+# CTL1 bit set when per-frame CRC is enabled, inhibits re-executing CMD on
+# FAR writes.
+CTL1_FAR_NO_CMD = 1 << 21
+
+
+class BitstreamError(Exception):
+    pass
+
+
+def read_words(data):
+    """ Return the big-endian words after the sync word in bytes data. """
+    sync_pos = data.find(SYNC_WORD)
+    if sync_pos == -1:
+        raise BitstreamError("Input doesn't look like a bitstream")
+
+    start = sync_pos + len(SYNC_WORD)
+    return np.frombuffer(
+        data, dtype='>u4', offset=start,
+        count=(len(data) - start) // 4).astype(np.uint32)
+
+
+def iter_packets(words):
+    """ Yield (opcode, register, data) for the packets in words.
+
+    data is a view of words.  Type 2 packets use the register of the
+    previous packet, and are skipped if there is none.
+
+    """
+    pos = 0
+    register = None
+    while pos < len(words):
+        header = int(words[pos])
+        header_type = header >> 29
+
+        if header_type == 0:
+            # Zero padding emitted with BITSTREAM.GENERAL.DEBUGBITSTREAM,
+            # consumed like a NOP to the CRC register.
+            register = REG_CRC
+            pos += 1
+            continue
+        elif header_type == 1:
+            opcode = (header >> 27) & 0x3
+            register = (header >> 13) & 0x3FFF
+            count = header & 0x7FF
+        elif header_type == 2:
+            opcode = (header >> 27) & 0x3
+            count = header & 0x7FFFFFF
+        else:
+            return
+
+        # Truncated packet, consider it the end.
+        if count > len(words) - pos - 1:
+            return
+
+        data = words[pos + 1:pos + 1 + count]
+        pos += 1 + count
+
+        if register is not None:
+            yield opcode, register, data
+
+
+class _FdriWrites(object):
+    """ Replays FDRI writes with FAR auto increment over the part. """
+
+    def __init__(self, part):
+        self.part = part
+        self.addresses = []
+        self.data = []
+
+        # Word offset of each frame of the part in an FDRI write starting at
+        # the first frame, including the two zero frames after row ends.
+        frame_words = bitstream.FRAME_WORD_COUNT * (
+            1 + 2 * part.row_ends().astype(np.int64))
+        self.word_offsets = np.cumsum(frame_words) - frame_words
+
+    def write(self, address, data):
+        """ Write data starting at frame address, return the next address. """
+        if len(data) == 0:
+            return address
+
+        part_addresses = self.part.frame_addresses
+        pos = int(np.searchsorted(part_addresses, address))
+        if pos == len(part_addresses) or part_addresses[pos] != address:
+            # No way to know the next address, only write one frame.
+            self.add_frames([address], data, np.array([0]))
+            return address
+
+        offsets = self.word_offsets[pos:] - self.word_offsets[pos]
+        count = int(np.searchsorted(offsets, len(data)))
+
+        self.add_frames(part_addresses[pos:pos + count], data, offsets[:count])
+
+        if pos + count < len(part_addresses):
+            return int(part_addresses[pos + count])
+        else:
+            return int(part_addresses[-1])
+
+    def add_frames(self, addresses, data, offsets):
+        # The last frame may be cut short, zero fill it.
+        padded = np.zeros(len(data) + bitstream.FRAME_WORD_COUNT, np.uint32)
+        padded[:len(data)] = data
+
+        self.addresses.append(np.asarray(addresses, dtype=np.int64))
+        self.data.append(
+            padded[offsets[:, None] +
+                   np.arange(bitstream.FRAME_WORD_COUNT)[None, :]])
+
+    def get_frames(self):
+        """ Return map of frame address to FRAME_WORD_COUNT words.
+
+        Later writes to a frame replace earlier ones.  All frames share one
+        backing array, each value is a view of one row.
+
+        """
+        if not self.addresses:
+            return {}
+
+        addresses = np.concatenate(self.addresses)[::-1]
+        data = np.concatenate(self.data)[::-1]
+
+        addresses, rows = np.unique(addresses, return_index=True)
+        data = data[rows]
+
+        return dict(zip(addresses.tolist(), data))
+
+
+def read_bitstream(data, part):
+    """ Return the frames written by bitstream bytes data.
+
+    part: bitstream.Part the bitstream is for, see bitstream.read_part.
+
+    Returns a map of frame address to FRAME_WORD_COUNT words, as returned
+    by FasmAssembler.get_frames().
+
+    """
+    mask_register = 0
+    ctl1_register = 0
+    command_register = 0
+    frame_address_register = 0
+
+    start_new_write = False
+    current_frame_address = 0
+
+    fdri = _FdriWrites(part)
+
+    for opcode, register, packet_data in iter_packets(read_words(data)):
+        if opcode != OPCODE_WRITE:
+            continue
+
+        if register == REG_FDRI:
+            if start_new_write:
+                current_frame_address = frame_address_register
+                start_new_write = False
+
+            current_frame_address = fdri.write(
+                current_frame_address, packet_data)
+            continue
+
+        if len(packet_data) < 1:
+            continue
+
+        value = int(packet_data[0])
+        if register == REG_MASK:
+            mask_register = value
+        elif register == REG_CTL1:
+            ctl1_register = value & mask_register
+        elif register == REG_CMD:
+            # WCFG arms a new write at FAR for the next FDRI write.
+            command_register = value
+            if command_register == CMD_WCFG:
+                start_new_write = True
+        elif register == REG_IDCODE:
+            if value != part.idcode:
+                raise BitstreamError(
+                    'Bitstream is for IDCODE 0x{:08x}, part has 0x{:08x}'.
+                    format(value, part.idcode))
+        elif register == REG_FAR:
+            # CMD is executed again on each FAR write, unless CTL1 says
+            # otherwise, see Configuration::InitWithPackets.
+            frame_address_register = value
+            if not ctl1_register & CTL1_FAR_NO_CMD and \
+                    command_register == CMD_WCFG:
+                start_new_write = True
+
+    return fdri.get_frames()
+
+
+def read_bitstream_file(fname, part):
+    """ read_bitstream of the .bit / .bin file fname. """
+    with open(fname, 'rb') as f:
+        return read_bitstream(f.read(), part)
+
+
+def parse_frame_range(frame_range):
+    """ Parse a bitread style "first:last" frame range (last inclusive).
+
+    Returns (first, last + 1).
+
+    """
+    first, last = frame_range.split(':')
+    return int(first, 0), int(last, 0) + 1
+
+
+def frames_to_frame_bits(frames, frame_range=None):
+    """ Return the set bits of frames as a bitstream.FrameBits.
+
+    frames: Map of frame address to FRAME_WORD_COUNT words.
+    frame_range: Optional (begin, end) frame address range to include.
+
+    Like bitread, the ECC bits of the frames are skipped.
+
+    """
+    if not frames:
+        return bitstream.FrameBits([], [])
+
+    addresses = np.array(list(frames.keys()), dtype=np.int64)
+    data = np.array(
+        list(frames.values()), dtype=np.uint32).reshape(
+            -1, bitstream.FRAME_WORD_COUNT)
+
+    if frame_range is not None:
+        begin, end = frame_range
+        keep = (addresses >= begin) & (addresses < end)
+        addresses = addresses[keep]
+        data = data[keep]
+
+    data = data.copy()
+    data[:, ECC_WORD] &= ~np.uint32(ECC_MASK)
+
+    rows = np.flatnonzero(data.any(axis=1))
+    return bitstream.FrameBits.from_frame_words(addresses[rows], data[rows])
+
+
+def frames_to_bitdata(frames, frame_range=None):
+    """ Return frames as bitdata, see bitstream.load_bitdata.
+
+    See frames_to_frame_bits for the arguments.
+
+    """
+    return frames_to_frame_bits(frames, frame_range=frame_range).bitdata()
+
+
+def write_bits(f, bitdata):
+    """ Write bitdata in the bitread -y format read by load_bitdata. """
+    if isinstance(bitdata, bitstream.BitdataView):
+        frame_bits = bitdata.frame_bits
+        set_bits = zip(
+            frame_bits.bit_frames().tolist(), frame_bits.bits.tolist())
+    else:
+        set_bits = (
+            (frame, bit)
+            for frame in sorted(bitdata)
+            for bit in sorted(bitdata[frame][1]))
+
+    for frame, bit in set_bits:
+        f.write(
+            'bit_{:08x}_{:03d}_{:02d}\n'.format(
+                frame, bit // bitstream.WORD_SIZE_BITS,
+                bit % bitstream.WORD_SIZE_BITS))
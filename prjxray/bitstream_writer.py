@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+""" Write Series-7 bitstreams (.bit / .bin) from frame data.
+
+This is the Series-7 part of xc7frames2bit in Python, so that tools like
+fasm2frames can emit a bitstream straight from FasmAssembler.get_frames()
+instead of writing a .frm file for xc7frames2bit to parse again:
+
+ - every frame of the part is written, missing frames are zero filled,
+ - the ECC word of each frame is recomputed,
+ - frames are sent as one type 2 FDRI write, with two zero frames after each
+   block type / row change and at the end,
+ - the packet sequence around the FDRI write matches xc7frames2bit.
+
+"""
+import datetime
+
+import numpy as np
+
+from prjxray import bitstream
+
+# Series-7 configuration registers, UG470 table 5-23.
+REG_CRC = 0x00
+REG_FAR = 0x01
+REG_FDRI = 0x02
+REG_CMD = 0x04
+REG_CTL0 = 0x05
+REG_MASK = 0x06
+REG_COR0 = 0x09
+REG_IDCODE = 0x0c
+REG_COR1 = 0x0e
+REG_WBSTAR = 0x10
+REG_TIMER = 0x11
+REG_UNKNOWN = 0x13
+REG_CTL1 = 0x18
+
+# Commands written to REG_CMD, UG470 table 5-25.
+CMD_NOP = 0x00
+CMD_WCFG = 0x01
+CMD_LFRM = 0x03
+CMD_START = 0x05
+CMD_RCRC = 0x07
+CMD_SWITCH = 0x09
+CMD_GRESTORE = 0x0a
+CMD_DESYNC = 0x0d
+
+OPCODE_WRITE = 2
+
+NOP = 0x20000000
+
+# Bus width auto detection and sync word, UG470 page 80.
+SYNC_HEADER = (0xFFFFFFFF, ) * 8 + (
+    0x000000BB, 0x11220044, 0xFFFFFFFF, 0xFFFFFFFF, 0xAA995566)
+
+# COR0 as written by xc7frames2bit: pipelined DONE_IN, DONE released in
+# startup phase 4, no DCI / MMCM wait, GTS in phase 5 and GWE in phase 6.
+COR0_VALUE = 0x02003fe5
+
+# Two zero frames separate block types and rows in the FDRI data.
+ZERO_FRAMES_SEPARATOR = 2
+
+ECC_WORD = 0x32
+ECC_MASK = 0x1FFF
+
+CRC32C_POLYNOMIAL = 0x82F63B78
+
+
+def icap_ecc(idx, data, ecc):
+    """ Extend the ECC of a frame with word data at word index idx.
+
+    Port of lib/xilinx/xc7series/ecc.cc, used as reference for update_ecc.
+    """
+    val = idx * 32
+    if idx > 0x25:
+        val += 0x1360
+    elif idx > 0x6:
+        val += 0x1340
+    else:
+        val += 0x1320
+
+    if idx == ECC_WORD:
+        data &= ~ECC_MASK & 0xFFFFFFFF
+
+    for i in range(32):
+        if data & 1:
+            ecc ^= val + i
+
+        data >>= 1
+
+    if idx == bitstream.FRAME_WORD_COUNT - 1:
+        v = ecc & 0xFFF
+        v ^= v >> 8
+        v ^= v >> 4
+        v ^= v >> 2
+        v ^= v >> 1
+        ecc ^= (v & 1) << 12
+
+    return ecc
+
+
+def _ecc_tables():
+    """ Return uint32[FRAME_WORD_COUNT, 4, 256].
+
+    Entry [word, byte, value] is the ECC contribution of byte number byte of
+    word number word having the given value, so the ECC of a frame is the
+    XOR of one entry per byte of the frame, plus the parity bit.
+
+    """
+    bit_values = np.zeros((bitstream.FRAME_WORD_COUNT, 32), dtype=np.uint32)
+    for idx in range(bitstream.FRAME_WORD_COUNT):
+        bit_values[idx] = [icap_ecc(idx, 1 << bit, 0) for bit in range(32)]
+
+    # The last word also folds in the parity, which is not linear, so take
+    # the plain bit offsets for it and add the parity in update_ecc.
+    last = bitstream.FRAME_WORD_COUNT - 1
+    bit_values[last] = np.arange(32) + last * 32 + 0x1360
+
+    tables = np.zeros((bitstream.FRAME_WORD_COUNT, 4, 256), dtype=np.uint32)
+    for bit in range(8):
+        has_bit = (np.arange(256) >> bit) & 1 == 1
+        for byte in range(4):
+            tables[:, byte, has_bit] ^= bit_values[:, byte * 8 + bit, None]
+
+    return tables
+
+
+_ECC_TABLES = None
+
+
+def update_ecc(data, chunk_size=4096):
+    """ Recompute the ECC word of all frames in uint32[N, 101] array data. """
+    global _ECC_TABLES
+    if _ECC_TABLES is None:
+        _ECC_TABLES = _ecc_tables()
+
+    words = np.arange(bitstream.FRAME_WORD_COUNT)[:, None]
+    byte_idx = np.arange(4)[None, :]
+
+    # Frames without any bit set have an ECC of 0.
+    rows = np.flatnonzero(data.any(axis=1))
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+
+        frames = data[chunk].astype('<u4')
+        frames[:, ECC_WORD] &= ~np.uint32(ECC_MASK)
+        frame_bytes = frames.view(np.uint8).reshape(
+            len(chunk), bitstream.FRAME_WORD_COUNT, 4)
+
+        ecc = np.bitwise_xor.reduce(
+            _ECC_TABLES[words, byte_idx, frame_bytes].reshape(len(chunk), -1),
+            axis=1)
+
+        parity = ecc & 0xFFF
+        for shift in (8, 4, 2, 1):
+            parity ^= parity >> shift
+        ecc ^= (parity & 1) << 12
+
+        data[chunk, ECC_WORD] = frames[:, ECC_WORD] | (ecc & ECC_MASK)
+
+
+def icap_crc(addr, data, prev):
+    """ Extend CRC prev with a write of data to register addr.
+
+    Port of lib/include/prjxray/xilinx/xc7series/crc.h.
+    """
+    poly = CRC32C_POLYNOMIAL << 1
+    val = (addr << 32) | data
+    crc = prev
+
+    for _ in range(5 + 32):
+        if (val & 1) != (crc & 1):
+            crc ^= poly
+
+        val >>= 1
+        crc >>= 1
+
+    return crc
+
+
+def _crc_byte_table():
+    table = np.zeros(256, dtype=np.uint32)
+    for value in range(256):
+        crc = value
+        for _ in range(8):
+            crc = (crc >> 1) ^ (CRC32C_POLYNOMIAL if crc & 1 else 0)
+        table[value] = crc
+
+    return table
+
+
+_CRC_BYTE_TABLE = _crc_byte_table()
+
+
+def _linear_map_tables(columns):
+    """ Return lookup tables applying a linear map of 32 bit CRC states.
+
+    columns[i] is the image of state 1 << i.  The map of a state is the XOR
+    of tables[byte][(state >> (8 * byte)) & 0xFF] for the four bytes.
+
+    """
+    tables = np.zeros((4, 256), dtype=np.uint32)
+    for bit in range(8):
+        has_bit = (np.arange(256) >> bit) & 1 == 1
+        for byte in range(4):
+            tables[byte, has_bit] ^= np.uint32(columns[byte * 8 + bit])
+
+    return tables
+
+
+def _apply_linear_map(tables, states):
+    return (
+        tables[0][states & 0xFF] ^ tables[1][(states >> 8) & 0xFF] ^
+        tables[2][(states >> 16) & 0xFF] ^ tables[3][states >> 24])
+
+
+def icap_crc_words(addr, words, prev=0):
+    """ Return icap_crc extended with every word of words written to addr.
+
+    The CRC has no initial or final XOR, so it is linear in the CRC state
+    and the written words.  Each word is first turned into its contribution
+    from a zero state, then contributions are combined pairwise in a tree
+    (left shifted through the zero input steps of the right block), which
+    keeps the work in numpy.
+
+    """
+    words = np.asarray(words, dtype=np.uint32)
+
+    crc = np.zeros(len(words), dtype=np.uint32)
+    for byte in range(4):
+        crc = (
+            crc >> 8) ^ _CRC_BYTE_TABLE[(crc ^ (words >> (8 * byte))) & 0xFF]
+    for bit in range(5):
+        crc = (crc >> 1) ^ (
+            ((crc ^ (addr >> bit)) & 1) * np.uint32(CRC32C_POLYNOMIAL))
+
+    # prev acts like one more leading contribution, and leading zero
+    # contributions do not change the result, so pad to a power of two.
+    size = 1
+    while size < len(words) + 1:
+        size *= 2
+
+    leaves = np.zeros(size, dtype=np.uint32)
+    leaves[size - len(words) - 1] = prev
+    leaves[size - len(words):] = crc
+
+    # Columns of the map advancing a state by one zero word.
+    columns = [icap_crc(0, 0, 1 << bit) for bit in range(32)]
+    while len(leaves) > 1:
+        tables = _linear_map_tables(columns)
+        pairs = leaves.reshape(-1, 2)
+        leaves = _apply_linear_map(tables, pairs[:, 0]) ^ pairs[:, 1]
+
+        # Square the map, it now advances by twice as many words.
+        columns = _apply_linear_map(
+            tables, np.array(columns, dtype=np.uint32)).tolist()
+
+    return int(leaves[0])
+
+
+def frame_data(frames, part):
+    """ Return (addresses, data) of every frame to write.
+
+    frames: Map of frame address to FRAME_WORD_COUNT words, as returned by
+    FasmAssembler.get_frames().
+
+    addresses is the sorted array of all frame addresses of the part and of
+    frames, data the uint32[len(addresses), FRAME_WORD_COUNT] frame words
+    with up to date ECC.
+
+    """
+    addresses = np.union1d(
+        part.frame_addresses, np.array(list(frames.keys()), dtype=np.int64))
+
+    data = np.zeros(
+        (len(addresses), bitstream.FRAME_WORD_COUNT), dtype=np.uint32)
+    if frames:
+        rows = np.searchsorted(
+            addresses, np.array(list(frames.keys()), dtype=np.int64))
+        data[rows] = np.array(list(frames.values()), dtype=np.uint32)
+
+    update_ecc(data)
+
+    return addresses, data
+
+
+def fdri_data(addresses, data, part):
+    """ Return the words of the type 2 FDRI write of the frames.
+
+    Like xc7frames2bit, two zero frames are inserted when the next frame
+    address of the part is in another block type, half or row, and after
+    the last frame.
+
+    """
+    part_addresses = part.frame_addresses
+
+    # Frames outside of the part are never followed by a separator.
+    pos = np.searchsorted(part_addresses, addresses)
+    in_part = pos < len(part_addresses)
+    in_part[in_part] = part_addresses[pos[in_part]] == addresses[in_part]
+
+    separator = np.zeros(len(addresses), dtype=bool)
+    separator[in_part] = part.row_ends()[pos[in_part]]
+
+    # Row of each frame in the output, after the separators before it.
+    rows = np.arange(len(addresses)) + ZERO_FRAMES_SEPARATOR * (
+        np.cumsum(separator) - separator)
+
+    out = np.zeros(
+        (
+            len(addresses) + ZERO_FRAMES_SEPARATOR *
+            (np.count_nonzero(separator) + 1), bitstream.FRAME_WORD_COUNT),
+        dtype=np.uint32)
+    out[rows] = data
+
+    return out.reshape(-1)
+
+
+class ConfigurationPackets(object):
+    """ Builds the configuration packet stream.
+
+    With crc_check, also tracks the CRC of the register writes, which is
+    expensive over the FDRI payload and only needed when it is written.
+
+    """
+
+    def __init__(self, crc_check=False):
+        self.chunks = []
+        self.crc_check = crc_check
+        self.crc = 0
+
+    def nop(self, count=1):
+        self.chunks.append(np.full(count, NOP, dtype=np.uint32))
+
+    def write(self, register, *values):
+        self.chunks.append(
+            np.array(
+                [type1_header(OPCODE_WRITE, register, len(values))] +
+                list(values),
+                dtype=np.uint32))
+
+        if not self.crc_check:
+            return
+
+        for value in values:
+            if register != REG_CRC:
+                self.crc = icap_crc(register, value, self.crc)
+
+            if register == REG_CMD and value == CMD_RCRC:
+                self.crc = 0
+
+    def command(self, command):
+        self.write(REG_CMD, command)
+
+    def write_fdri(self, words):
+        self.write(REG_FDRI)
+        self.chunks.append(
+            np.array(
+                [type2_header(OPCODE_WRITE, len(words))], dtype=np.uint32))
+        self.chunks.append(words)
+        if self.crc_check:
+            self.crc = icap_crc_words(REG_FDRI, words, self.crc)
+
+    def words(self):
+        return np.concatenate(self.chunks)
+
+
+def type1_header(opcode, register, word_count):
+    return (1 << 29) | (opcode << 27) | (register << 13) | word_count
+
+
+def type2_header(opcode, word_count):
+    return (2 << 29) | (opcode << 27) | word_count
+
+
+def configuration_words(frames, part, crc_check=False):
+    """ Return the configuration words, from the sync word to DESYNC.
+
+    With crc_check, the CRC of the packets is written to the CRC register
+    after the frame data.  xc7frames2bit does not check the CRC, and the
+    device does not require it.
+
+    """
+    packets = ConfigurationPackets(crc_check=crc_check)
+
+    packets.nop()
+    packets.write(REG_TIMER, 0)
+    packets.write(REG_WBSTAR, 0)
+    packets.command(CMD_NOP)
+    packets.nop()
+    packets.command(CMD_RCRC)
+    packets.nop(2)
+    packets.write(REG_UNKNOWN, 0)
+    packets.write(REG_COR0, COR0_VALUE)
+    packets.write(REG_COR1, 0)
+    packets.write(REG_IDCODE, part.idcode)
+    packets.command(CMD_SWITCH)
+    packets.nop()
+    packets.write(REG_MASK, 0x401)
+    packets.write(REG_CTL0, 0x501)
+    packets.write(REG_MASK, 0)
+    packets.write(REG_CTL1, 0)
+    packets.nop(8)
+    packets.write(REG_FAR, 0)
+    packets.command(CMD_WCFG)
+    packets.nop()
+
+    addresses, data = frame_data(frames, part)
+    packets.write_fdri(fdri_data(addresses, data, part))
+
+    if crc_check:
+        packets.write(REG_CRC, packets.crc)
+
+    packets.command(CMD_RCRC)
+    packets.nop(2)
+    packets.command(CMD_GRESTORE)
+    packets.nop()
+    packets.command(CMD_LFRM)
+    packets.nop(100)
+    packets.command(CMD_START)
+    packets.nop()
+    packets.write(REG_FAR, 0x3be0000)
+    packets.write(REG_MASK, 0x501)
+    packets.write(REG_CTL0, 0x501)
+    packets.command(CMD_RCRC)
+    packets.nop(2)
+    packets.command(CMD_DESYNC)
+    packets.nop(400)
+
+    return np.concatenate(
+        [np.array(SYNC_HEADER, dtype=np.uint32),
+         packets.words()])
+
+
+def bit_header(part_name, source_name, generator, length, now=None):
+    """ Return the .bit file header, a mostly tag-length-value format.
+
+    See http://www.fpga-faq.com/FAQ_Pages/0026_Tell_me_about_bit_files.htm
+
+    """
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+    def field(tag, value):
+        value = value.encode() + b'\x00'
+        return tag + len(value).to_bytes(2, 'big') + value
+
+    return b''.join(
+        [
+            bytes(
+                [
+                    0x00, 0x09, 0x0f, 0xf0, 0x0f, 0xf0, 0x0f, 0xf0, 0x0f, 0xf0,
+                    0x00, 0x00, 0x01
+                ]),
+            field(b'a', '{};Generator={}'.format(source_name, generator)),
+            field(b'b', part_name),
+            field(b'c', now.strftime('%Y/%m/%d')),
+            field(b'd', now.strftime('%H:%M:%S')),
+            b'e' + length.to_bytes(4, 'big'),
+        ])
+
+
+def write_bitstream(
+        f,
+        frames,
+        part,
+        part_name,
+        source_name='',
+        generator='prjxray',
+        bit_header_enabled=True,
+        crc_check=False):
+    """ Write a bitstream of frames for part to binary file object f.
+
+    frames: Map of frame address to FRAME_WORD_COUNT words, as returned by
+    FasmAssembler.get_frames().
+    part: bitstream.Part, see bitstream.read_part.
+    part_name: Part name for the .bit header, e.g. xc7a35tcsg324-1.
+    bit_header_enabled: Write the .bit header, otherwise a raw .bin file.
+
+    """
+    data = configuration_words(
+        frames, part, crc_check=crc_check).astype('>u4').tobytes()
+
+    if bit_header_enabled:
+        f.write(bit_header(part_name, source_name, generator, len(data)))
+
+    f.write(data)
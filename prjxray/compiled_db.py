@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+""" Single file binary snapshot of the database of one part.
+
+Parsing the text database (tilegrid.json, tileconn.json, tile_type_*.json,
+segbits_*.db, ...) dominates the startup time of tools like bit2fasm and
+fasm2frames.  write_compiled_database packs everything a Database serves for
+one part into a single file, and CompiledDatabase memory maps that file and
+decodes sections only when they are first requested.
+
+File layout:
+
+  header:   magic (8 bytes), format version (uint32),
+            index offset (uint64), index length (uint64)
+  sections: pickled section payloads
+  index:    pickled dict with the part metadata and a map of section name to
+            (offset, length)
+
+Use Database.open_compiled to get a Database backed by a snapshot.
+
+"""
+import mmap
+import os.path
+import pickle
+import struct
+
+import simplejson as json
+
+from prjxray import tile_segbits
+from prjxray.grid_types import BlockType
+
+MAGIC = b'XRAYDB\x00\x00'
+VERSION = 3
+
+HEADER = struct.Struct('<8sIQQ')
+
+
+class CompiledDatabaseError(Exception):
+    pass
+
+
+def _read_json(fname):
+    with open(fname) as f:
+        return json.load(f)
+
+
+def write_compiled_database(db, fname):
+    """ Write a snapshot of Database db to fname. """
+    sections = {}
+
+    def add(name, value):
+        assert name not in sections, name
+        sections[name] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    fabric_root = os.path.join(db.db_root, db.fabric)
+
+    db._read_tilegrid()
+    add('tilegrid', db.tilegrid)
+    add('grid', db.grid())
+
+    tileconn = os.path.join(fabric_root, 'tileconn.json')
+    if os.path.isfile(tileconn):
+        add('tileconn', _read_json(tileconn))
+
+    node_wires = os.path.join(fabric_root, 'node_wires.json')
+    if os.path.isfile(node_wires):
+        add('node_wires', _read_json(node_wires))
+
+    for tile_type, tile_dbs in db.tile_types.items():
+        if tile_dbs.tile_type is not None:
+            add('tile_type:' + tile_type, _read_json(tile_dbs.tile_type))
+
+        segbits, ppips = tile_segbits.read_tile_segbits(tile_dbs)
+        add('tile_ppips:' + tile_type, ppips)
+        for block_type, block_segbits in segbits.items():
+            add(segbits_section(tile_type, block_type), block_segbits)
+
+    for site_type_name, site_type_file in db.site_types.items():
+        add('site_type:' + site_type_name, _read_json(site_type_file))
+
+    part_json = os.path.join(db.db_root, db.part, 'part.json')
+    if os.path.isfile(part_json):
+        add('part_json', _read_json(part_json))
+
+    index = {
+        'db_root': db.db_root,
+        'part': db.part,
+        'fabric': db.fabric,
+        'tile_types': dict(db.tile_types),
+        'site_types': dict(db.site_types),
+        'required_features': db.required_features,
+        'sections': {},
+    }
+
+    with open(fname, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+
+        for name, data in sections.items():
+            index['sections'][name] = (f.tell(), len(data))
+            f.write(data)
+
+        index_data = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+        index_offset = f.tell()
+        f.write(index_data)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, index_offset, len(index_data)))
+
+
+def segbits_section(tile_type, block_type):
+    return 'segbits:{}:{}'.format(tile_type, block_type.value)
+
+
+class CompiledDatabase(object):
+    """ Read only view of a file written by write_compiled_database. """
+
+    def __init__(self, fname):
+        self.fname = fname
+
+        with open(fname, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size:
+                raise CompiledDatabaseError(
+                    '{} is too short to be a compiled database'.format(fname))
+
+            magic, version, index_offset, index_length = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise CompiledDatabaseError(
+                    '{} is not a compiled database'.format(fname))
+            if version != VERSION:
+                raise CompiledDatabaseError(
+                    '{} has format version {}, expected {}, recompile it'.
+                    format(fname, version, VERSION))
+
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index = pickle.loads(
+            self.mmap[index_offset:index_offset + index_length])
+
+        self.db_root = index['db_root']
+        self.part = index['part']
+        self.fabric = index['fabric']
+        self.tile_types = index['tile_types']
+        self.site_types = index['site_types']
+        self.required_features = index['required_features']
+        self.sections = index['sections']
+
+    def has_section(self, name):
+        return name in self.sections
+
+    def load(self, name):
+        """ Decode and return section name. """
+        offset, length = self.sections[name]
+        return pickle.loads(self.mmap[offset:offset + length])
+
+    def load_tile_type(self, tile_type):
+        return self.load('tile_type:' + tile_type)
+
+    def load_tile_segbits(self, tile_type):
+        """ Return (segbits, ppips) for tile_type, see read_tile_segbits. """
+        segbits = {}
+        for block_type in self.get_segbits_block_types(tile_type):
+            segbits[block_type] = self.load_block_segbits(
+                tile_type, block_type)
+
+        return segbits, self.load_tile_ppips(tile_type)
+
+    def get_segbits_block_types(self, tile_type):
+        """ Return the block types with segbits for tile_type. """
+        return [
+            block_type for block_type in BlockType
+            if self.has_section(segbits_section(tile_type, block_type))
+        ]
+
+    def load_block_segbits(self, tile_type, block_type):
+        """ Return segbits of one block type, see read_segbits. """
+        return self.load(segbits_section(tile_type, block_type))
+
+    def load_tile_ppips(self, tile_type):
+        return self.load('tile_ppips:' + tile_type)
+
+    def load_site_type(self, site_type_name):
+        return self.load('site_type:' + site_type_name)
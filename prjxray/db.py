@@ -8,14 +8,19 @@
 # https://opensource.org/licenses/ISC
 #
 # SPDX-License-Identifier: ISC
+import functools
 import os.path
 import pathlib
 import simplejson as json
+from prjxray import bitstream
 from prjxray import grid
 from prjxray import tile
 from prjxray import tile_segbits
+from prjxray import tile_segbits_alias
 from prjxray import site_type
 from prjxray import connections
+from prjxray import compiled_db
+from prjxray.grid_types import BlockType
 from prjxray.node_model import NodeModel
 from prjxray.util import get_fabric_for_part
 
@@ -38,29 +43,55 @@ def get_available_databases(prjxray_root):
 
 
 class Database(object):
-    def __init__(self, db_root, part):
+    def __init__(self, db_root, part, snapshot=None, lazy_segbits=False):
         """ Create project x-ray Database at given db_root.
 
     db_root: Path to directory containing settings.sh, *.db, tilegrid.json and
              tileconn.json
+    snapshot: Optional compiled_db.CompiledDatabase to serve the database
+              from instead of db_root, see Database.open_compiled.
+    lazy_segbits: Only read the segbits of a block type of a tile type when
+                  they are first used, instead of all block types of the tile
+                  type at once.  Useful when only part of the frames are
+                  decoded, e.g. partial bitstreams.
 
     """
         self.db_root = db_root
         self.part = part
-        self.fabric = get_fabric_for_part(db_root, part)
+        self.snapshot = snapshot
+        self.lazy_segbits = lazy_segbits
+
+        # Number of segbits files (one per tile type and block type) read.
+        self.segbits_files_read = 0
 
         # tilegrid.json JSON object
         self.tilegrid = None
         self.tileconn = None
         self.tile_types_json = None
         self.node_wires = None
+        self._grid = None
 
         self.tile_types = {}
         self.tile_segbits = {}
+        self.tile_segbits_aliases = {}
+        self.tile_ppips = {}
         self.site_types = {}
 
         self.required_features = {}
 
+        self.tile_types_obj = {}
+
+        if self.snapshot is not None:
+            assert self.snapshot.part == self.part, (
+                self.snapshot.part, self.part)
+            self.fabric = self.snapshot.fabric
+            self.tile_types.update(self.snapshot.tile_types)
+            self.site_types.update(self.snapshot.site_types)
+            self.required_features.update(self.snapshot.required_features)
+            return
+
+        self.fabric = get_fabric_for_part(db_root, part)
+
         for f in os.listdir(self.db_root):
             if f.endswith('.json') and f.startswith('tile_type_'):
                 tile_type = f[len('tile_type_'):-len('.json')].lower()
@@ -116,7 +147,25 @@ class Database(object):
 
                 self.required_features[self.part] = set(features)
 
-        self.tile_types_obj = {}
+    @classmethod
+    def open_compiled(cls, fname, lazy_segbits=False):
+        """ Open Database from a snapshot written by compile_db.py.
+
+        Everything is served from the snapshot file, the database directory
+        is not accessed.
+
+        """
+        snapshot = compiled_db.CompiledDatabase(fname)
+        return cls(
+            snapshot.db_root,
+            snapshot.part,
+            snapshot=snapshot,
+            lazy_segbits=lazy_segbits)
+
+    def write_compiled(self, fname):
+        """ Write a snapshot of this Database that can be opened with
+        Database.open_compiled. """
+        compiled_db.write_compiled_database(self, fname)
 
     def get_tile_types(self):
         """ Return list of tile types """
@@ -125,14 +174,24 @@ class Database(object):
     def get_tile_type(self, tile_type):
         """ Return Tile object for given tilename. """
         if tile_type not in self.tile_types_obj:
+            tile_type_json = None
+            if self.snapshot is not None:
+                tile_type_json = self.snapshot.load_tile_type(tile_type)
+
             self.tile_types_obj[tile_type] = tile.Tile(
-                tile_type, self.tile_types[tile_type])
+                tile_type,
+                self.tile_types[tile_type],
+                tile_type_json=tile_type_json)
 
         return self.tile_types_obj[tile_type]
 
     def _read_tilegrid(self):
         """ Read tilegrid database if not already read. """
         if not self.tilegrid:
+            if self.snapshot is not None:
+                self.tilegrid = self.snapshot.load('tilegrid')
+                return
+
             with open(os.path.join(self.db_root, self.fabric,
                                    'tilegrid.json')) as f:
                 self.tilegrid = json.load(f)
@@ -140,6 +199,10 @@ class Database(object):
     def _read_tileconn(self):
         """ Read tileconn database if not already read. """
         if not self.tileconn:
+            if self.snapshot is not None:
+                self.tileconn = self.snapshot.load('tileconn')
+                return
+
             with open(os.path.join(self.db_root, self.fabric,
                                    'tileconn.json')) as f:
                 self.tileconn = json.load(f)
@@ -147,19 +210,60 @@ class Database(object):
     def _read_node_wires(self):
         """ Read node wires if not already read. """
         if self.node_wires is None:
+            if self.snapshot is not None:
+                self.node_wires = self.snapshot.load('node_wires')
+                return
+
             with open(os.path.join(self.db_root, self.fabric,
                                    'node_wires.json')) as f:
                 self.node_wires = json.load(f)
 
     def grid(self):
-        """ Return Grid object for database. """
-        self._read_tilegrid()
-        return grid.Grid(self, self.tilegrid)
+        """ Return Grid object for database.
+
+        The Grid is built on the first call and shared by every later caller,
+        so it must not be modified.
+
+        """
+        if self._grid is None:
+            if self.snapshot is not None:
+                self._grid = self.snapshot.load('grid')
+                self._grid.db = self
+            else:
+                self._read_tilegrid()
+                self._grid = grid.Grid(self, self.tilegrid)
+
+        return self._grid
+
+    def get_part(self):
+        """ Return bitstream.Part read from the part.json of the part.
+
+        Raises bitstream.PartDataError if part.json lacks the configuration
+        frame data, e.g. when only the fabric database was generated.
+
+        """
+        if self.snapshot is None:
+            return bitstream.read_part(self.db_root, self.part)
+
+        if not self.snapshot.has_section('part_json'):
+            raise bitstream.PartDataError(
+                '{} has no part.json'.format(self.snapshot.fname))
+
+        try:
+            return bitstream.Part.from_json(self.snapshot.load('part_json'))
+        except bitstream.PartDataError as e:
+            raise bitstream.PartDataError(
+                '{}: {}'.format(self.snapshot.fname, e))
 
     def _read_tile_types(self):
         if self.tile_types_json is None:
             self.tile_types_json = {}
             for tile_type, db in self.tile_types.items():
+                if self.snapshot is not None:
+                    self.tile_types_json[
+                        tile_type] = self.snapshot.load_tile_type(tile_type)
+                    continue
+
                 with open(db.tile_type) as f:
                     self.tile_types_json[tile_type] = json.load(f)
 
@@ -207,18 +311,103 @@ class Database(object):
         return self.site_types.keys()
 
     def get_site_type(self, site_type_name):
-        with open(self.site_types[site_type_name]) as f:
-            site_type_data = json.load(f)
+        if self.snapshot is not None:
+            site_type_data = self.snapshot.load_site_type(site_type_name)
+        else:
+            with open(self.site_types[site_type_name]) as f:
+                site_type_data = json.load(f)
 
         return site_type.SiteType(site_type_data)
 
+    def _read_block_segbits(self, tile_type, block_type):
+        """ Read the segbits of one block type of tile_type. """
+        self.segbits_files_read += 1
+
+        if self.snapshot is not None:
+            return self.snapshot.load_block_segbits(tile_type, block_type)
+
+        tile_db = self.tile_types[tile_type]
+        if block_type == BlockType.CLB_IO_CLK:
+            fname = tile_db.segbits
+        else:
+            assert block_type == BlockType.BLOCK_RAM, block_type
+            fname = tile_db.block_ram_segbits
+
+        with open(fname) as f:
+            return tile_segbits.read_segbits(f)
+
+    def _lazy_tile_segbits(self, tile_type):
+        """ Return (LazySegbits, ppips) of tile_type. """
+        if self.snapshot is not None:
+            block_types = self.snapshot.get_segbits_block_types(tile_type)
+        else:
+            tile_db = self.tile_types[tile_type]
+            block_types = []
+            if tile_db.segbits is not None:
+                block_types.append(BlockType.CLB_IO_CLK)
+            if tile_db.block_ram_segbits is not None:
+                block_types.append(BlockType.BLOCK_RAM)
+
+        loaders = {}
+        for block_type in block_types:
+            loaders[block_type] = functools.partial(
+                self._read_block_segbits, tile_type, block_type)
+
+        return (
+            tile_segbits.LazySegbits(loaders), self.get_tile_ppips(tile_type))
+
     def get_tile_segbits(self, tile_type):
         if tile_type not in self.tile_segbits:
+            if self.lazy_segbits:
+                parsed = self._lazy_tile_segbits(tile_type.upper())
+            elif self.snapshot is not None:
+                parsed = self.snapshot.load_tile_segbits(tile_type.upper())
+            else:
+                parsed = tile_segbits.read_tile_segbits(
+                    self.tile_types[tile_type.upper()])
+
+            if not self.lazy_segbits:
+                self.segbits_files_read += len(parsed[0])
+
             self.tile_segbits[tile_type] = tile_segbits.TileSegbits(
-                self.tile_types[tile_type.upper()])
+                self.tile_types[tile_type.upper()], parsed=parsed)
 
         return self.tile_segbits[tile_type]
 
+    def get_tile_ppips(self, tile_type):
+        """ Return ppips of tile_type, see tile_segbits.read_ppips. """
+        if tile_type not in self.tile_ppips:
+            if self.snapshot is not None:
+                ppips = self.snapshot.load_tile_ppips(tile_type)
+            else:
+                ppips = {}
+                tile_db = self.tile_types[tile_type]
+                if tile_db.ppips is not None:
+                    with open(tile_db.ppips) as f:
+                        ppips = tile_segbits.read_ppips(f)
+
+            self.tile_ppips[tile_type] = ppips
+
+        return self.tile_ppips[tile_type]
+
+    def get_tile_segbits_alias(self, tile_type, bits_map):
+        """ Return TileSegbitsAlias for a tile of tile_type with aliased bits.
+
+        bits_map: BlockType -> grid.Bits map of the tile.
+
+        Tiles with the same tile type, alias tile type, start offsets, word
+        counts and site map share one TileSegbitsAlias.
+
+        """
+        key = tile_segbits_alias.alias_key(tile_type, bits_map)
+
+        if key not in self.tile_segbits_aliases:
+            alias = tile_segbits_alias.TileSegbitsAlias(
+                self, tile_type, bits_map)
+            self.tile_segbits_aliases[key] = alias
+
+        return self.tile_segbits_aliases[key]
+
     def get_required_fasm_features(self, part=None):
         """
         Assembles a set of required fasm features for given part. Returns a list
@@ -8,8 +8,19 @@
 # https://opensource.org/licenses/ISC
 #
 # SPDX-License-Identifier: ISC
+import collections
+import copy
+import hashlib
+import itertools
+import multiprocessing
+import os
+import pickle
+import zlib
+
 import fasm
+import numpy as np
 from prjxray import bitstream
+from prjxray import tile_segbits_alias
 
 
 class FasmLookupError(Exception):
@@ -20,134 +31,423 @@ class FasmInconsistentBits(Exception):
     pass
 
 
-def init_frame_at_address(frames, addr):
-    '''Set given frame to 0 if not initialized '''
-    if not addr in frames:
-        frames[addr] = [0 for _i in range(bitstream.FRAME_WORD_COUNT)]
+def database_signature(db):
+    """ Return value that changes when the segbits of db change.
+
+    Used to invalidate a persisted FeatureBitsCache.  Hashes the name, size
+    and mtime_ns of the tilegrid and segbits files, or of the compiled
+    database snapshot.
+
+    """
+    if db.snapshot is not None:
+        fnames = [db.snapshot.fname]
+    else:
+        fnames = [os.path.join(db.db_root, db.fabric, 'tilegrid.json')]
+        for tile_dbs in db.tile_types.values():
+            fnames.extend(
+                fname for fname in (
+                    tile_dbs.segbits, tile_dbs.block_ram_segbits,
+                    tile_dbs.ppips) if fname is not None)
+
+    files_hash = hashlib.sha1()
+    for fname in sorted(fnames):
+        stat = os.stat(fname)
+        files_hash.update(
+            '{} {} {}\n'.format(fname, stat.st_size,
+                                stat.st_mtime_ns).encode('utf-8'))
+
+    return (FeatureBitsCache.VERSION, db.part, files_hash.hexdigest())
+
+
+class FeatureBitsCache(object):
+    """ Cache of the bits of each feature of each tile type.
+
+    Bits are stored relative to the tile, grouped by word as tuples of
+    (block_type, word_column, word_index, set_mask, clear_mask), so one table
+    serves every tile of a tile type.  Aliased tiles get one table per alias,
+    see tile_segbits_alias.alias_key.
+
+    Tables are built lazily from TileSegbits.feature_to_bits and at most
+    max_tables are kept, least recently used first out.  When the cache is
+    persisted (see load and save), evicted tables are kept for saving.
+
+    """
+
+    VERSION = 2
+
+    def __init__(self, max_tables=256):
+        self.max_tables = max_tables
+        self.tables = collections.OrderedDict()
+
+        # Tables loaded or evicted, that are not in self.tables.
+        self.stored_tables = None
+
+    def get_table(self, key):
+        table = self.tables.get(key)
+        if table is not None:
+            self.tables.move_to_end(key)
+            return table
+
+        table = {}
+        if self.stored_tables is not None and key in self.stored_tables:
+            table = self.stored_tables.pop(key)
+
+        self.tables[key] = table
+        if len(self.tables) > self.max_tables:
+            old_key, old_table = self.tables.popitem(last=False)
+            if self.stored_tables is not None:
+                self.stored_tables[old_key] = old_table
+
+        return table
+
+    def get_feature_bits(self, segbits, bits_map, db_k, address):
+        """ Return relative bits of feature db_k[address], in segbits order.
+
+        segbits: TileSegbits or TileSegbitsAlias of the tile.
+        bits_map: BlockType -> grid.Bits of the tile.
+
+        Returns tuples of (block_type, word_column, word_bit, isset).  Not
+        cached, see get_feature_words.
+
+        Raises KeyError if the feature is unknown.
+
+        """
+        # Bits are linear in the tile base address and offset, so mapping
+        # against a tile at address 0 gives the relative bits.
+        zero_bits_map = {}
+        for block_type, bits in bits_map.items():
+            zero_bits_map[block_type] = bits._replace(base_address=0, offset=0)
+
+        return tuple(
+            (block_type, bit.word_column, bit.word_bit, bit.isset)
+            for block_type, bit in segbits.feature_to_bits(
+                zero_bits_map, db_k, address))
+
+    def get_feature_words(self, key, segbits, bits_map, db_k, address):
+        """ Return relative bits of feature db_k[address], grouped by word.
+
+        key: Table key of the tile, see FasmAssembler.get_table_key.
+
+        Returns tuples of (block_type, word_column, word_index, set_mask,
+        clear_mask).  A bit in both masks means the feature itself is
+        inconsistent.
+
+        Raises KeyError if the feature is unknown.
+
+        """
+        table = self.get_table(key)
+        feature_words = table.get((db_k, address))
+        if feature_words is None:
+            feature_bits = self.get_feature_bits(
+                segbits, bits_map, db_k, address)
+
+            words = collections.OrderedDict()
+            for block_type, word_column, word_bit, isset in feature_bits:
+                word_key = (
+                    block_type, word_column,
+                    word_bit // bitstream.WORD_SIZE_BITS)
+                set_mask, clear_mask = words.get(word_key, (0, 0))
+                mask = 1 << (word_bit % bitstream.WORD_SIZE_BITS)
+                if isset:
+                    set_mask |= mask
+                else:
+                    clear_mask |= mask
+                words[word_key] = (set_mask, clear_mask)
+
+            feature_words = tuple(
+                word_key + masks for word_key, masks in words.items())
+            table[(db_k, address)] = feature_words
+
+        return feature_words
+
+    def load(self, fname, signature):
+        """ Load tables saved by save, if fname exists and matches signature.
+        """
+        self.stored_tables = {}
+
+        if not os.path.exists(fname):
+            return
+
+        with open(fname, 'rb') as f:
+            stored = pickle.load(f)
+
+        if stored['signature'] == signature:
+            self.stored_tables = stored['tables']
+
+    def save(self, fname, signature):
+        """ Save all tables to fname.
+
+        The file is replaced atomically, so concurrent runs sharing fname
+        always see a complete file.
+
+        """
+        tables = dict(self.stored_tables or {})
+        tables.update(self.tables)
+
+        tmp_fname = '{}.{}.tmp'.format(fname, os.getpid())
+        with open(tmp_fname, 'wb') as f:
+            pickle.dump(
+                {
+                    'signature': signature,
+                    'tables': tables,
+                },
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_fname, fname)
+
+
+def fasm_line_string(line):
+    """ Return the FASM text of FasmLine line, used in error messages. """
+    line_strs = tuple(fasm.fasm_line_to_string(line))
+    assert len(line_strs) == 1
+    return line_strs[0]
+
+
+# State shared with forked shard workers, see FasmAssembler.parse_fasm_lines.
+_SHARD_ASSEMBLER = None
+_SHARD_LINES = None
+
+
+def _assemble_shard(shard_idx):
+    """ Assemble one shard of lines in a forked worker process. """
+    return _SHARD_ASSEMBLER.assemble_shard(_SHARD_LINES[shard_idx])
 
 
 class FasmAssembler(object):
-    def __init__(self, db):
+    def __init__(self, db, feature_bits=None):
         self.db = db
         self.grid = db.grid()
 
+        if feature_bits is None:
+            feature_bits = FeatureBitsCache()
+
+        self.feature_bits = feature_bits
+
+        # Tile name -> FeatureBitsCache table key
+        self.table_keys = {}
+
+        self.init_frame_state()
+
+        self.feature_callback = lambda feature: None
+
+    def init_frame_state(self):
+        '''Forget all frames, bits and lines assembled so far'''
         self.seen_tile = set()
         self.frames_in_use = set()
 
+        # Frame address -> uint32 array of bit values, one entry per word.
         self.frames = {}
-        self.frames_line = {}
 
-        self.feature_callback = lambda feature: None
+        # Frame address -> uint32 array of bits set or cleared by a FASM line.
+        self.frames_written = {}
+
+        # (tile, feature, address, line) of each feature enabled, in order.
+        # Which line wrote a bit is only looked up to report inconsistent
+        # bits, see find_bit_line.
+        self.enabled_features = []
 
     def set_feature_callback(self, feature_callback):
         self.feature_callback = feature_callback
 
     def get_frames(self, sparse=False):
+        """ Return map of frame address to array of FRAME_WORD_COUNT words.
+
+        All frames share one backing array, each value is a view of one row.
+
+        """
         if not sparse:
-            frames = self.frames_init()
+            addresses = self.frames_init()
         else:
             # Even in sparse mode, zero all frames for any tile that is
             # setting a bit.  This handles the case where the tile has
             # multiple frames, but the FASM only specifies some of the frames.
-            frames = {}
-            for frame in self.frames_in_use:
-                init_frame_at_address(frames, frame)
+            addresses = set(self.frames_in_use)
 
-        for (frame_addr, word_addr, bit_index), is_set in self.frames.items():
-            init_frame_at_address(frames, frame_addr)
+        addresses |= self.frames.keys()
+        addresses = sorted(addresses)
 
-            if is_set:
-                frames[frame_addr][word_addr] |= 1 << bit_index
+        data = np.zeros(
+            (len(addresses), bitstream.FRAME_WORD_COUNT), dtype=np.uint32)
+
+        frames = {}
+        for row, frame_addr in enumerate(addresses):
+            frames[frame_addr] = data[row]
+
+            if frame_addr in self.frames:
+                data[row] = self.frames[frame_addr]
 
         return frames
 
     def frames_init(self):
-        '''Set all frames to 0'''
-        frames = {}
+        '''Return the set of all frame addresses used by the grid'''
+        addresses = set()
 
         for bits_info in self.grid.iter_all_frames():
-            for coli in range(bits_info.bits.frames):
-                init_frame_at_address(
-                    frames, bits_info.bits.base_address + coli)
+            base_address = bits_info.bits.base_address
+            addresses.update(
+                range(base_address, base_address + bits_info.bits.frames))
+
+        return addresses
+
+    def init_frame(self, frame_addr):
+        '''Allocate the bitmaps for given frame address if needed'''
+        if frame_addr not in self.frames:
+            self.frames[frame_addr] = np.zeros(
+                bitstream.FRAME_WORD_COUNT, dtype=np.uint32)
+            self.frames_written[frame_addr] = np.zeros(
+                bitstream.FRAME_WORD_COUNT, dtype=np.uint32)
+
+    def get_table_key(self, tile, gridinfo):
+        '''Return FeatureBitsCache table key for tile'''
+        key = self.table_keys.get(tile)
+        if key is None:
+            key = gridinfo.tile_type
+            for bits in gridinfo.bits.values():
+                if bits.alias is not None:
+                    key = tile_segbits_alias.alias_key(
+                        gridinfo.tile_type, gridinfo.bits)
+                    break
+
+            self.table_keys[tile] = key
+
+        return key
+
+    def get_feature_words(self, tile, feature, address):
+        '''Return the words written by a feature of tile
+
+        Returns tuples of (block_type, frame_addr, word_addr, set_mask,
+        clear_mask).  Raises KeyError if the feature is unknown.
+
+        '''
+        gridinfo = self.grid.gridinfo_at_tilename(tile)
+        db_k = '%s.%s' % (gridinfo.tile_type, feature)
 
-        return frames
+        feature_words = self.feature_bits.get_feature_words(
+            self.get_table_key(tile, gridinfo),
+            self.grid.get_tile_segbits_at_tilename(tile), gridinfo.bits, db_k,
+            address)
 
-    def frame_set(self, frame_addr, word_addr, bit_index, line):
-        '''Set given bit in given frame address and word'''
-        assert bit_index is not None
+        words = []
+        for block_type, word_column, word_index, set_mask, clear_mask in (
+                feature_words):
+            bits = gridinfo.bits[block_type]
+            words.append(
+                (
+                    block_type, bits.base_address + word_column,
+                    bits.offset + word_index, set_mask, clear_mask))
 
-        key = (frame_addr, word_addr, bit_index)
-        if key in self.frames:
-            if self.frames[key] != 1:
-                raise FasmInconsistentBits(
-                    'FASM line "{}" wanted to set bit {} but was cleared by FASM line "{}"'
-                    .format(
-                        line,
-                        key,
-                        self.frames_line[key],
-                    ))
-            return
+        return words
+
+    def find_bit_line(self, frame_addr, word_addr, bit_index):
+        '''Return the first FASM line that set or cleared given bit
+
+        Replays the enabled features, so is only used to report errors.
+
+        '''
+        mask = 1 << bit_index
+        for tile, feature, address, line in self.enabled_features:
+            for _, word_frame, word, set_mask, clear_mask in (
+                    self.get_feature_words(tile, feature, address)):
+                if word_frame == frame_addr and word == word_addr and (
+                        set_mask | clear_mask) & mask:
+                    return line
 
-        self.frames[key] = 1
-        self.frames_line[key] = line
+        return None
 
-    def frame_clear(self, frame_addr, word_addr, bit_index, line):
-        '''Set given bit in given frame address and word'''
-        assert bit_index is not None
+    def raise_inconsistent_bits(self, tile, feature, address, line):
+        '''Raise FasmInconsistentBits for the first inconsistent bit of feature
+
+        Bits are checked in segbits order, as if set or cleared one by one.
+
+        '''
+        gridinfo = self.grid.gridinfo_at_tilename(tile)
+        db_k = '%s.%s' % (gridinfo.tile_type, feature)
 
-        key = (frame_addr, word_addr, bit_index)
-        if key in self.frames:
-            if self.frames[key] != 0:
+        feature_bits = self.feature_bits.get_feature_bits(
+            self.grid.get_tile_segbits_at_tilename(tile), gridinfo.bits, db_k,
+            address)
+
+        # Bits already set or cleared by this feature.
+        written = {}
+        for block_type, word_column, word_bit, is_set in feature_bits:
+            bits = gridinfo.bits[block_type]
+            word_bit += bits.offset * bitstream.WORD_SIZE_BITS
+            frame_addr = bits.base_address + word_column
+            word_addr = word_bit // bitstream.WORD_SIZE_BITS
+            bit_index = word_bit % bitstream.WORD_SIZE_BITS
+            key = (frame_addr, word_addr, bit_index)
+
+            if key in written:
+                was_set = written[key]
+                other_line = line
+            elif frame_addr in self.frames_written and (
+                    int(self.frames_written[frame_addr][word_addr]) >>
+                    bit_index & 1):
+                was_set = bool(
+                    int(self.frames[frame_addr][word_addr]) >> bit_index & 1)
+                other_line = self.find_bit_line(*key)
+            else:
+                written[key] = is_set
+                continue
+
+            if was_set != is_set:
                 raise FasmInconsistentBits(
-                    'FASM line "{}" wanted to clear bit {} but was set by FASM line "{}"'
+                    'FASM line "{}" wanted to {} bit {} but was {} by FASM line "{}"'
                     .format(
                         line,
+                        'set' if is_set else 'clear',
                         key,
-                        self.frames_line[key],
+                        'set' if was_set else 'cleared',
+                        other_line,
                     ))
-            return
 
-        self.frames[key] = 0
-        self.frames_line[key] = line
+        assert False, (tile, feature, address)
 
     def enable_feature(self, tile, feature, address, line):
         gridinfo = self.grid.gridinfo_at_tilename(tile)
 
-        def update_segbit(bit):
-            '''Set or clear a single bit in a segment at the given word column and word bit position'''
-
-            frame_addr = bit.word_column
-            word_addr = bit.word_bit // bitstream.WORD_SIZE_BITS
-            bit_index = bit.word_bit % bitstream.WORD_SIZE_BITS
-            if bit.isset:
-                self.frame_set(frame_addr, word_addr, bit_index, line)
-            else:
-                self.frame_clear(frame_addr, word_addr, bit_index, line)
-
-        segbits = self.grid.get_tile_segbits_at_tilename(tile)
-
         self.seen_tile.add(tile)
 
         db_k = '%s.%s' % (gridinfo.tile_type, feature)
 
-        any_bits = set()
-
         try:
-            for block_type, bit in segbits.feature_to_bits(gridinfo.bits, db_k,
-                                                           address):
-                any_bits.add(block_type)
-                update_segbit(bit)
+            feature_words = self.get_feature_words(tile, feature, address)
         except KeyError:
             raise FasmLookupError(
                 "Segment DB %s, key %s not found from line '%s'" %
                 (gridinfo.tile_type, db_k, line))
 
+        # Check all words before updating any, one batch per feature.
+        for _, frame_addr, word_addr, set_mask, clear_mask in feature_words:
+            if set_mask & clear_mask:
+                self.raise_inconsistent_bits(tile, feature, address, line)
+
+            if frame_addr not in self.frames_written:
+                continue
+
+            overlap = int(self.frames_written[frame_addr][word_addr]) & (
+                set_mask | clear_mask)
+            if overlap & (int(self.frames[frame_addr][word_addr]) ^ set_mask):
+                self.raise_inconsistent_bits(tile, feature, address, line)
+
+        any_bits = set()
+        for block_type, frame_addr, word_addr, set_mask, clear_mask in (
+                feature_words):
+            any_bits.add(block_type)
+
+            self.init_frame(frame_addr)
+            self.frames_written[frame_addr][word_addr] |= set_mask | clear_mask
+            if set_mask:
+                self.frames[frame_addr][word_addr] |= set_mask
+
+        self.enabled_features.append((tile, feature, address, line))
+
         for block_type in any_bits:
             # Mark all frames used by this tile as in use.
             bits = gridinfo.bits[block_type]
-            for frame in range(bits.base_address,
-                               bits.base_address + bits.frames):
-                self.frames_in_use.add(frame)
+            self.frames_in_use.update(
+                range(bits.base_address, bits.base_address + bits.frames))
 
     def add_fasm_line(self, line, missing_features):
         if not line.set_feature:
@@ -155,9 +455,7 @@ class FasmAssembler(object):
 
         self.feature_callback(line.set_feature)
 
-        line_strs = tuple(fasm.fasm_line_to_string(line))
-        assert len(line_strs) == 1
-        line_str = line_strs[0]
+        line_str = fasm_line_string(line)
 
         parts = line.set_feature.feature.split('.')
         tile = parts[0]
@@ -178,17 +476,181 @@ class FasmAssembler(object):
             except FasmLookupError as e:
                 missing_features.append(str(e))
 
-    def parse_fasm_filename(self, filename, extra_features=[]):
-        missing_features = []
-        for line in fasm.parse_fasm_filename(filename):
-            self.add_fasm_line(line, missing_features)
+    def parse_fasm_filename(self, filename, extra_features=[], jobs=1):
+        lines = itertools.chain(
+            fasm.parse_fasm_filename(filename), extra_features)
 
-        for line in extra_features:
+        if jobs > 1:
+            self.parse_fasm_lines(lines, jobs)
+            return
+
+        missing_features = []
+        for line in lines:
             self.add_fasm_line(line, missing_features)
 
         if missing_features:
             raise FasmLookupError('\n'.join(missing_features))
 
+    def assemble_shard(self, lines):
+        '''Assemble (line index, FasmLine) tuples into a new frame state.
+
+        Returns a picklable tuple (enabled_features, frames, seen_tile,
+        frames_in_use, missing_features, conflict), see merge_shard.
+
+        '''
+        shard = copy.copy(self)
+        shard.init_frame_state()
+        shard.feature_callback = lambda feature: None
+
+        enabled_features = []
+        missing_features = []
+        conflict = False
+        for line_idx, line in lines:
+            line_missing_features = []
+            try:
+                shard.add_fasm_line(line, line_missing_features)
+            except FasmInconsistentBits:
+                conflict = True
+                break
+
+            for missing_feature in line_missing_features:
+                missing_features.append((line_idx, missing_feature))
+
+            line_features = shard.enabled_features[len(enabled_features):]
+            enabled_features.extend(
+                (line_idx, enabled_feature)
+                for enabled_feature in line_features)
+
+        frames = {}
+        for frame_addr, written in shard.frames_written.items():
+            frames[frame_addr] = (shard.frames[frame_addr], written)
+
+        return (
+            enabled_features, frames, shard.seen_tile, shard.frames_in_use,
+            missing_features, conflict)
+
+    def parse_fasm_lines(self, lines, jobs):
+        '''Assemble FasmLine's using a pool of jobs worker processes.
+
+        Lines are sharded by tile, each shard is assembled in a forked worker
+        and the resulting frame bitmaps are merged.  Any bit written with
+        different values, in one shard or across shards, makes the lines
+        replay serially so the FasmInconsistentBits error is the one serial
+        assembly reports.  Missing features are reported in line order.
+
+        '''
+        global _SHARD_ASSEMBLER, _SHARD_LINES
+
+        lines = list(lines)
+        shards = [[] for _ in range(jobs)]
+        for line_idx, line in enumerate(lines):
+            if not line.set_feature:
+                continue
+
+            self.feature_callback(line.set_feature)
+
+            tile = line.set_feature.feature.split('.')[0]
+            shard_idx = zlib.crc32(tile.encode('utf-8')) % jobs
+            shards[shard_idx].append((line_idx, line))
+
+        _SHARD_ASSEMBLER = self
+        _SHARD_LINES = shards
+        try:
+            with multiprocessing.get_context('fork').Pool(jobs) as pool:
+                results = pool.map(_assemble_shard, range(jobs))
+        finally:
+            _SHARD_ASSEMBLER = None
+            _SHARD_LINES = None
+
+        merged = {}
+        conflict = [
+            'shard {} set and cleared a bit'.format(shard_idx)
+            for shard_idx, result in enumerate(results)
+            if result[-1]
+        ]
+        if not conflict:
+            for shard_idx, result in enumerate(results):
+                frame_addr = self.merge_shard(merged, result)
+                if frame_addr is not None:
+                    conflict.append(
+                        'shard {} disagrees on frame {:#010x}'.format(
+                            shard_idx, frame_addr))
+                    break
+
+        if conflict:
+            feature_callback = self.feature_callback
+            self.feature_callback = lambda feature: None
+            try:
+                missing_features = []
+                for line in lines:
+                    self.add_fasm_line(line, missing_features)
+            finally:
+                self.feature_callback = feature_callback
+
+            raise RuntimeError(
+                'Serial replay of {} shards did not reproduce bit conflict: {}'
+                .format(jobs, ', '.join(conflict)))
+
+        for frame_addr, (values, written) in merged.items():
+            self.frames[frame_addr] = values
+            self.frames_written[frame_addr] = written
+
+        # Features in line order, as serial assembly enables them, so
+        # find_bit_line finds the same line.
+        enabled_features = []
+        missing_features = []
+        for result in results:
+            shard_enabled, _, seen_tile, frames_in_use, shard_missing, _ = (
+                result)
+            enabled_features.extend(shard_enabled)
+            self.seen_tile |= seen_tile
+            self.frames_in_use |= frames_in_use
+            missing_features.extend(shard_missing)
+
+        enabled_features.sort(key=lambda enabled: enabled[0])
+        self.enabled_features.extend(
+            enabled_feature for _, enabled_feature in enabled_features)
+
+        if missing_features:
+            missing_features.sort(key=lambda missing: missing[0])
+            raise FasmLookupError(
+                '\n'.join(
+                    missing_feature
+                    for _, missing_feature in missing_features))
+
+    def merge_shard(self, merged, result):
+        '''Merge shard result from assemble_shard into merged.
+
+        merged is a map of frame address to (values, written), initialized
+        from this assembler for frames not yet merged.
+
+        Returns the address of the first frame where a bit was written with
+        different values, or None.
+
+        '''
+        _, frames, _, _, _, _ = result
+
+        for frame_addr, (values, written) in frames.items():
+            if frame_addr not in merged:
+                if frame_addr in self.frames:
+                    merged[frame_addr] = (
+                        self.frames[frame_addr].copy(),
+                        self.frames_written[frame_addr].copy())
+                else:
+                    merged[frame_addr] = (
+                        np.zeros_like(values), np.zeros_like(written))
+
+            merged_values, merged_written = merged[frame_addr]
+
+            overlap = merged_written & written
+            if np.any((merged_values ^ values) & overlap):
+                return frame_addr
+
+            merged_values |= values
+            merged_written |= written
+
+        return None
+
     def mark_roi_frames(self, roi):
         for tile in roi.gen_tiles():
             gridinfo = self.grid.gridinfo_at_tilename(tile)
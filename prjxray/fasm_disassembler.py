@@ -8,9 +8,18 @@
 # https://opensource.org/licenses/ISC
 #
 # SPDX-License-Identifier: ISC
+from collections import namedtuple
+import functools
+import multiprocessing
 import re
 import fasm
+import numpy as np
 from prjxray import bitstream
+from prjxray.tile_segbits_alias import alias_key
+
+# Frame address bits above the column and minor address, i.e. block type,
+# top/bottom and row.
+FRAME_ROW_SHIFT = 17
 
 
 def mk_fasm(tile_name, feature):
@@ -38,6 +47,173 @@ def mk_fasm(tile_name, feature):
         comment=None)
 
 
+def mk_unknown_bits(frame, remaining_bits):
+    """ Yield FasmLine tuples for bits of frame that were not decoded. """
+    yield fasm.FasmLine(
+        set_feature=None,
+        annotations=None,
+        comment=" In frame 0x{:08x} {} bits were not converted.".format(
+            frame,
+            len(remaining_bits),
+        ))
+
+    for bit in sorted(remaining_bits):
+        frame_offset = frame % bitstream.FRAME_ALIGNMENT
+        aligned_frame = frame - frame_offset
+        wordidx = bit // bitstream.WORD_SIZE_BITS
+        bitidx = bit % bitstream.WORD_SIZE_BITS
+
+        annotations = []
+        annotations.append(
+            fasm.Annotation(
+                'unknown_bit', '{:08x}_{}_{}'.format(frame, wordidx, bitidx)))
+        annotations.append(
+            fasm.Annotation(
+                'unknown_segment', '0x{:08x}'.format(aligned_frame)))
+        annotations.append(
+            fasm.Annotation(
+                'unknown_segbit', '{:02d}_{:02d}'.format(frame_offset, bit)))
+        yield fasm.FasmLine(
+            set_feature=None,
+            annotations=tuple(annotations),
+            comment=None,
+        )
+
+
+# Tiles of one tile type sharing segbits and Bits layout for one block type,
+# see MatrixFasmDisassembler.
+#
+# tiles: List of tile names.
+# base_addresses, offsets: Arrays of Bits.base_address and Bits.offset of each
+#                          tile.
+TileGroup = namedtuple(
+    'TileGroup', 'block_type frames words tiles base_addresses offsets')
+
+
+class FrameArray(object):
+    """ bitdata as a dense array of frame words.
+
+    words has one row per frame of bitdata, in frame address order, plus one
+    final all zero row that frames not in bitdata map to.  A BitdataView is
+    read from its FrameBits columns.
+
+    """
+
+    def __init__(self, bitdata):
+        if isinstance(bitdata, bitstream.BitdataView):
+            frame_bits = bitdata.frame_bits
+            self.addresses = frame_bits.frames
+            rows = np.repeat(
+                np.arange(len(frame_bits.frames)), np.diff(frame_bits.starts))
+            bits = frame_bits.bits.astype(np.int64)
+        else:
+            self.addresses, rows, bits = self.bitdata_columns(bitdata)
+
+        word_count = bitstream.FRAME_WORD_COUNT
+        if len(bits):
+            word_count = max(
+                word_count,
+                int(bits.max()) // bitstream.WORD_SIZE_BITS + 1)
+
+        self.words = np.zeros(
+            (len(self.addresses) + 1, word_count), dtype=np.uint32)
+        np.bitwise_or.at(
+            self.words, (rows, bits // bitstream.WORD_SIZE_BITS),
+            np.left_shift(1, bits % bitstream.WORD_SIZE_BITS).astype(
+                np.uint32))
+
+        # Number of non-zero words before each word of each frame.
+        self.words_set = np.zeros(
+            (len(self.addresses) + 1, word_count + 1), dtype=np.int32)
+        np.cumsum(self.words != 0, axis=1, out=self.words_set[:, 1:])
+
+    @staticmethod
+    def bitdata_columns(bitdata):
+        """ Return (addresses, row of each bit, bit index) arrays of bitdata.
+        """
+        addresses = np.array(sorted(bitdata), dtype=np.int64)
+
+        rows = []
+        bits = []
+        for row, frame in enumerate(addresses.tolist()):
+            frame_bits = bitdata[frame][1]
+            rows.append(np.full(len(frame_bits), row, dtype=np.int64))
+            bits.append(
+                np.fromiter(frame_bits, dtype=np.int64, count=len(frame_bits)))
+
+        rows = np.concatenate(rows) if rows else np.zeros(0, np.int64)
+        bits = np.concatenate(bits) if bits else np.zeros(0, np.int64)
+        return addresses, rows, bits
+
+    def rows(self, frames):
+        """ Return the row of words for each frame address in frames. """
+        pos = np.searchsorted(self.addresses, frames)
+        pos[pos == len(self.addresses)] = 0
+        found = self.addresses[pos] == frames
+        return np.where(found, pos, len(self.addresses))
+
+    def bits(self, rows, word_bits, offsets):
+        """ Return the 0/1 values of bits at word_bits in rows.
+
+        offsets: Word offset added to the word of each bit.
+
+        """
+        words = offsets + word_bits // bitstream.WORD_SIZE_BITS
+        valid = (words >= 0) & (words < self.words.shape[1])
+        words = np.where(valid, words, 0)
+
+        values = np.right_shift(
+            self.words[rows, words], word_bits % bitstream.WORD_SIZE_BITS) & 1
+        values[~valid] = 0
+        return values
+
+
+def partition_frames(bitdata, jobs):
+    """ Split the frames of bitdata into at most jobs lists of frames.
+
+    Frames are grouped by configuration row (block type, top/bottom and row
+    of the frame address), as the frames of a tile are all in one row.  Rows
+    are assigned to the partition with the fewest bits set so far, largest
+    first.  Each partition is sorted by frame address.
+
+    """
+    rows = {}
+    for frame, (_, bits) in bitdata.items():
+        row = frame >> FRAME_ROW_SHIFT
+        if row not in rows:
+            rows[row] = [[], 0]
+
+        rows[row][0].append(frame)
+        rows[row][1] += len(bits)
+
+    partitions = [[[], 0] for _ in range(min(jobs, len(rows)))]
+    for row in sorted(rows, key=lambda row: (-rows[row][1], row)):
+        frames, bit_count = rows[row]
+        partition = min(partitions, key=lambda partition: partition[1])
+        partition[0].extend(frames)
+        partition[1] += bit_count
+
+    return [sorted(frames) for frames, _ in partitions if frames]
+
+
+# State shared with forked partition workers, see
+# FasmDisassembler.find_features_in_partitions.
+_PARTITION_DISASSEMBLER = None
+_PARTITION_BITDATA = None
+_PARTITIONS = None
+
+
+def _disassemble_partition(partition_idx, verbose):
+    """ Decode one partition of frames in a forked worker process. """
+    frame_lines = _PARTITION_DISASSEMBLER.find_features_in_frames(
+        _PARTITION_BITDATA, _PARTITIONS[partition_idx], verbose=verbose)
+
+    # Only send frames with output back.
+    return [
+        (frame, fasm_lines) for frame, fasm_lines in frame_lines if fasm_lines
+    ]
+
+
 class FasmDisassembler(object):
     """ Given a Project X-ray data, outputs FasmLine tuples for bits set. """
 
@@ -47,6 +223,11 @@ class FasmDisassembler(object):
         self.segment_map = self.grid.get_segment_map()
         self.decode_warnings = set()
 
+        # Tile -> zero table key, and key -> feature -> is zero, see
+        # is_zero_feature.
+        self.zero_table_keys = {}
+        self.zero_tables = {}
+
     def find_features_in_tile(
             self,
             tile_name,
@@ -94,22 +275,26 @@ class FasmDisassembler(object):
 
             yield mk_fasm(tile_name=tile_name, feature=feature)
 
-    def find_features_in_bitstream(self, bitdata, verbose=False):
-        solved_bitdata = {}
-        frames = set(bitdata.keys())
-        tiles_checked = set()
+    def iter_frame_tiles(self, bitdata, frames):
+        """ Yield (frame, list of BitsInfo) for each frame in frames.
 
-        emitted_features = set()
+        The BitsInfo are the tile blocks first found to have data in the
+        frame, in segment map order, i.e. the tile blocks
+        find_features_in_frames decodes at the frame.
 
-        while len(frames) > 0:
-            frame = frames.pop()
+        """
+        frame_segments = self.segment_map.segment_info_for_frames(frames)
+        tiles_checked = set()
 
+        for frame in frames:
             # Skip frames that were emptied in a previous iteration.
             if not bitdata[frame]:
                 continue
 
+            bits_infos = []
+
             # Iterate over all tiles that use this frame.
-            for bits_info in self.segment_map.segment_info_for_frame(frame):
+            for bits_info in frame_segments.get(frame, ()):
                 # Don't examine a tile twice
                 if (bits_info.tile, bits_info.block_type) in tiles_checked:
                     continue
@@ -125,67 +310,438 @@ class FasmDisassembler(object):
                     continue
 
                 tiles_checked.add((bits_info.tile, bits_info.block_type))
+                bits_infos.append(bits_info)
+
+            yield frame, bits_infos
+
+    def find_features_in_frames(self, bitdata, frames, verbose=False):
+        """ Yield (frame, list of FasmLine) for each frame in frames.
+
+        Frames are processed in the order given.  Each tile is decoded at the
+        first frame with data for it, so frames must include every frame of
+        bitdata used by the tiles it touches.  FasmLines are not deduplicated
+        across frames.
+
+        """
+        solved_bitdata = {}
+
+        for frame, bits_infos in self.iter_frame_tiles(bitdata, frames):
+            fasm_lines = []
+            for bits_info in bits_infos:
+                fasm_lines.extend(
+                    self.find_features_in_tile(
+                        bits_info.tile,
+                        bits_info.block_type,
+                        bits_info.bits,
+                        solved_bitdata,
+                        bitdata,
+                        verbose=verbose))
+
+            if verbose:
+                fasm_lines.extend(
+                    self.unknown_bits(bitdata, solved_bitdata, frame))
+
+            yield frame, fasm_lines
+
+    def unknown_bits(self, bitdata, solved_bitdata, frame):
+        """ Yield FasmLines of the bits of frame not in solved_bitdata. """
+        remaining_bits = bitdata[frame][1]
+        if frame in solved_bitdata:
+            remaining_bits = remaining_bits - solved_bitdata[frame]
+
+        if len(remaining_bits) > 0:
+            # Some bits were not decoded, add warning and annotations to
+            # FASM.
+            yield from mk_unknown_bits(frame, remaining_bits)
+
+    def find_features_by_tile(self, bitdata, tile_key, verbose=False):
+        """ Yield (tile, list of FasmLine) for each tile with data.
+
+        Tiles are decoded one at a time, in order of tile_key(tile), so
+        output can be written before the whole bitstream is decoded.  The
+        FasmLines are those find_features_in_bitstream returns for the tile.
 
+        With verbose, a final (None, list of FasmLine) has the lines not
+        about a single tile, i.e. missing segbits warnings and unknown bits,
+        in the order find_features_in_bitstream returns them.
+
+        """
+        self.decode_warnings = set()
+
+        frames = sorted(bitdata)
+        frame_tiles = list(self.iter_frame_tiles(bitdata, frames))
+
+        tile_blocks = {}
+        for _, bits_infos in frame_tiles:
+            for bits_info in bits_infos:
+                if bits_info.tile not in tile_blocks:
+                    tile_blocks[bits_info.tile] = []
+                tile_blocks[bits_info.tile].append(bits_info)
+
+        # Solved bits are only kept to find unknown bits.
+        solved_bitdata = {}
+        for tile in sorted(tile_blocks, key=tile_key):
+            fasm_lines = []
+            emitted_features = set()
+            for bits_info in tile_blocks[tile]:
                 for fasm_line in self.find_features_in_tile(
-                        bits_info.tile, bits_info.block_type, bits_info.bits,
-                        solved_bitdata, bitdata, verbose=verbose):
+                        tile, bits_info.block_type, bits_info.bits,
+                        solved_bitdata if verbose else {}, bitdata):
                     if fasm_line not in emitted_features:
                         emitted_features.add(fasm_line)
-                        yield fasm_line
-
-            remaining_bits = bitdata[frame][1]
-            if frame in solved_bitdata:
-                remaining_bits -= solved_bitdata[frame]
-
-            if len(remaining_bits) > 0 and verbose:
-                # Some bits were not decoded, add warning and annotations to
-                # FASM.
-                yield fasm.FasmLine(
-                    set_feature=None,
-                    annotations=None,
-                    comment=" In frame 0x{:08x} {} bits were not converted.".
-                    format(
-                        frame,
-                        len(remaining_bits),
-                    ))
+                        fasm_lines.append(fasm_line)
+
+            yield tile, fasm_lines
+
+        if not verbose:
+            return
+
+        fasm_lines = []
+        for frame, bits_infos in frame_tiles:
+            for bits_info in bits_infos:
+                try:
+                    self.grid.get_tile_segbits_at_tilename(bits_info.tile)
+                except KeyError:
+                    # Only yields the missing segbits warning, once per tile
+                    # type.
+                    fasm_lines.extend(
+                        self.find_features_in_tile(
+                            bits_info.tile,
+                            bits_info.block_type,
+                            bits_info.bits, {},
+                            bitdata,
+                            verbose=True))
+
+            fasm_lines.extend(
+                self.unknown_bits(bitdata, solved_bitdata, frame))
+
+        yield None, fasm_lines
+
+    def find_features_in_partitions(self, bitdata, jobs, verbose=False):
+        """ find_features_in_frames over all frames using jobs processes.
 
-                for bit in sorted(remaining_bits):
-                    frame_offset = frame % bitstream.FRAME_ALIGNMENT
-                    aligned_frame = frame - frame_offset
-                    wordidx = bit // bitstream.WORD_SIZE_BITS
-                    bitidx = bit % bitstream.WORD_SIZE_BITS
-
-                    annotations = []
-                    annotations.append(
-                        fasm.Annotation(
-                            'unknown_bit', '{:08x}_{}_{}'.format(
-                                frame, wordidx, bitidx)))
-                    annotations.append(
-                        fasm.Annotation(
-                            'unknown_segment',
-                            '0x{:08x}'.format(aligned_frame)))
-                    annotations.append(
-                        fasm.Annotation(
-                            'unknown_segbit', '{:02d}_{:02d}'.format(
-                                frame_offset, bit)))
-                    yield fasm.FasmLine(
-                        set_feature=None,
-                        annotations=tuple(annotations),
-                        comment=None,
-                    )
+        Frames are split by configuration row with partition_frames, and each
+        partition is decoded in a forked worker sharing this disassembler and
+        its database read-only.  Returns the same (frame, list of FasmLine)
+        tuples as the serial find_features_in_frames in frame order.
+
+        """
+        global _PARTITION_DISASSEMBLER, _PARTITION_BITDATA, _PARTITIONS
+
+        partitions = partition_frames(bitdata, jobs)
+        if len(partitions) <= 1:
+            return list(
+                self.find_features_in_frames(
+                    bitdata, sorted(bitdata), verbose=verbose))
+
+        # Load the segbits used by the bitstream before forking, so workers
+        # share them instead of each reading them again.
+        self.load_tile_segbits(bitdata)
+
+        _PARTITION_DISASSEMBLER = self
+        _PARTITION_BITDATA = bitdata
+        _PARTITIONS = partitions
+        try:
+            with multiprocessing.get_context('fork').Pool(min(
+                    jobs, len(partitions))) as pool:
+                results = pool.map(
+                    functools.partial(_disassemble_partition, verbose=verbose),
+                    range(len(partitions)))
+        finally:
+            _PARTITION_DISASSEMBLER = None
+            _PARTITION_BITDATA = None
+            _PARTITIONS = None
+
+        frame_lines = [
+            frame_line for result in results for frame_line in result
+        ]
+        frame_lines.sort(key=lambda frame_line: frame_line[0])
+        return frame_lines
+
+    def load_tile_segbits(self, bitdata):
+        """ Load segbits and segbits index of tiles using frames of bitdata.
+        """
+        frame_segments = self.segment_map.segment_info_for_frames(
+            bitdata.keys())
+
+        loaded = set()
+        for bits_infos in frame_segments.values():
+            for bits_info in bits_infos:
+                gridinfo = self.grid.gridinfo_at_tilename(bits_info.tile)
+                key = (gridinfo.tile_type, bits_info.block_type)
+                if key in loaded:
+                    continue
+
+                loaded.add(key)
+                try:
+                    tile_segbits = self.grid.get_tile_segbits_at_tilename(
+                        bits_info.tile)
+                except KeyError:
+                    continue
+
+                if bits_info.bits.alias is not None:
+                    tile_segbits = tile_segbits.tile_segbits
+
+                if bits_info.block_type in tile_segbits.segbits:
+                    tile_segbits.get_segbits_index(bits_info.block_type)
+
+    def find_features_in_bitstream(self, bitdata, verbose=False, jobs=1):
+        """ Yield FasmLines of the features set in bitdata.
+
+        Frames are decoded in address order.  With jobs > 1, frames are
+        decoded in jobs worker processes, see find_features_in_partitions.
+        The FasmLines are the same, in the same order.
+
+        """
+        # Report missing tile types again for each bitstream.
+        self.decode_warnings = set()
+
+        if jobs > 1:
+            frame_lines = self.find_features_in_partitions(
+                bitdata, jobs, verbose=verbose)
+        else:
+            frame_lines = self.find_features_in_frames(
+                bitdata, sorted(bitdata), verbose=verbose)
+
+        emitted_features = set()
+        for _, fasm_lines in frame_lines:
+            for fasm_line in fasm_lines:
+                if fasm_line not in emitted_features:
+                    emitted_features.add(fasm_line)
+                    yield fasm_line
+
+    def get_zero_table_key(self, tile):
+        """ Return the key of the zero feature table of tile.
+
+        The tile type, or tile_segbits_alias.alias_key for aliased tiles.
+
+        """
+        key = self.zero_table_keys.get(tile)
+        if key is None:
+            gridinfo = self.grid.gridinfo_at_tilename(tile)
+            key = gridinfo.tile_type
+            if any(bits.alias is not None for bits in gridinfo.bits.values()):
+                key = alias_key(gridinfo.tile_type, gridinfo.bits)
+
+            self.zero_table_keys[tile] = key
+
+        return key
 
     def is_zero_feature(self, feature):
-        parts = feature.split('.')
-        tile = parts[0]
-        gridinfo = self.grid.gridinfo_at_tilename(tile)
-        feature = '.'.join(parts[1:])
-
-        db_k = '%s.%s' % (gridinfo.tile_type, feature)
-        segbits = self.grid.get_tile_segbits_at_tilename(tile)
-        any_bits = False
-        for block_type, bit in segbits.feature_to_bits(gridinfo.bits, db_k):
-            if bit.isset:
-                any_bits = True
-                break
-
-        return not any_bits
+        """ Return True if feature (TILE.FEATURE) has no bits set.
+
+        Results are kept per tile type (or alias), as they do not depend on
+        the tile.
+
+        """
+        tile, _, tile_feature = feature.partition('.')
+        key = self.get_zero_table_key(tile)
+        if key not in self.zero_tables:
+            self.zero_tables[key] = {}
+        zero_table = self.zero_tables[key]
+
+        if tile_feature not in zero_table:
+            gridinfo = self.grid.gridinfo_at_tilename(tile)
+            db_k = '%s.%s' % (gridinfo.tile_type, tile_feature)
+            segbits = self.grid.get_tile_segbits_at_tilename(tile)
+            any_bits = False
+            for block_type, bit in segbits.feature_to_bits(gridinfo.bits,
+                                                           db_k):
+                if bit.isset:
+                    any_bits = True
+                    break
+
+            zero_table[tile_feature] = not any_bits
+
+        return zero_table[tile_feature]
+
+
+class MatrixFasmDisassembler(FasmDisassembler):
+    """ FasmDisassembler that matches all tiles of a tile type at once.
+
+    bitdata is converted to a FrameArray.  For each TileGroup, the tiles with
+    data are found, their bits are gathered into a tiles x bits matrix and
+    every feature of every tile is evaluated against the SegbitsMatrix of
+    the tile type with one matrix product.
+
+    find_features_in_bitstream returns the same set of FasmLines as
+    FasmDisassembler, in a different order.
+
+    """
+
+    def __init__(self, db, chunk_size=1024):
+        super().__init__(db)
+
+        # Number of tiles evaluated in one matrix product.
+        self.chunk_size = chunk_size
+        self.tile_groups = None
+
+    def get_tile_groups(self):
+        """ Return list of TileGroup for all tiles of the grid. """
+        if self.tile_groups is None:
+            groups = {}
+            for bits_info in self.grid.iter_all_frames():
+                gridinfo = self.grid.gridinfo_at_tilename(bits_info.tile)
+                bits = bits_info.bits
+
+                tile_alias = None
+                if any(b.alias is not None for b in gridinfo.bits.values()):
+                    tile_alias = alias_key(gridinfo.tile_type, gridinfo.bits)
+
+                key = (
+                    gridinfo.tile_type, tile_alias, bits_info.block_type,
+                    bits.frames, bits.words)
+                if key not in groups:
+                    groups[key] = []
+
+                groups[key].append((bits_info.tile, bits))
+
+            self.tile_groups = []
+            for (_, _, block_type, frames, words), tiles in groups.items():
+                self.tile_groups.append(
+                    TileGroup(
+                        block_type=block_type,
+                        frames=frames,
+                        words=words,
+                        tiles=[tile for tile, _ in tiles],
+                        base_addresses=np.array(
+                            [bits.base_address for _, bits in tiles],
+                            dtype=np.int64),
+                        offsets=np.array(
+                            [bits.offset for _, bits in tiles],
+                            dtype=np.int64),
+                    ))
+
+        return self.tile_groups
+
+    def tiles_with_data(self, frame_array, group):
+        """ Return indices of tiles of group with any word set. """
+        rows = frame_array.rows(
+            group.base_addresses[:, None] + np.arange(group.frames)[None, :])
+
+        word_count = frame_array.words.shape[1]
+        begin = np.minimum(group.offsets, word_count)[:, None]
+        end = np.minimum(group.offsets + group.words, word_count)[:, None]
+
+        words_set = frame_array.words_set[rows, end] - \
+            frame_array.words_set[rows, begin]
+        return np.flatnonzero((words_set > 0).any(axis=1))
+
+    def match_group(self, frame_array, group, tile_idxs, matrix):
+        """ Yield (tile index, feature, solved frames, solved bits).
+
+        solved frames and bits are arrays of the bits set by the feature.
+
+        """
+        if len(matrix.features) == 0:
+            return
+
+        ones = matrix.weights > 0
+        for start in range(0, len(tile_idxs), self.chunk_size):
+            idxs = tile_idxs[start:start + self.chunk_size]
+            base_addresses = group.base_addresses[idxs][:, None]
+            offsets = group.offsets[idxs][:, None]
+
+            frames = base_addresses + matrix.word_columns[None, :]
+            bits = offsets * bitstream.WORD_SIZE_BITS + \
+                matrix.word_bits[None, :]
+
+            values = frame_array.bits(
+                frame_array.rows(frames), matrix.word_bits[None, :], offsets)
+
+            # Bits clear in all tiles of the chunk do not add to any score.
+            columns = np.flatnonzero(values.any(axis=0))
+            scores = values[:, columns].astype(np.float32) @ \
+                matrix.weights[:, columns].T
+            for tile, feature in zip(*np.nonzero(
+                    scores == matrix.ones_count[None, :])):
+                solved = ones[feature]
+                yield (
+                    idxs[tile], matrix.features[feature], frames[tile, solved],
+                    bits[tile, solved])
+
+    def find_features_in_bitstream(self, bitdata, verbose=False, jobs=1):
+        if jobs != 1:
+            raise ValueError(
+                'MatrixFasmDisassembler does not support jobs, got {}'.format(
+                    jobs))
+
+        self.decode_warnings = set()
+        frame_array = FrameArray(bitdata)
+
+        # Frames and bits set by matched features, only needed to report
+        # the remaining bits.
+        solved_frames = []
+        solved_bits = []
+
+        emitted_features = set()
+
+        for group in self.get_tile_groups():
+            tile_idxs = self.tiles_with_data(frame_array, group)
+            if len(tile_idxs) == 0:
+                continue
+
+            try:
+                tile_segbits = self.grid.get_tile_segbits_at_tilename(
+                    group.tiles[tile_idxs[0]])
+            except KeyError:
+                tile_segbits = None
+
+            if tile_segbits is None:
+                # Let FasmDisassembler report the missing segbits.
+                solved_bitdata = {}
+                for idx in tile_idxs:
+                    for fasm_line in self.find_features_in_tile(
+                            group.tiles[idx], group.block_type,
+                            self.grid.gridinfo_at_tilename(
+                                group.tiles[idx]).bits[group.block_type],
+                            solved_bitdata, bitdata, verbose=verbose):
+                        if fasm_line not in emitted_features:
+                            emitted_features.add(fasm_line)
+                            yield fasm_line
+                continue
+
+            matrix = tile_segbits.get_segbits_matrix(group.block_type)
+            if matrix is None:
+                continue
+
+            for idx, feature, frames, bits in self.match_group(
+                    frame_array, group, tile_idxs, matrix):
+                if verbose:
+                    solved_frames.append(frames)
+                    solved_bits.append(bits)
+
+                fasm_line = mk_fasm(
+                    tile_name=group.tiles[idx], feature=feature)
+                if fasm_line not in emitted_features:
+                    emitted_features.add(fasm_line)
+                    yield fasm_line
+
+        if not verbose:
+            return
+
+        solved = np.zeros_like(frame_array.words)
+        if solved_frames:
+            frames = np.concatenate(solved_frames)
+            bits = np.concatenate(solved_bits)
+            np.bitwise_or.at(
+                solved,
+                (frame_array.rows(frames), bits // bitstream.WORD_SIZE_BITS),
+                np.left_shift(1, bits % bitstream.WORD_SIZE_BITS).astype(
+                    np.uint32))
+
+        remaining = frame_array.words[:-1] & ~solved[:-1]
+        for row in np.flatnonzero(remaining.any(axis=1)):
+            remaining_bits = np.flatnonzero(
+                np.unpackbits(
+                    remaining[row].astype('<u4').view(np.uint8),
+                    bitorder='little'))
+            yield from mk_unknown_bits(
+                int(frame_array.addresses[row]), remaining_bits.tolist())
+
+
+# Disassembler classes by engine name, see bit2fasm --engine.
+DISASSEMBLERS = {
+    'scalar': FasmDisassembler,
+    'matrix': MatrixFasmDisassembler,
+}
@@ -10,7 +10,6 @@
 # SPDX-License-Identifier: ISC
 from prjxray import segment_map
 from prjxray.grid_types import BlockType, GridLoc, GridInfo, BitAlias, Bits, BitsInfo, ClockRegion
-from prjxray.tile_segbits_alias import TileSegbitsAlias
 import re
 
 CLOCK_REGION_RE = re.compile('X([0-9])Y([0-9])')
@@ -87,6 +86,13 @@ class Grid(object):
         x, y = zip(*self.loc.keys())
         self._dims = (min(x), max(x), min(y), max(y))
 
+    def __getstate__(self):
+        # The database is not part of the grid state, the owner of an
+        # unpickled Grid must set Grid.db.
+        state = self.__dict__.copy()
+        state['db'] = None
+        return state
+
     def tiles(self):
         """ Return list of tiles. """
         return self.tileinfo.keys()
@@ -144,6 +150,7 @@ class Grid(object):
                 any_alias = True
 
         if any_alias:
-            return TileSegbitsAlias(self.db, gridinfo.tile_type, gridinfo.bits)
+            return self.db.get_tile_segbits_alias(
+                gridinfo.tile_type, gridinfo.bits)
         else:
             return self.db.get_tile_segbits(gridinfo.tile_type)
@@ -23,6 +23,11 @@ The solution is computed using the Tikhonov regularization scheme to ensure
 numerical stability. The parameter -a can be used to vary the regularization
 factor.
 
+With --solver sparse the matrix A is kept sparse and the regularized normal
+equations are solved by Cholesky factorization instead of inverting them.
+This uses much less memory for large data sets. With --stream the input files
+are loaded one at a time, and only the normal equations are kept.
+
 By default each tag is solved separately (best results) while they can be
 solved all at once (not recommended).
 
@@ -48,11 +53,17 @@ other tags responsible for enabling other features of that block.
 import sys
 import os
 import argparse
-import itertools
+import collections
+import contextlib
+import hashlib
 import json
+import multiprocessing
+import time
 
 import numpy as np
 import numpy.linalg as linalg
+import scipy.linalg
+import scipy.sparse as sparse
 
 # =============================================================================
 
@@ -84,7 +95,7 @@ def load_data(file_name, tagfilter=lambda tag: True, address_map=None):
     all_segdata = []
 
     with open(file_name, "r") as fp:
-        for line in fp.readlines():
+        for line in fp:
             line = line.strip()
 
             # Segment tag
@@ -330,6 +341,63 @@ def dump_correlation_report(
 # =============================================================================
 
 
+def segdata_indices(all_tags, all_bits, segdata, bias=0.0):
+    """
+    Maps the bits and tags of segdata to matrix row and column indices.
+
+    Parameters
+    ----------
+
+    all_tags:
+        List of considered tags.
+    all_bits:
+        List of considered bits.
+    segdata:
+        List of segdata used.
+    bias:
+        T.B.D.
+
+    Returns
+    -------
+
+    A tuple with:
+    - Row and column indices of the bits set in each segdata.
+    - Row and column indices and values of the tags of each segdata.
+
+    """
+
+    bit_index = {bit: c for c, bit in enumerate(all_bits)}
+    tag_index = {tag: c for c, tag in enumerate(all_tags)}
+
+    bit_rows = []
+    bit_cols = []
+    tag_values = {}
+
+    for r, data in enumerate(segdata):
+        for bit in data["bit"]:
+            c = bit_index.get(bit)
+            if c is not None:
+                bit_rows.append(r)
+                bit_cols.append(c)
+
+        # The last value of a repeated tag wins
+        for t, x in data["tag"]:
+            c = tag_index.get(t)
+            if c is not None:
+                tag_values[(r, c)] = (+1.0 if x > 0 else -1.0) + bias
+
+    tag_rows = [r for r, c in tag_values.keys()]
+    tag_cols = [c for r, c in tag_values.keys()]
+
+    return (
+        np.array(bit_rows, dtype=int),
+        np.array(bit_cols, dtype=int),
+        np.array(tag_rows, dtype=int),
+        np.array(tag_cols, dtype=int),
+        np.array(list(tag_values.values()), dtype=np.float64),
+    )
+
+
 def build_matrices(all_tags, all_bits, segdata, bias=0.0):
     """
     Builds matrices for the linear equation system to be solved.
@@ -351,26 +419,59 @@ def build_matrices(all_tags, all_bits, segdata, bias=0.0):
     N = len(all_bits)
     K = len(all_tags)
 
-    A = np.zeros((M, N), dtype=np.float64)
-    B = np.zeros((M, K), dtype=np.float64)
+    bit_rows, bit_cols, tag_rows, tag_cols, tag_values = segdata_indices(
+        all_tags, all_bits, segdata, bias)
 
-    # A matrix
-    for r, c in itertools.product(range(M), range(N)):
-        if all_bits[c] in segdata[r]["bit"]:
-            A[r, c] = +1.0
-        else:
-            A[r, c] = -1.0
+    # A matrix, +1 for bits set and -1 otherwise
+    A = np.full((M, N), -1.0, dtype=np.float64)
+    A[bit_rows, bit_cols] = +1.0
 
-    # B matrix
-    for r, c in itertools.product(range(M), range(K)):
-        for t, x in segdata[r]["tag"]:
-            if t == all_tags[c]:
-                v = +1.0 if x > 0 else -1.0
-                B[r, c] = v + bias
+    # B matrix, 0 for tags not present
+    B = np.zeros((M, K), dtype=np.float64)
+    B[tag_rows, tag_cols] = tag_values
 
     return A, B
 
 
+def build_sparse_matrices(all_tags, all_bits, segdata, bias=0.0):
+    """
+    Builds the matrices of build_matrices() in sparse form.
+
+    Parameters
+    ----------
+
+    all_tags:
+        List of considered tags.
+    all_bits:
+        List of considered bits.
+    segdata:
+        List of segdata used.
+    bias:
+        T.B.D.
+
+    Returns
+    -------
+
+    A tuple with:
+    - Matrix S with ones for bits set, so that A = 2 * S - 1.
+    - Matrix B.
+
+    """
+
+    M = len(segdata)
+    N = len(all_bits)
+    K = len(all_tags)
+
+    bit_rows, bit_cols, tag_rows, tag_cols, tag_values = segdata_indices(
+        all_tags, all_bits, segdata, bias)
+
+    S = sparse.csr_matrix(
+        (np.ones(len(bit_rows)), (bit_rows, bit_cols)), shape=(M, N))
+    B = sparse.csr_matrix((tag_values, (tag_rows, tag_cols)), shape=(M, K))
+
+    return S, B
+
+
 def compute_error(A, B, X):
     """
     Computes solution error.
@@ -474,13 +575,353 @@ def solve_tichonov(all_tags, all_bits, segdata, bias=0.0, a=0.0):
     return X, compute_error(A, B, X)
 
 
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MB, or NaN where
+    the resource module is not available (Windows).
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / (1024.0 * 1024.0)
+
+    return maxrss / 1024.0
+
+
+class PhaseTimer(object):
+    """
+    Accumulates time spent in solver phases, and the peak memory use at the
+    end of each phase.
+    """
+
+    def __init__(self):
+        self.times = collections.OrderedDict()
+        self.peak_rss = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + (
+                time.perf_counter() - start)
+            self.peak_rss[name] = peak_rss_mb()
+
+    def merge(self, other):
+        """
+        Adds the time spent in the phases of another timer.
+        """
+
+        for name, seconds in other.times.items():
+            self.times[name] = self.times.get(name, 0.0) + seconds
+            self.peak_rss[name] = max(
+                self.peak_rss.get(name, 0.0), other.peak_rss[name])
+
+    def dump(self, fp):
+        for name, seconds in self.times.items():
+            fp.write(
+                "%-10s %8.3fs  peak RSS %8.1f MB\n" %
+                (name + ":", seconds, self.peak_rss[name]))
+
+
+class NormalEquations(object):
+    """
+    Normal equations AtA X = AtB of the system built by build_matrices(),
+    accumulated from any number of segdata without forming A.
+
+    With A = 2 * S - 1, where S is the sparse matrix of set bits:
+
+        AtA = 4 StS - 2 (s 1t + 1 st) + M 1 1t
+        AtB = 2 StB - 1 bt
+
+    where s and b are the column sums of S and B. So only the sparse StS,
+    StB, s, b, the number of rows M and the column sums of B squared (for
+    the solution error) are kept.
+    """
+
+    def __init__(self, all_tags, all_bits, bias=0.0):
+        self.all_tags = all_tags
+        self.all_bits = all_bits
+        self.bias = bias
+
+        N = len(all_bits)
+        K = len(all_tags)
+
+        self.M = 0
+        self.StS = sparse.csr_matrix((N, N))
+        self.StB = np.zeros((N, K))
+        self.s = np.zeros(N)
+        self.b = np.zeros(K)
+        self.bb = np.zeros(K)
+
+    def add(self, segdata):
+        """
+        Adds rows of segdata to the equations.
+        """
+
+        S, B = build_sparse_matrices(
+            self.all_tags, self.all_bits, segdata, self.bias)
+
+        self.M += S.shape[0]
+        self.StS = self.StS + S.T @ S
+        self.StB += (S.T @ B).toarray()
+        self.s += np.asarray(S.sum(axis=0)).ravel()
+        self.b += np.asarray(B.sum(axis=0)).ravel()
+        self.bb += np.asarray(B.multiply(B).sum(axis=0)).ravel()
+
+    def merge(self, other):
+        """
+        Adds the rows of other equations, with the same tags and bits.
+        """
+
+        self.merge_rows(other)
+        self.StB += other.StB
+        self.b += other.b
+        self.bb += other.bb
+
+    def merge_rows(self, other):
+        """
+        Adds the rows of other equations, with the same bits, to the part of
+        the equations not depending on tags.
+        """
+
+        self.M += other.M
+        self.StS = self.StS + other.StS
+        self.s = self.s + other.s
+
+    def reindex(self, all_tags, all_bits):
+        """
+        Returns these equations with other tags and bits, in that order.
+        Tags and bits these equations do not have are absent from all rows,
+        and tags and bits not in all_tags and all_bits are dropped. Returns
+        these equations if the tags and bits are the same.
+        """
+
+        if list(all_tags) == list(self.all_tags) and list(all_bits) == list(
+                self.all_bits):
+            return self
+
+        equations = NormalEquations(all_tags, all_bits, self.bias)
+        equations.M = self.M
+
+        bit_index = {bit: i for i, bit in enumerate(self.all_bits)}
+        tag_index = {tag: i for i, tag in enumerate(self.all_tags)}
+
+        bits = [
+            (i, bit_index[bit])
+            for i, bit in enumerate(all_bits)
+            if bit in bit_index
+        ]
+        tags = [
+            (i, tag_index[tag])
+            for i, tag in enumerate(all_tags)
+            if tag in tag_index
+        ]
+
+        new_bits = np.array([i for i, j in bits], dtype=int)
+        old_bits = np.array([j for i, j in bits], dtype=int)
+        new_tags = np.array([i for i, j in tags], dtype=int)
+        old_tags = np.array([j for i, j in tags], dtype=int)
+
+        # P maps the old bits to the new ones
+        P = sparse.csr_matrix(
+            (np.ones(len(bits)), (new_bits, old_bits)),
+            shape=(len(all_bits), len(self.all_bits)))
+
+        equations.StS = (P @ self.StS @ P.T).tocsr()
+        equations.s[new_bits] = self.s[old_bits]
+        equations.StB[np.ix_(new_bits, new_tags)] = self.StB[np.ix_(
+            old_bits, old_tags)]
+        equations.b[new_tags] = self.b[old_tags]
+        equations.bb[new_tags] = self.bb[old_tags]
+
+        return equations
+
+    def normal_matrix(self, a=0.0):
+        """
+        Returns the dense matrix AtA + a * I.
+        """
+
+        AtA = 4.0 * self.StS.toarray()
+        AtA -= 2.0 * (self.s[:, None] + self.s[None, :])
+        AtA += self.M
+        AtA[np.diag_indices_from(AtA)] += a
+
+        return AtA
+
+    def rhs(self):
+        """
+        Returns AtB.
+        """
+
+        return 2.0 * self.StB - self.b[None, :]
+
+    def product(self, X):
+        """
+        Returns AtA X, without forming AtA.
+        """
+
+        ones_X = np.sum(X, axis=0)[None, :]
+        s_X = (self.s @ X)[None, :]
+
+        return 4.0 * (self.StS @ X) - 2.0 * self.s[:, None] * ones_X \
+            - 2.0 * s_X + self.M * ones_X
+
+    def error(self, X):
+        """
+        Computes solution error as compute_error() does, from
+        |AX - B|^2 = XtAtAX - 2 XtAtB + BtB.
+        """
+
+        E2 = np.sum(X * self.product(X), axis=0) \
+            - 2.0 * np.sum(X * self.rhs(), axis=0) + self.bb
+
+        return np.sqrt(np.maximum(E2, 0.0))
+
+
+def solve_normal_equations(equations, a=0.0, timer=None):
+    """
+    Solves NormalEquations with Tichonov regularization by Cholesky
+    factorization.
+
+    Parameters
+    ----------
+
+    equations:
+        NormalEquations to solve.
+    a:
+        Regularization coefficient.
+    timer:
+        PhaseTimer accumulating time and memory use of each phase.
+
+    Returns
+    -------
+
+    Tuple with:
+    - Solution matrix X
+    - Error vector.
+
+    """
+
+    if timer is None:
+        timer = PhaseTimer()
+
+    with timer.phase("factorize"):
+        factor = scipy.linalg.cho_factor(
+            equations.normal_matrix(a), overwrite_a=True)
+
+    with timer.phase("solve"):
+        X = scipy.linalg.cho_solve(factor, equations.rhs())
+
+    with timer.phase("error"):
+        E = equations.error(X)
+
+    return X, E
+
+
+def solve_tichonov_sparse(
+        all_tags, all_bits, segdata, bias=0.0, a=0.0, chunk_size=1024,
+        timer=None):
+    """
+    Solves the system of solve_tichonov() keeping A sparse. The normal
+    equations are accumulated over chunks of segdata and solved by
+    Cholesky factorization, without inverting AtA.
+
+    Parameters
+    ----------
+
+    all_tags:
+        List of considered tags.
+    all_bits:
+        List of considered bits.
+    segdata:
+        List of segdata used.
+    bias:
+        T.B.D.
+    a:
+        Regularization coefficient.
+    chunk_size:
+        Number of segdata rows added to the normal equations at once.
+    timer:
+        PhaseTimer accumulating time and memory use of each phase.
+
+    Returns
+    -------
+
+    Tuple with:
+    - Solution matrix X
+    - Error vector.
+
+    """
+
+    if timer is None:
+        timer = PhaseTimer()
+
+    with timer.phase("build"):
+        equations = NormalEquations(all_tags, all_bits, bias)
+        for i in range(0, len(segdata), chunk_size):
+            equations.add(segdata[i:i + chunk_size])
+
+    return solve_normal_equations(equations, a, timer)
+
+
 # =============================================================================
 
+# State shared with forked tag group workers, see solve_onebyone.
+_ONEBYONE_DATA = None
+
+
+def tag_rows(all_tags, segdata):
+    """
+    Builds a dict indexed by tag names with tuples of the segdata rows
+    having that tag.
+    """
+
+    rows = {tag: [] for tag in all_tags}
+
+    for r, data in enumerate(segdata):
+        for t in set(t for t, x in data["tag"]):
+            if t in rows:
+                rows[t].append(r)
+
+    return {tag: tuple(r) for tag, r in rows.items()}
+
 
-def solve_onebyone(all_tags, all_bits, segdata, solver=solve_lms, **kw):
+def _solve_tag_group(group):
+    """
+    Solves tags having the same segdata rows at once.
+    """
+
+    all_bits, segdata, solver, kw = _ONEBYONE_DATA
+    tags, rows = group
+
+    # Phases are timed by the worker, and merged by the caller.
+    kw = dict(kw)
+    if "timer" in kw:
+        kw["timer"] = PhaseTimer()
+
+    start = time.perf_counter()
+    X, E = solver(tags, all_bits, [segdata[r] for r in rows], **kw)
+    elapsed = time.perf_counter() - start
+
+    return X, E, elapsed, kw.get("timer")
+
+
+def solve_onebyone(
+        all_tags, all_bits, segdata, solver=solve_lms, jobs=1, **kw):
     """
     Solves each tag separately in one-by-one fashion.
 
+    Tags present in the same segdata rows have the same matrix A, so they are
+    solved together sharing one factorization.
+
     Parameters
     ----------
 
@@ -492,6 +933,8 @@ def solve_onebyone(all_tags, all_bits, segdata, solver=solve_lms, **kw):
         List of segdata used.
     solver:
         Solver function.
+    jobs:
+        Number of processes solving groups of tags in parallel.
     **kw:
         Parameters to solver function.
 
@@ -503,21 +946,42 @@ def solve_onebyone(all_tags, all_bits, segdata, solver=solve_lms, **kw):
     - Error vector.
 
     """
+    global _ONEBYONE_DATA
 
     X = np.empty((len(all_bits), len(all_tags)))
     E = np.empty((len(all_tags)))
 
-    for i, tag in enumerate(all_tags):
+    # Group tags by their rows
+    groups = collections.OrderedDict()
+    for tag, rows in tag_rows(all_tags, segdata).items():
+        groups.setdefault(rows, []).append(tag)
+    groups = [(tags, rows) for rows, tags in groups.items()]
 
-        tag_segdata = [
-            data for data in segdata if tag in [t[0] for t in data["tag"]]
-        ]
-        print("%s #%d" % (tag, len(tag_segdata)))
+    column = {tag: i for i, tag in enumerate(all_tags)}
+
+    _ONEBYONE_DATA = (all_bits, segdata, solver, kw)
+    try:
+        if jobs <= 1 or len(groups) <= 1:
+            results = list(map(_solve_tag_group, groups))
+        else:
+            with multiprocessing.get_context('fork').Pool(min(
+                    jobs, len(groups))) as pool:
+                results = pool.map(_solve_tag_group, groups)
+    finally:
+        _ONEBYONE_DATA = None
+
+    for (tags, rows), (X1, E1, elapsed, timer) in zip(groups, results):
+        for k, tag in enumerate(tags):
+            X[:, column[tag]] = X1[:, k]
+            E[column[tag]] = E1[k]
 
-        X1, E1 = solver([tag], all_bits, tag_segdata, **kw)
+            line = "%s #%d %.3fs" % (tag, len(rows), elapsed)
+            if len(tags) > 1:
+                line += " (shared by %d tags)" % len(tags)
+            print(line)
 
-        X[:, i] = X1[:, 0]
-        E[i] = E1[0]
+        if timer is not None:
+            kw["timer"].merge(timer)
 
     return X, E
 
@@ -564,70 +1028,168 @@ def detect_candidates(X, th, norm=None):
 # =============================================================================
 
 
-def compute_bit_correlations(tags_to_solve, bits_to_solve, segdata, W):
+def build_tag_matrices(all_tags, segdata):
+    """
+    Builds matrices with ones for tags with value 1 and with value 0 in each
+    segdata. The first value of a repeated tag is used.
     """
-    Basing on solution given in the matrix W returns a matrix C with
-    correlation coefficients of each bit.
 
-    Also returns a dict of dicts indexed by tag names and bit names with
-    correlation exceptions - concrete specimen names where the correlation
-    does not occur.
+    M = len(segdata)
+    K = len(all_tags)
+
+    tag_index = {tag: c for c, tag in enumerate(all_tags)}
+
+    tag_values = {}
+    for r, data in enumerate(segdata):
+        for t, x in data["tag"]:
+            c = tag_index.get(t)
+            if c is not None and (r, c) not in tag_values:
+                tag_values[(r, c)] = x > 0
+
+    T = []
+    for value in (True, False):
+        rows = [r for (r, c), x in tag_values.items() if x == value]
+        cols = [c for (r, c), x in tag_values.items() if x == value]
+        T.append(
+            sparse.csc_matrix(
+                (np.ones(len(rows), dtype=int), (rows, cols)), shape=(M, K)))
+
+    return T[0], T[1]
+
+
+def build_correlation_matrices(all_tags, all_bits, segdata):
+    """
+    Builds the boolean matrices bit correlations are computed from.
+
+    Parameters
+    ----------
+
+    all_tags:
+        List of considered tags.
+    all_bits:
+        List of considered bits.
+    segdata:
+        List of segdata used.
+
+    Returns
+    -------
+
+    A tuple with:
+    - Matrix with ones for bits set in each segdata.
+    - Matrix with ones for tags with value 1 in each segdata.
+    - Matrix with ones for tags with value 0 in each segdata.
+    - List of segment names of the rows.
+
+    """
+
+    M = len(segdata)
+    N = len(all_bits)
+
+    bit_rows, bit_cols, _, _, _ = segdata_indices([], all_bits, segdata)
+    S = sparse.csr_matrix(
+        (np.ones(len(bit_rows), dtype=int), (bit_rows, bit_cols)),
+        shape=(M, N))
+
+    T1, T0 = build_tag_matrices(all_tags, segdata)
+
+    return S, T1, T0, [data["seg"] for data in segdata]
+
+
+def correlation_counts(tags_to_solve, bits_to_solve, W, S, T1, T0, segs):
     """
+    Computes bit_correlation_counts() from matrices returned by
+    build_correlation_matrices(), for all tags at once.
+    """
+
+    # Number of segdata with each tag value, and also with each bit set
+    n1 = np.asarray(T1.sum(axis=0)).ravel()
+    n0 = np.asarray(T0.sum(axis=0)).ravel()
+    n11 = (T1.T @ S).toarray()
+    n01 = (T0.T @ S).toarray()
+
+    # Bits correlate with the tag value, or its negation for negative
+    # weights
+    positive = n11 + (n0[:, None] - n01)
+    negative = n01 + (n1[:, None] - n11)
+
+    corr_sums = np.where(W > 0, positive, np.where(W < 0, negative, 0))
+    corr_counts = np.where(W != 0, (n0 + n1)[:, None], 0)
 
-    C = np.zeros_like(W, dtype=float)
     exceptions = {}
 
     for i, tag in enumerate(tags_to_solve):
-
-        # Filter data for this tag
-        tag_segdata = [
-            data for data in segdata if tag in [t[0] for t in data["tag"]]
-        ]
         exceptions[tag] = {}
 
-        # Compute bit correlation
-        for j, bit in enumerate(bits_to_solve):
-            w = W[i, j]
+        cols = np.nonzero(
+            (W[i, :] != 0) & (corr_sums[i, :] < corr_counts[i, :]))[0]
+        if not len(cols):
+            continue
 
-            # No correlation with that bit
-            if w == 0:
-                continue
+        # Rows having the tag, in segdata order
+        rows = np.concatenate((T1[:, i].indices, T0[:, i].indices))
+        values = np.concatenate(
+            (
+                np.ones(T1[:, i].nnz, dtype=int),
+                np.zeros(T0[:, i].nnz, dtype=int)))
+        order = np.argsort(rows, kind="stable")
+        rows = rows[order]
+        values = values[order]
 
-            corr_sum = 0
-            corr_count = 0
+        vb = S[rows][:, cols].toarray()
+        vt = np.where(W[i, cols] > 0, values[:, None], 1 - values[:, None])
 
-            # Compute for one bit
-            for k, data in enumerate(tag_segdata):
-                bits = data["bit"]
+        for k, j in enumerate(cols.tolist()):
+            exceptions[tag][bits_to_solve[j]] = [
+                (int(vb[r, k]), int(vt[r, k]), segs[rows[r]])
+                for r in np.nonzero(vb[:, k] != vt[:, k])[0].tolist()
+            ]
 
-                vt = [v for t, v in data["tag"] if t == tag][0]
-                vb = 1 if bit in bits else 0
+    return corr_sums, corr_counts, exceptions
 
-                # Negative correlation
-                if w < 0:
-                    vt = int(1 - vt)
-                else:
-                    vt = int(vt)
 
-                # Correlates
-                if vt == vb:
-                    corr_sum += 1
-                # Does not correlate
-                else:
-                    if bit not in exceptions[tag]:
-                        exceptions[tag][bit] = []
-                    exceptions[tag][bit].append((
-                        vb,
-                        vt,
-                        data["seg"],
-                    ))
+def bit_correlation_counts(tags_to_solve, bits_to_solve, segdata, W):
+    """
+    Basing on solution given in the matrix W returns matrices with the
+    number of segdata each bit correlates in, and the number of segdata
+    each tag is present in.
 
-                corr_count += 1
+    Also returns a dict of dicts indexed by tag names and bit names with
+    correlation exceptions - concrete specimen names where the correlation
+    does not occur.
+    """
 
-            # Store correlation
-            C[i, j] = corr_sum / corr_count
+    return correlation_counts(
+        tags_to_solve, bits_to_solve, W,
+        *build_correlation_matrices(tags_to_solve, bits_to_solve, segdata))
 
-    return C, exceptions
+
+def compute_bit_correlations(tags_to_solve, bits_to_solve, segdata, W):
+    """
+    Basing on solution given in the matrix W returns a matrix C with
+    correlation coefficients of each bit.
+
+    Also returns a dict of dicts indexed by tag names and bit names with
+    correlation exceptions - concrete specimen names where the correlation
+    does not occur.
+    """
+
+    corr_sums, corr_counts, exceptions = bit_correlation_counts(
+        tags_to_solve, bits_to_solve, segdata, W)
+
+    return correlation_matrix(corr_sums, corr_counts), exceptions
+
+
+def correlation_matrix(corr_sums, corr_counts):
+    """
+    Returns the correlation coefficients from counts returned by
+    bit_correlation_counts().
+    """
+
+    C = np.zeros_like(corr_sums, dtype=float)
+    counted = corr_counts > 0
+    C[counted] = corr_sums[counted] / corr_counts[counted]
+
+    return C
 
 
 def compute_tag_stats(all_tags, segdata):
@@ -646,27 +1208,26 @@ def compute_tag_stats(all_tags, segdata):
     -------
 
     A dict indexed by tag name with tuples containing 0 and 1 occurrence count.
+    Every occurrence of a tag repeated in one segdata is counted, as in the
+    "tag_count" of summarize_segdata().
 
     """
 
+    counts = {tag: [0, 0] for tag in all_tags}
+
+    for data in segdata:
+        for t, v in data["tag"]:
+            count = counts.get(t)
+            if count is not None:
+                if v > 0:
+                    count[1] += 1
+                else:
+                    count[0] += 1
+
     stats = {}
+    for tag in all_tags:
+        stats[tag] = tuple(counts[tag])
 
-    for i, tag in enumerate(all_tags):
-        count0 = 0
-        count1 = 0
-
-        for data in segdata:
-            for t, v in data["tag"]:
-                if t == tag:
-                    if v > 0:
-                        count1 += 1
-                    else:
-                        count0 += 1
-
-        stats[tag] = (
-            count0,
-            count1,
-        )
     return stats
 
 
@@ -741,6 +1302,393 @@ def build_address_map(tilegrid_file):
 # =============================================================================
 
 
+def summarize_segdata(segdata):
+    """
+    Summarizes segdata for choosing the tags and bits to solve.
+
+    Parameters
+    ----------
+
+    segdata:
+        List of segdata.
+
+    Returns
+    -------
+
+    A dict with:
+    - "segs": Number of segments
+    - "bits": Set of all bits
+    - "const1_bits": Set of bits set in all segments, None if no segments
+    - "tag_count": A dict indexed by tag names with lists of 0 and 1 counts
+
+    """
+
+    summary = {
+        "segs": len(segdata),
+        "bits": set(),
+        "const1_bits": None,
+        "tag_count": {},
+    }
+
+    for seg in segdata:
+        bits = set(seg["bit"])
+        summary["bits"] |= bits
+
+        if summary["const1_bits"] is None:
+            summary["const1_bits"] = set(bits)
+        else:
+            summary["const1_bits"] &= bits
+
+        for tag, val in seg["tag"]:
+            count = summary["tag_count"].setdefault(tag, [0, 0])
+            if val > 0:
+                count[1] += 1
+            else:
+                count[0] += 1
+
+    return summary
+
+
+def merge_summaries(summary, other):
+    """
+    Adds the summary of other segdata to summary.
+    """
+
+    summary["segs"] += other["segs"]
+    summary["bits"] |= other["bits"]
+
+    if summary["const1_bits"] is None:
+        summary["const1_bits"] = other["const1_bits"]
+    elif other["const1_bits"] is not None:
+        summary["const1_bits"] &= other["const1_bits"]
+
+    for tag, (count0, count1) in other["tag_count"].items():
+        count = summary["tag_count"].setdefault(tag, [0, 0])
+        count[0] += count0
+        count[1] += count1
+
+
+def accumulate_equations(segdata, all_tags, all_bits, bias=0.0):
+    """
+    Accumulates NormalEquations of segdata rows for the tags having them.
+    Tags present in the same rows share one set of equations.
+
+    Returns
+    -------
+
+    A list of tuples with rows, and NormalEquations of these rows for the
+    tags present in exactly these rows.
+
+    """
+
+    groups = collections.OrderedDict()
+    for tag, rows in tag_rows(all_tags, segdata).items():
+        if len(rows):
+            groups.setdefault(rows, []).append(tag)
+
+    row_groups = []
+    for rows, tags in groups.items():
+        equations = NormalEquations(tags, all_bits, bias)
+        equations.add([segdata[r] for r in rows])
+        row_groups.append((rows, equations))
+
+    return row_groups
+
+
+def solve_equations_onebyone(equations, all_tags, all_bits, a=0.0, timer=None):
+    """
+    Solves each tag separately from equations accumulated by
+    stream_equations(), like solve_onebyone() with solve_tichonov_sparse().
+
+    Parameters
+    ----------
+
+    equations:
+        A dict with NormalEquations of tags present in the same rows.
+    all_tags:
+        List of considered tags.
+    all_bits:
+        List of considered bits.
+    a:
+        Regularization coefficient.
+    timer:
+        PhaseTimer accumulating time and memory use of each phase.
+
+    Returns
+    -------
+
+    Tuple with:
+    - Solution matrix X
+    - Error vector.
+
+    """
+
+    if timer is None:
+        timer = PhaseTimer()
+
+    X = np.empty((len(all_bits), len(all_tags)))
+    E = np.empty((len(all_tags)))
+
+    column = {tag: i for i, tag in enumerate(all_tags)}
+
+    for tag_equations in equations.values():
+        tags = tag_equations.all_tags
+
+        start = time.perf_counter()
+        X1, E1 = solve_normal_equations(tag_equations, a, timer)
+        elapsed = time.perf_counter() - start
+
+        for k, tag in enumerate(tags):
+            X[:, column[tag]] = X1[:, k]
+            E[column[tag]] = E1[k]
+
+            line = "%s #%d %.3fs" % (tag, tag_equations.M, elapsed)
+            if len(tags) > 1:
+                line += " (shared by %d tags)" % len(tags)
+            print(line)
+
+    return X, E
+
+
+# State shared with forked file workers, see map_files.
+_STREAM_DATA = None
+
+
+def map_files(function, file_names, jobs=1):
+    """
+    Yields tuples of file names and function results for each of them,
+    computed by jobs forked worker processes when jobs > 1.
+    """
+
+    if jobs <= 1 or len(file_names) <= 1:
+        for file_name in file_names:
+            yield file_name, function(file_name)
+        return
+
+    with multiprocessing.get_context('fork').Pool(min(
+            jobs, len(file_names))) as pool:
+        yield from zip(file_names, pool.imap(function, file_names))
+
+
+def _load_file(file_name):
+    return load_data(
+        file_name, _STREAM_DATA["tagfilter"], _STREAM_DATA["address_map"])
+
+
+def _accumulate_file(file_name):
+    segdata = _load_file(file_name)
+
+    summary = summarize_segdata(segdata)
+    all_tags = sorted(summary["tag_count"].keys())
+    all_bits = sorted(summary["bits"], key=sort_bits)
+
+    if _STREAM_DATA["solve_all"]:
+        equations = NormalEquations(all_tags, all_bits, _STREAM_DATA["bias"])
+        equations.add(segdata)
+        return summary, equations
+
+    return summary, accumulate_equations(
+        segdata, all_tags, all_bits, _STREAM_DATA["bias"])
+
+
+def _correlate_file(file_name):
+    return bit_correlation_counts(
+        _STREAM_DATA["all_tags"], _STREAM_DATA["all_bits"],
+        _load_file(file_name), _STREAM_DATA["W"])
+
+
+def stream_files(function, file_names, jobs=1, **data):
+    """
+    Maps one of the file functions over file names, with data shared with
+    the workers. Each file is loaded by the worker processing it, so
+    segdata of one file at a time is kept by each worker.
+    """
+    global _STREAM_DATA
+
+    _STREAM_DATA = data
+    try:
+        yield from map_files(function, file_names, jobs)
+    finally:
+        _STREAM_DATA = None
+
+
+def extend_names(names, other_names):
+    """
+    Returns names followed by the other names not in names.
+    """
+
+    seen = set(names)
+    return names + [name for name in other_names if name not in seen]
+
+
+def stream_equations(
+        file_names, tagfilter, address_map, bias=0.0, solve_all=False, jobs=1):
+    """
+    Summarizes segdata files and accumulates their normal equations, reading
+    each file once.
+
+    Returns
+    -------
+
+    A tuple with:
+    - summarize_segdata() of the segdata of all files.
+    - Equations of all tags and bits of the files, see select_equations().
+
+    With solve_all, the equations are NormalEquations of all tags and rows.
+
+    Otherwise they are a dict with NormalEquations of the tags present in the
+    same rows.
+
+    """
+
+    summary = summarize_segdata([])
+    all_tags = []
+    all_bits = []
+
+    if solve_all:
+        equations = NormalEquations(all_tags, all_bits, bias)
+        for file_name, (file_summary, file_equations) in stream_files(
+                _accumulate_file, file_names, jobs, tagfilter=tagfilter,
+                address_map=address_map, bias=bias, solve_all=True):
+            print(file_name)
+            merge_summaries(summary, file_summary)
+
+            all_tags = extend_names(all_tags, file_equations.all_tags)
+            all_bits = extend_names(all_bits, file_equations.all_bits)
+            equations = equations.reindex(all_tags, all_bits)
+            equations.merge(file_equations.reindex(all_tags, all_bits))
+
+        return summary, equations
+
+    # Tags present in the same rows of all files so far have the same key,
+    # a digest of these rows. The part of the equations not depending on
+    # tags is kept once for each key, and only the columns of StB, b and bb
+    # are kept for each tag. Bits are added as files have them, rows of
+    # earlier files do not have them set.
+    row_groups = {"": NormalEquations([], all_bits, bias)}
+    tag_keys = {}
+    tag_columns = NormalEquations(all_tags, all_bits, bias)
+
+    for file_name, (file_summary, file_row_groups) in stream_files(
+            _accumulate_file, file_names, jobs, tagfilter=tagfilter,
+            address_map=address_map, bias=bias, solve_all=False):
+        print(file_name)
+        merge_summaries(summary, file_summary)
+
+        all_tags = extend_names(
+            all_tags, sorted(file_summary["tag_count"].keys()))
+        all_bits = extend_names(
+            all_bits, sorted(file_summary["bits"], key=sort_bits))
+        tag_columns = tag_columns.reindex(all_tags, all_bits)
+        for tag in all_tags:
+            tag_keys.setdefault(tag, "")
+
+        column = {tag: i for i, tag in enumerate(all_tags)}
+
+        for rows, file_equations in file_row_groups:
+            file_equations = file_equations.reindex(
+                file_equations.all_tags, all_bits)
+
+            cols = [column[tag] for tag in file_equations.all_tags]
+            tag_columns.StB[:, cols] += file_equations.StB
+            tag_columns.b[cols] += file_equations.b
+            tag_columns.bb[cols] += file_equations.bb
+
+            # Tags with different rows in previous files get different keys
+            prev_keys = collections.OrderedDict()
+            for tag in file_equations.all_tags:
+                prev_keys.setdefault(tag_keys[tag], []).append(tag)
+
+            for prev_key, tags in prev_keys.items():
+                digest = hashlib.sha1(prev_key.encode())
+                digest.update(file_name.encode())
+                digest.update(np.array(rows, dtype=int).tobytes())
+                key = digest.hexdigest()
+
+                row_group = NormalEquations([], all_bits, bias)
+                row_group.merge_rows(
+                    row_groups[prev_key].reindex([], all_bits))
+                row_group.merge_rows(file_equations)
+                row_groups[key] = row_group
+
+                for tag in tags:
+                    tag_keys[tag] = key
+
+        # Forget rows of no tag
+        row_groups = {key: row_groups[key] for key in set(tag_keys.values())}
+
+    groups = collections.OrderedDict()
+    for tag in all_tags:
+        groups.setdefault(tag_keys[tag], []).append(tag)
+
+    equations = collections.OrderedDict()
+    for key, tags in groups.items():
+        cols = [column[tag] for tag in tags]
+
+        equations[key] = NormalEquations(tags, all_bits, bias)
+        equations[key].merge_rows(row_groups[key].reindex([], all_bits))
+        equations[key].StB = tag_columns.StB[:, cols]
+        equations[key].b = tag_columns.b[cols]
+        equations[key].bb = tag_columns.bb[cols]
+
+    return summary, equations
+
+
+def select_equations(equations, all_tags, all_bits):
+    """
+    Returns the equations accumulated by stream_equations() of only the
+    considered tags and bits, in their order.
+
+    Without solve_all, the equations of tags present in the same rows are
+    ordered by the first of their tags, for solve_equations_onebyone().
+    """
+
+    if isinstance(equations, NormalEquations):
+        return equations.reindex(all_tags, all_bits)
+
+    tag_keys = {}
+    for key, tag_equations in equations.items():
+        for tag in tag_equations.all_tags:
+            tag_keys[tag] = key
+
+    groups = collections.OrderedDict()
+    for tag in all_tags:
+        groups.setdefault(tag_keys[tag], []).append(tag)
+
+    selected = collections.OrderedDict()
+    for key, tags in groups.items():
+        selected[key] = equations[key].reindex(tags, all_bits)
+
+    return selected
+
+
+def stream_bit_correlations(
+        file_names, tagfilter, address_map, all_tags, all_bits, W, jobs=1):
+    """
+    Computes bit correlations of segdata files, as
+    compute_bit_correlations() of their segdata.
+    """
+
+    corr_sums = np.zeros_like(W, dtype=int)
+    corr_counts = np.zeros_like(W, dtype=int)
+    exceptions = {tag: {} for tag in all_tags}
+
+    for file_name, (file_sums, file_counts, file_exceptions) in stream_files(
+            _correlate_file, file_names, jobs, tagfilter=tagfilter,
+            address_map=address_map, all_tags=all_tags, all_bits=all_bits,
+            W=W):
+        corr_sums += file_sums
+        corr_counts += file_counts
+        for tag, bit_exceptions in file_exceptions.items():
+            for bit, e in bit_exceptions.items():
+                exceptions[tag].setdefault(bit, []).extend(e)
+
+    return correlation_matrix(corr_sums, corr_counts), exceptions
+
+
+# =============================================================================
+
+
 class FileOrStream(object):
     def __init__(self, file_name, stream=sys.stdout):
         self.file_name = file_name
@@ -801,6 +1749,24 @@ def main():
         type=float,
         default=0.01,
         help="Regularization coefficient (def. 0.01)")
+    parser.add_argument(
+        "--solver",
+        type=str,
+        choices=("dense", "sparse"),
+        default="dense",
+        help="Solver backend. 'sparse' keeps A sparse and reports time and "
+        "memory use of each phase (def. dense)")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Load input files one at a time, accumulating the normal "
+        "equations of the sparse solver, instead of loading all of them")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes solving tags, or loading files with "
+        "--stream, in parallel (def. 1)")
     parser.add_argument(
         "--all",
         action="store_true",
@@ -841,47 +1807,44 @@ def main():
     # Compute threshold
     th = args.t
 
-    # Load and filter segdata
-    segdata = []
-
     def tagfilter(tag):
         if args.f is None:
             return True
         return args.f in tag
 
-    for name in args.files:
-        print(name)
-        segdata.extend(load_data(name, tagfilter, address_map))
+    timer = PhaseTimer()
+
+    # Load and filter segdata
+    if args.stream:
+        # Accumulates the equations of all tags and bits while loading, the
+        # tags and bits to solve are selected below.
+        segdata = None
+        with timer.phase("build"):
+            summary, equations = stream_equations(
+                args.files,
+                tagfilter,
+                address_map,
+                bias=args.b,
+                solve_all=args.all,
+                jobs=args.jobs)
+    else:
+        segdata = []
+        for name in args.files:
+            print(name)
+            segdata.extend(load_data(name, tagfilter, address_map))
+        summary = summarize_segdata(segdata)
 
     # Make list of all bits
-    all_bits = set()
-    for seg in segdata:
-        all_bits |= set(seg["bit"])
-    all_bits = sorted(list(all_bits), key=sort_bits)
+    all_bits = sorted(list(summary["bits"]), key=sort_bits)
 
     # Detect bits that are always set
-    const1_bits = set(all_bits)
-    for seg in segdata:
-        const1_bits &= set(seg["bit"])
+    const1_bits = summary["const1_bits"] or set()
 
     # Make list of all tags
-    all_tags = set()
-    for seg in segdata:
-        all_tags |= set([tag[0] for tag in seg["tag"]])
-    all_tags = sorted(list(all_tags))
+    all_tags = sorted(list(summary["tag_count"].keys()))
 
     # Count 0s and 1s for each tag
-    tag_count = {}
-    for seg in segdata:
-        for tag, val in seg["tag"]:
-
-            if tag not in tag_count:
-                tag_count[tag] = [0, 0]
-
-            if val > 0:
-                tag_count[tag][1] += 1
-            else:
-                tag_count[tag][0] += 1
+    tag_count = summary["tag_count"]
 
     # Identify const0 and const1 tags
     const_tags = {}
@@ -895,12 +1858,12 @@ def main():
     const1_tags = [t for t, v in const_tags.items() if v == 1]
 
     # Print config
-    print("# segs:", len(segdata))
+    print("# segs:", summary["segs"])
     print("# tags:", len(all_tags))
     print("# bits:", len(all_bits))
     print("threshold: %.2f" % th)
 
-    if len(segdata) == 0:
+    if summary["segs"] == 0:
         print("No data!")
         exit(-1)
 
@@ -929,22 +1892,42 @@ def main():
     for bit in const1_bits:
         bits_to_solve.remove(bit)
 
-    # Statistics
-    tag_stats = compute_tag_stats(tags_to_solve, segdata)
+    # Statistics, the same as compute_tag_stats()
+    tag_stats = {tag: tuple(tag_count[tag]) for tag in tags_to_solve}
 
     # Solve
     print("Solving...")
-    if args.all:
-        X, E = solve_tichonov(
-            tags_to_solve, bits_to_solve, segdata, bias=args.b, a=args.a)
+    if args.stream:
+        with timer.phase("build"):
+            equations = select_equations(
+                equations, tags_to_solve, bits_to_solve)
+
+        if args.all:
+            X, E = solve_normal_equations(equations, a=args.a, timer=timer)
+        else:
+            X, E = solve_equations_onebyone(
+                equations, tags_to_solve, bits_to_solve, a=args.a, timer=timer)
     else:
-        X, E = solve_onebyone(
-            tags_to_solve,
-            bits_to_solve,
-            segdata,
-            solver=solve_tichonov,
-            bias=args.b,
-            a=args.a)
+        solver_kw = {"bias": args.b, "a": args.a}
+        if args.solver == "sparse":
+            solver = solve_tichonov_sparse
+            solver_kw["timer"] = timer
+        else:
+            solver = solve_tichonov
+
+        if args.all:
+            X, E = solver(tags_to_solve, bits_to_solve, segdata, **solver_kw)
+        else:
+            X, E = solve_onebyone(
+                tags_to_solve,
+                bits_to_solve,
+                segdata,
+                solver=solver,
+                jobs=args.jobs,
+                **solver_kw)
+
+    if args.stream or args.solver == "sparse":
+        timer.dump(sys.stdout)
 
     # Detect candidate bits
     W, X = detect_candidates(X, th, norm="max_abs")
@@ -955,12 +1938,9 @@ def main():
         tags = [t for t in tags_to_solve if args.m in t]
         for tag in tags:
             i = tags_to_solve.index(tag)
-            for r in range(len(tags_to_solve)):
-                if r == i:
-                    continue
-                for c in range(len(bits_to_solve)):
-                    if W[r, c] == W[i, c]:
-                        W[r, c] = 0
+            mask = W == W[i, :]
+            mask[i, :] = False
+            W[mask] = 0
 
     # Reject 0s and/or 1s
     if args.no_0:
@@ -974,8 +1954,13 @@ def main():
             W[r, :] = 0
 
     # Compute correlation
-    C, correlation_exceptions = compute_bit_correlations(
-        tags_to_solve, bits_to_solve, segdata, W)
+    if args.stream:
+        C, correlation_exceptions = stream_bit_correlations(
+            args.files, tagfilter, address_map, tags_to_solve, bits_to_solve,
+            W, args.jobs)
+    else:
+        C, correlation_exceptions = compute_bit_correlations(
+            tags_to_solve, bits_to_solve, segdata, W)
 
     # Write segbits
     write_segbits(args.o, tags_to_solve, bits_to_solve, W)
@@ -23,7 +23,10 @@ tag CLB.SLICE_X0.BFF.DMUX.BX 0
 tilegrid.json provides tile addresses
 '''
 
+from collections import namedtuple
+import multiprocessing
 import os, json, re
+from prjxray import bitstream
 from prjxray import util
 
 BLOCK_TYPES = set(('CLB_IO_CLK', 'BLOCK_RAM', 'CFG_CLB'))
@@ -81,8 +84,133 @@ def add_site_group_zero(segmk, site, prefix, vals, zero_val, val):
             segmk.add_site_tag(site, tag, False)
 
 
+def normalize_tile_type(tile_type):
+    '''
+    Simplify names by simplifying like:
+    -CLBLM_L => CLB
+    -CENTER_INTER_R => CENTER_INTER
+    -CLK_HROW_TOP_R => CLK_HROW
+    -LIOB33 => IOB33
+    -LIOI3 => IOI3
+    '''
+    tile_type_norm = re.sub("(_TOP|_BOT|LL|LM)?_[LR]$", "", tile_type)
+    tile_type_norm = re.sub("_TOP_[LR]_UPPER", "_UPPER", tile_type_norm)
+
+    if tile_type_norm in ['LIOB33', 'RIOB33']:
+        tile_type_norm = 'IOB33'
+
+    if tile_type_norm in ['LIOI3', 'RIOI3']:
+        tile_type_norm = 'IOI3'
+    if tile_type_norm in ['LIOI3_TBYTESRC', 'RIOI3_TBYTESRC']:
+        tile_type_norm = 'IOI3'
+    if tile_type_norm in ['LIOI3_TBYTETERM', 'RIOI3_TBYTETERM']:
+        tile_type_norm = 'IOI3'
+    if tile_type_norm in ['CMT_TOP_L_LOWER_B', 'CMT_TOP_R_LOWER_B']:
+        tile_type_norm = 'CMT_LOWER_B'
+    if 'GTP_CHANNEL' in tile_type_norm:
+        tile_type_norm = 'GTP_CHANNEL'
+    if 'GTP_COMMON' in tile_type_norm:
+        tile_type_norm = 'GTP_COMMON'
+    if 'GTP_INT_INTERFACE' in tile_type_norm:
+        tile_type_norm = 'GTP_INT_INTERFACE'
+
+    return tile_type_norm
+
+
+# Configuration block of a tile, see SegmakerContext.tile_blocks.
+#
+# segname: Name of the segment of the block in segdata files, the FDRI base
+#          address and word offset, e.g. 00020500_004.
+TileBlock = namedtuple('TileBlock', 'base_address frames offset words segname')
+
+
+class SegmakerContext:
+    '''
+    tilegrid.json of a fabric, indexed for Segmaker
+
+    Loaded once per fabric by get_segmaker_context and shared by all
+    Segmaker of the process.  Can be pickled to pass it to worker processes.
+    Treat as read only.
+    '''
+
+    def __init__(self, db_root, fabric):
+        self.db_root = db_root
+        self.fabric = fabric
+
+        fname = os.path.join(db_root, fabric, "tilegrid.json")
+        self.mtime = os.path.getmtime(fname)
+        with open(fname, "r") as f:
+            self.grid = json.load(f)
+        assert "segments" not in self.grid, "Old format tilegrid.json"
+
+        # site -> tilename
+        self.sites = {}
+        # site -> list of tilenames, in grid order
+        self.site_tiles = {}
+        # tilename -> position in the grid
+        self.tile_order = {}
+        # tilename -> block type -> TileBlock
+        self.tile_blocks = {}
+        # tile type -> normalized tile type, in grid order
+        self.tile_type_norms = {}
+
+        for idx, (tilename, tiledata) in enumerate(self.grid.items()):
+            self.tile_order[tilename] = idx
+            for site in tiledata["sites"]:
+                self.sites[site] = tilename
+                self.site_tiles.setdefault(site, []).append(tilename)
+
+            self.tile_blocks[tilename] = {
+                block_type: TileBlock(
+                    base_address=json_hex2i(bitj["baseaddr"]),
+                    frames=bitj["frames"],
+                    offset=bitj["offset"],
+                    words=bitj["words"],
+                    # truncate 0x to leave hex string
+                    segname="%s_%03d" % (bitj["baseaddr"][2:], bitj["offset"]),
+                )
+                for block_type, bitj in tiledata["bits"].items()
+            }
+
+            tile_type = tiledata["type"]
+            if tile_type not in self.tile_type_norms:
+                self.tile_type_norms[tile_type] = normalize_tile_type(
+                    tile_type)
+
+
+# (db_root, fabric) -> SegmakerContext
+_SEGMAKER_CONTEXTS = {}
+
+
+def get_segmaker_context(db_root, fabric):
+    '''
+    Return the SegmakerContext of fabric
+
+    Loaded on first use, and again if tilegrid.json changed since.
+    '''
+    key = (db_root, fabric)
+    context = _SEGMAKER_CONTEXTS.get(key)
+    if context is None or context.mtime != os.path.getmtime(os.path.join(
+            db_root, fabric, "tilegrid.json")):
+        context = SegmakerContext(db_root, fabric)
+        _SEGMAKER_CONTEXTS[key] = context
+
+    return context
+
+
 class Segmaker:
-    def __init__(self, bitsfile, verbose=None, db_root=None, fabric=None):
+    def __init__(
+            self, bitsfile, verbose=None, db_root=None, fabric=None,
+            context=None):
+        '''
+        context: SegmakerContext to use, instead of the one of db_root and
+                 fabric from get_segmaker_context.
+        '''
+        self.context = context
+        if context is not None:
+            db_root = context.db_root
+            fabric = context.fabric
+
         self.db_root = db_root
         if self.db_root is None:
             self.db_root = util.get_db_root()
@@ -115,10 +243,7 @@ class Segmaker:
 
     def index_sites(self):
         self.verbose and print("Indexing sites")
-        self.sites = {}
-        for tilename, tiledata in self.grid.items():
-            for site in tiledata["sites"]:
-                self.sites[site] = tilename
+        self.sites = self.context.sites
         self.verbose and print("Sites indexed")
 
     def set_def_bt(self, block_type):
@@ -129,45 +254,28 @@ class Segmaker:
 
     def load_grid(self):
         '''Load self.grid holding tile addresses'''
-        with open(os.path.join(self.db_root, self.fabric, "tilegrid.json"),
-                  "r") as f:
-            self.grid = json.load(f)
-        assert "segments" not in self.grid, "Old format tilegrid.json"
+        if self.context is None:
+            self.context = get_segmaker_context(self.db_root, self.fabric)
+        self.grid = self.context.grid
 
     def load_bits(self, bitsfile):
         '''Load self.bits holding the bits that occured in the bitstream'''
         '''
         Format:
-        self.bits[base_frame][bit_wordidx] = set()
-        Where elements are (bit_frame, bit_wordidx, bit_bitidx))
-        bit_frame is a relatively large number forming the FDRI address
-        base_frame is a truncated bit_frame address of related FDRI addresses
-        0 <= bit_wordidx <= 100
-        0 <= bit_bitidx < 31
+        self.bits is a bitstream.FrameBits, see FrameBits.select
 
         Sample bits input
         bit_00020500_000_08
         bit_00020500_000_14
         bit_00020500_000_17
         '''
-        self.bits = dict()
         print("Loading bits from %s." % bitsfile)
         with open(bitsfile, "r") as f:
-            for line in f:
-                # ex: bit_00020500_000_17
-                line = line.split("_")
-                bit_frame = int(line[1], 16)
-                bit_wordidx = int(line[2], 10)
-                bit_bitidx = int(line[3], 10)
-                base_frame = bit_frame & ~0x7f
-
-                self.bits.setdefault(base_frame, dict()).setdefault(
-                    bit_wordidx, set()).add(
-                        (bit_frame, bit_wordidx, bit_bitidx))
+            self.bits = bitstream.FrameBits.load(f)
         if self.verbose:
             print(
-                'Loaded bits: %u bits in %u base frames' %
-                (recurse_sum(self.bits), len(self.bits)))
+                'Loaded bits: %u bits in %u frames' %
+                (len(self.bits), len(self.bits.frames)))
 
     def add_site_tag(self, site, name, value):
         '''
@@ -200,11 +308,10 @@ class Segmaker:
         print("Compiling segment data.")
         tags_used = set()
         sites_used = set()
-        tile_types_found = set()
 
         self.segments_by_type = dict()
 
-        def add_segbits(segments, segname, tiledata, bitfilter=None):
+        def add_segbits(segments, segname, block, bitfilter=None):
             '''
             Add and populate segments[segname]["bits"]
             Gives all of the bits that could exist for the space we are exploring
@@ -216,7 +323,7 @@ class Segmaker:
             segments[segname]["tags"][tag] = value
 
             segname: FDRI address + word offset string
-            tiledata: tilegrid info for this tile
+            block: TileBlock of the tile
             '''
             assert segname not in segments
             segment = segments.setdefault(
@@ -225,52 +332,48 @@ class Segmaker:
                     "bits": set(),
                     "tags": dict(),
                     # verify new entries match this
-                    "offset": bitj["offset"],
-                    "words": bitj["words"],
-                    "frames": bitj["frames"],
+                    "offset": block.offset,
+                    "words": block.words,
+                    "frames": block.frames,
                 })
 
-            base_frame = json_hex2i(bitj["baseaddr"])
-            for wordidx in range(bitj["offset"],
-                                 bitj["offset"] + bitj["words"]):
-                if base_frame not in self.bits:
-                    continue
-                if wordidx not in self.bits[base_frame]:
-                    continue
-                for bit_frame, bit_wordidx, bit_bitidx in self.bits[
-                        base_frame][wordidx]:
-                    bitname_frame = bit_frame - base_frame
-                    bitname_bit = 32 * (
-                        bit_wordidx - bitj["offset"]) + bit_bitidx
-
-                    # Skip bits above the frame limit.
-                    if bitname_frame >= bitj["frames"]:
-                        continue
-
-                    # some bits are hard to de-correlate
-                    # allow force dropping some bits from search space for practicality
-                    if bitfilter is None or bitfilter(bitname_frame,
-                                                      bitname_bit):
-                        bitname = "%02d_%02d" % (bitname_frame, bitname_bit)
-                        segment["bits"].add(bitname)
+            frame_offsets, bit_offsets = self.bits.select(
+                block.base_address, block.frames, block.offset, block.words)
+            for bitname_frame, bitname_bit in zip(frame_offsets.tolist(),
+                                                  bit_offsets.tolist()):
+                # some bits are hard to de-correlate
+                # allow force dropping some bits from search space for practicality
+                if bitfilter is None or bitfilter(bitname_frame, bitname_bit):
+                    bitname = "%02d_%02d" % (bitname_frame, bitname_bit)
+                    segment["bits"].add(bitname)
 
             return segment
 
-        '''
-        XXX: wouldn't it be better to iterate over tags? Easy to drop tags
-        For now, add a check that all tags are used
-        '''
-        for tilename, tiledata in self.grid.items():
+        # Only tiles with tags contribute segments, visit them in grid order
+        # like a full scan would.
+        context = self.context
+        tagged_tiles = set(
+            tilename for tilename in self.tile_tags
+            if tilename in context.tile_order)
+        for site in self.site_tags:
+            tagged_tiles.update(context.site_tiles.get(site, ()))
+
+        for tile_type in context.tile_type_norms:
+            self.segments_by_type[tile_type] = dict()
+
+        for tilename in sorted(tagged_tiles,
+                               key=context.tile_order.__getitem__):
+            tiledata = self.grid[tilename]
 
             def getseg(segname):
                 if not segname in segments:
                     return add_segbits(
-                        segments, segname, tiledata, bitfilter=bitfilter)
+                        segments, segname, block, bitfilter=bitfilter)
                 else:
                     segment = segments[segname]
-                    assert segment["offset"] == bitj["offset"]
-                    assert segment["words"] == bitj["words"]
-                    assert segment["frames"] == bitj["frames"]
+                    assert segment["offset"] == block.offset
+                    assert segment["words"] == block.words
+                    assert segment["frames"] == block.frames
                     return segment
 
             def add_tilename_tags():
@@ -350,40 +453,13 @@ class Segmaker:
                 sites_used.add(site)
 
             tile_type = tiledata["type"]
-            tile_types_found.add(tile_type)
-            segments = self.segments_by_type.setdefault(tile_type, dict())
-            '''
-            Simplify names by simplifying like:
-            -CLBLM_L => CLB
-            -CENTER_INTER_R => CENTER_INTER
-            -CLK_HROW_TOP_R => CLK_HROW
-            -LIOB33 => IOB33
-            -LIOI3 => IOI3
-            '''
-            tile_type_norm = re.sub("(_TOP|_BOT|LL|LM)?_[LR]$", "", tile_type)
-            tile_type_norm = re.sub(
-                "_TOP_[LR]_UPPER", "_UPPER", tile_type_norm)
-
-            if tile_type_norm in ['LIOB33', 'RIOB33']:
-                tile_type_norm = 'IOB33'
-
-            if tile_type_norm in ['LIOI3', 'RIOI3']:
-                tile_type_norm = 'IOI3'
-            if tile_type_norm in ['LIOI3_TBYTESRC', 'RIOI3_TBYTESRC']:
-                tile_type_norm = 'IOI3'
-            if tile_type_norm in ['LIOI3_TBYTETERM', 'RIOI3_TBYTETERM']:
-                tile_type_norm = 'IOI3'
-            if tile_type_norm in ['CMT_TOP_L_LOWER_B', 'CMT_TOP_R_LOWER_B']:
-                tile_type_norm = 'CMT_LOWER_B'
-            if 'GTP_CHANNEL' in tile_type_norm:
-                tile_type_norm = 'GTP_CHANNEL'
-            if 'GTP_COMMON' in tile_type_norm:
-                tile_type_norm = 'GTP_COMMON'
-            if 'GTP_INT_INTERFACE' in tile_type_norm:
-                tile_type_norm = 'GTP_INT_INTERFACE'
+            segments = self.segments_by_type[tile_type]
+            tile_type_norm = context.tile_type_norms[tile_type]
+
+            blocks = context.tile_blocks[tilename]
 
             # ignore dummy tiles (ex: VBRK)
-            if len(tiledata['bits']) == 0:
+            if len(blocks) == 0:
                 if self.verbose:
                     for site in tiledata["sites"]:
                         assert site not in self.site_tags, "Site %s does not have bitstream info" % site
@@ -391,18 +467,14 @@ class Segmaker:
                 assert this_tile_tags == 0, "Tile %s does not have bitstream info but %s tags" % (
                     tilename, this_tile_tags)
                 continue
-            elif len(tiledata['bits']) == 1:
-                bitj = list(tiledata['bits'].values())[0]
+            elif len(blocks) == 1:
+                block = list(blocks.values())[0]
             else:
-                assert self.def_bt in tiledata[
-                    'bits'], 'Default block not present: %s' % self.def_bt
-                bitj = tiledata['bits'][self.def_bt]
+                assert self.def_bt in blocks, 'Default block not present: %s' % self.def_bt
+                block = blocks[self.def_bt]
 
             # NOTE: multiple tiles may have the same base addr + offset
-            segname = "%s_%03d" % (
-                # truncate 0x to leave hex string
-                bitj["baseaddr"][2:],
-                bitj["offset"])
+            segname = block.segname
 
             # process tile name tags
             if tilename in self.tile_tags:
@@ -425,7 +497,9 @@ class Segmaker:
                 print('  Ex: %s' % list(self.site_tags.keys())[0])
             print("Tag tiles: %u" % (n_tile_tags, ))
             print("Used %u sites" % len(sites_used))
-            print("Grid DB had %u tile types" % len(tile_types_found))
+            print(
+                "Grid DB had %u tile types" % len(
+                    self.context.tile_type_norms))
         assert ntags == len(tags_used), "Unused tags, %s used out of %s" % (
             len(tags_used), ntags)
 
@@ -454,3 +528,77 @@ class Segmaker:
                             print("bit %s" % bitname, file=f)
                         for tagname, tagval in sorted(segdata["tags"].items()):
                             print("tag %s %d" % (tagname, tagval), file=f)
+
+
+# State shared with forked specimen workers, see run_specimens.
+_SPECIMEN_CONTEXT = None
+_SPECIMEN_OPTIONS = None
+
+
+def _run_specimen(specimen_dir):
+    '''Make the segdata files of one specimen, in the specimen directory'''
+    tag_specimen, bits_file, bitfilter, suffix, allow_empty, verbose = \
+        _SPECIMEN_OPTIONS
+
+    cwd = os.getcwd()
+    os.chdir(specimen_dir)
+    try:
+        segmk = Segmaker(bits_file, verbose=verbose, context=_SPECIMEN_CONTEXT)
+        tag_specimen(segmk)
+        segmk.compile(bitfilter=bitfilter)
+        segmk.write(suffix=suffix, allow_empty=allow_empty)
+    finally:
+        os.chdir(cwd)
+
+
+def run_specimens(
+        specimen_dirs,
+        tag_specimen,
+        jobs=1,
+        bits_file="design.bits",
+        bitfilter=None,
+        suffix=None,
+        allow_empty=False,
+        db_root=None,
+        fabric=None,
+        verbose=None):
+    '''
+    Write the segdata files of many specimens, like one generate.py each
+
+    For each specimen directory, a Segmaker of bits_file is created, passed
+    to tag_specimen(segmk) to add the tags, then compiled with bitfilter and
+    written with suffix and allow_empty.  All of it runs with the specimen
+    directory as working directory, so relative file names work as in
+    generate.py.
+
+    Specimens are processed one at a time by each of jobs forked workers,
+    which share the SegmakerContext loaded before forking, so tilegrid.json
+    is read once.  tag_specimen and bitfilter are inherited by the workers,
+    they need not be picklable.
+    '''
+    global _SPECIMEN_CONTEXT, _SPECIMEN_OPTIONS
+
+    if db_root is None:
+        db_root = util.get_db_root()
+        assert db_root, "No db root specified."
+    if fabric is None:
+        fabric = util.get_fabric()
+        assert fabric, "No fabric specified."
+
+    specimen_dirs = [os.path.abspath(d) for d in specimen_dirs]
+
+    _SPECIMEN_CONTEXT = get_segmaker_context(db_root, fabric)
+    _SPECIMEN_OPTIONS = (
+        tag_specimen, bits_file, bitfilter, suffix, allow_empty, verbose)
+    try:
+        if jobs <= 1 or len(specimen_dirs) <= 1:
+            for specimen_dir in specimen_dirs:
+                _run_specimen(specimen_dir)
+        else:
+            with multiprocessing.get_context('fork').Pool(min(
+                    jobs, len(specimen_dirs))) as pool:
+                for _ in pool.imap_unordered(_run_specimen, specimen_dirs):
+                    pass
+    finally:
+        _SPECIMEN_CONTEXT = None
+        _SPECIMEN_OPTIONS = None
@@ -8,23 +8,100 @@
 # https://opensource.org/licenses/ISC
 #
 # SPDX-License-Identifier: ISC
-from intervaltree import IntervalTree, Interval
-from prjxray import bitstream
+import numpy as np
 
 
 class SegmentMap(object):
+    """ Maps frame addresses to the tile blocks (BitsInfo) using them.
+
+    Tile blocks are grouped by their frame range (base address and frame
+    count), as all tiles of a column share the same range.  Every frame
+    address covered by any range is then mapped to the tuple of BitsInfo of
+    all ranges covering it.  Frames with the same set of covering ranges
+    share one tuple.
+
+    """
+
     def __init__(self, grid):
-        self.segment_tree = IntervalTree()
+        # (base_address, frames) -> list of BitsInfo
+        ranges = {}
 
         for bits_info in grid.iter_all_frames():
-            self.segment_tree.add(
-                Interval(
-                    begin=bits_info.bits.base_address,
-                    end=bits_info.bits.base_address + bits_info.bits.frames,
-                    data=bits_info,
-                ))
+            key = (bits_info.bits.base_address, bits_info.bits.frames)
+            if key not in ranges:
+                ranges[key] = []
+
+            ranges[key].append(bits_info)
+
+        range_keys = list(ranges.keys())
+        range_infos = [tuple(ranges[key]) for key in range_keys]
+
+        base_addresses = np.array(
+            [base_address for base_address, _ in range_keys], dtype=np.int64)
+        frame_counts = np.array(
+            [frames for _, frames in range_keys], dtype=np.int64)
+
+        # Expand each range to one (frame, range index) pair per frame.
+        range_idx = np.repeat(np.arange(len(range_keys)), frame_counts)
+        range_start = np.repeat(
+            np.cumsum(frame_counts) - frame_counts, frame_counts)
+        frames = np.repeat(base_addresses, frame_counts) + (
+            np.arange(len(range_idx)) - range_start)
+
+        order = np.lexsort((range_idx, frames))
+        frames = frames[order]
+        range_idx = range_idx[order]
+
+        # Sorted unique frame addresses, and for each the index into
+        # self.segments of the BitsInfo tuple for that frame.
+        self.frame_addresses, first = np.unique(frames, return_index=True)
+
+        self.segments = []
+        segment_idx = {}
+        frame_segment_idx = []
+
+        range_idx = range_idx.tolist()
+        bounds = first.tolist() + [len(range_idx)]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            key = tuple(range_idx[start:end])
+            if key not in segment_idx:
+                segment_idx[key] = len(self.segments)
+                self.segments.append(
+                    tuple(
+                        bits_info for ridx in key
+                        for bits_info in range_infos[ridx]))
+
+            frame_segment_idx.append(segment_idx[key])
+
+        self.frame_segment_idx = np.array(frame_segment_idx, dtype=np.int64)
+        self.frame_segments = dict(
+            zip(
+                self.frame_addresses.tolist(),
+                (self.segments[idx] for idx in frame_segment_idx)))
 
     def segment_info_for_frame(self, frame):
         """ Return all bits info that match frame address. """
-        for frame in self.segment_tree[frame]:
-            yield frame.data
+        return iter(self.frame_segments.get(frame, ()))
+
+    def segment_info_for_frames(self, frames):
+        """ Return bits info for many frame addresses at once.
+
+        frames: Iterable or array of frame addresses.
+
+        Returns a dict of frame address to tuple of BitsInfo, for each frame
+        in frames used by at least one tile.
+
+        """
+        frames = np.unique(np.fromiter(frames, dtype=np.int64))
+        if len(self.frame_addresses) == 0:
+            return {}
+
+        pos = np.searchsorted(self.frame_addresses, frames)
+        pos[pos == len(self.frame_addresses)] = 0
+        found = self.frame_addresses[pos] == frames
+
+        return dict(
+            zip(
+                frames[found].tolist(), (
+                    self.segments[idx]
+                    for idx in self.frame_segment_idx[pos[found]].tolist())))
@@ -260,7 +260,15 @@ def is_pass_transistor(pip_json):
 class Tile(object):
     """ Provides abstration of a tile in the database. """
 
-    def __init__(self, tilename, tile_dbs):
+    def __init__(self, tilename, tile_dbs, tile_type_json=None):
+        """ Create Tile for a tile type.
+
+        tilename: Name of the tile type.
+        tile_dbs: TileDbs for the tile type.
+        tile_type_json: Optional already parsed tile_type_*.json contents.
+                        When None, tile_dbs.tile_type is read.
+
+        """
         self.tilename = tilename
         self.tilename_upper = self.tilename.upper()
         self.tile_dbs = tile_dbs
@@ -313,12 +321,14 @@ class Tile(object):
                     backward_timing=get_pip_timing(pip.get('dst_to_src')),
                 )
 
-        with open(self.tile_dbs.tile_type) as f:
-            tile_type = json.load(f)
-            assert self.tilename_upper == tile_type['tile_type']
-            self.wires = get_wires(tile_type['wires'])
-            self.sites = tuple(yield_sites(tile_type['sites']))
-            self.pips = tuple(yield_pips(tile_type['pips']))
+        if tile_type_json is None:
+            with open(self.tile_dbs.tile_type) as f:
+                tile_type_json = json.load(f)
+
+        assert self.tilename_upper == tile_type_json['tile_type']
+        self.wires = get_wires(tile_type_json['wires'])
+        self.sites = tuple(yield_sites(tile_type_json['sites']))
+        self.pips = tuple(yield_pips(tile_type_json['pips']))
 
         self.wire_info = {}
 
@@ -9,6 +9,8 @@
 #
 # SPDX-License-Identifier: ISC
 from collections import namedtuple
+from collections.abc import Mapping
+import numpy as np
 from prjxray import bitstream
 from prjxray.grid_types import BlockType
 import enum
@@ -37,6 +39,33 @@ def read_ppips(f):
 
 Bit = namedtuple('Bit', 'word_column word_bit isset')
 
+# Inverted index of the segbits of one block type, see
+# TileSegbits.get_segbits_index.
+#
+# features: List of (feature, segbit list) tuples, in segbits order.
+# columns: Tuple of (word_column, words), where words is a tuple of
+#          (relative word, ((word_bit, feature indices), ...)).  Each
+#          feature index is present under every bit the feature requires set.
+# always_check: Indices of features that require no bits set.  These
+#               features cannot be found from set bits, so are always checked.
+SegbitsIndex = namedtuple('SegbitsIndex', 'features columns always_check')
+
+# Matrix form of the segbits of one block type, see
+# TileSegbits.get_segbits_matrix.
+#
+# features: List of features, in segbits order (matrix rows).
+# word_columns, word_bits: Arrays of the word_column and word_bit of each
+#                          bit used by any feature (matrix columns).
+# weights: float32 features x bits matrix, 1 where the feature requires the
+#          bit set, -1 where it requires the bit clear, 0 otherwise.
+# ones_count: Number of bits each feature requires set, inf for features
+#             that require a bit both set and clear and so never match.
+#
+# With x the 0/1 values of the bits of a tile, feature f matches when
+# weights[f] @ x == ones_count[f].
+SegbitsMatrix = namedtuple(
+    'SegbitsMatrix', 'features word_columns word_bits weights ones_count')
+
 
 def parsebit(val):
     '''Return "!012_23" => (12, 23, False)'''
@@ -57,6 +86,37 @@ def parsebit(val):
     )
 
 
+def segbits_matrix(features):
+    """ Return SegbitsMatrix of list of (feature, segbit list) tuples. """
+    columns = {}
+    for _, segbit in features:
+        for bit in segbit:
+            columns.setdefault((bit.word_column, bit.word_bit), len(columns))
+
+    weights = np.zeros((len(features), len(columns)), dtype=np.float32)
+    ones_count = np.zeros(len(features), dtype=np.float32)
+
+    for idx, (_, segbit) in enumerate(features):
+        for bit in segbit:
+            column = columns[(bit.word_column, bit.word_bit)]
+            weight = 1 if bit.isset else -1
+            if weights[idx, column] == -weight:
+                ones_count[idx] = np.inf
+            elif weights[idx, column] == 0:
+                ones_count[idx] += bit.isset
+
+            weights[idx, column] = weight
+
+    keys = list(columns.keys())
+    return SegbitsMatrix(
+        features=[feature for feature, _ in features],
+        word_columns=np.array([k[0] for k in keys], dtype=np.int64),
+        word_bits=np.array([k[1] for k in keys], dtype=np.int64),
+        weights=weights,
+        ones_count=ones_count,
+    )
+
+
 def read_segbits(f):
     segbits = {}
 
@@ -76,25 +136,90 @@ def read_segbits(f):
     return segbits
 
 
+def read_tile_segbits(tile_db):
+    """ Read the segbits and ppips files of a tile type.
+
+    Returns (segbits, ppips), where segbits is a map of BlockType to the
+    output of read_segbits, and ppips is the output of read_ppips.
+
+    """
+    segbits = {}
+    ppips = {}
+
+    if tile_db.ppips is not None:
+        with open(tile_db.ppips) as f:
+            ppips = read_ppips(f)
+
+    if tile_db.segbits is not None:
+        with open(tile_db.segbits) as f:
+            segbits[BlockType.CLB_IO_CLK] = read_segbits(f)
+
+    if tile_db.block_ram_segbits is not None:
+        with open(tile_db.block_ram_segbits) as f:
+            segbits[BlockType.BLOCK_RAM] = read_segbits(f)
+
+    return segbits, ppips
+
+
+class LazySegbits(Mapping):
+    """ BlockType to segbits map that loads each block type on first use.
+
+    loaders: Map of BlockType to a function returning the segbits of that
+             block type, see read_segbits.  Iteration follows its order.
+
+    """
+
+    def __init__(self, loaders):
+        self.loaders = loaders
+        self.loaded = {}
+
+    def __getitem__(self, block_type):
+        if block_type not in self.loaded:
+            self.loaded[block_type] = self.loaders[block_type]()
+
+        return self.loaded[block_type]
+
+    def __contains__(self, block_type):
+        return block_type in self.loaders
+
+    def __iter__(self):
+        return iter(self.loaders)
+
+    def is_loaded(self, block_type):
+        return block_type in self.loaded
+
+    def __len__(self):
+        return len(self.loaders)
+
+
 class TileSegbits(object):
-    def __init__(self, tile_db):
-        self.segbits = {}
-        self.ppips = {}
-        self.feature_addresses = {}
+    def __init__(self, tile_db, parsed=None):
+        """ Create TileSegbits for a tile type.
+
+        tile_db: TileDbs for the tile type.
+        parsed: Optional (segbits, ppips) tuple, as returned by
+                read_tile_segbits.  When provided, tile_db files are not read.
+                segbits may be a LazySegbits, block types are then only
+                loaded when bits or features of that block type are needed.
+
+        """
+        if parsed is None:
+            parsed = read_tile_segbits(tile_db)
 
-        if tile_db.ppips is not None:
-            with open(tile_db.ppips) as f:
-                self.ppips = read_ppips(f)
+        self.segbits, self.ppips = parsed
+        self.feature_addresses = {}
+        self.segbits_index = {}
+        self.segbits_matrix = {}
 
-        if tile_db.segbits is not None:
-            with open(tile_db.segbits) as f:
-                self.segbits[BlockType.CLB_IO_CLK] = read_segbits(f)
+    def get_feature_addresses(self, block_type):
+        """ Return map of base feature to map of address to feature.
 
-        if tile_db.block_ram_segbits is not None:
-            with open(tile_db.block_ram_segbits) as f:
-                self.segbits[BlockType.BLOCK_RAM] = read_segbits(f)
+        E.g. CLBLM_L.SLICEL_X1.ALUT.INIT -> 10 -> CLBLM_L.SLICEL_X1.ALUT.INIT[10]
+        for the features of block_type.
 
-        for block_type in self.segbits:
+        """
+        if block_type not in self.feature_addresses:
+            feature_addresses = {}
             for feature in self.segbits[block_type]:
                 sidx = feature.rfind('[')
                 eidx = feature.rfind(']')
@@ -104,23 +229,103 @@ class TileSegbits(object):
 
                     base_feature = feature[:sidx]
 
-                    if base_feature not in self.feature_addresses:
-                        self.feature_addresses[base_feature] = {}
+                    if base_feature not in feature_addresses:
+                        feature_addresses[base_feature] = {}
+
+                    feature_addresses[base_feature][int(
+                        feature[sidx + 1:eidx])] = feature
+
+            self.feature_addresses[block_type] = feature_addresses
+
+        return self.feature_addresses[block_type]
+
+    def get_segbits_index(self, block_type):
+        """ Return SegbitsIndex for block_type, building it on first use. """
+        if block_type not in self.segbits_index:
+            features = list(self.segbits[block_type].items())
+            columns = {}
+            always_check = []
+
+            for idx, (feature, segbit) in enumerate(features):
+                any_set = False
+                for bit in segbit:
+                    if not bit.isset:
+                        continue
+
+                    any_set = True
+                    words = columns.setdefault(bit.word_column, {})
+                    word_bits = words.setdefault(
+                        bit.word_bit // bitstream.WORD_SIZE_BITS, {})
+                    word_bits.setdefault(bit.word_bit, []).append(idx)
+
+                if not any_set:
+                    always_check.append(idx)
+
+            self.segbits_index[block_type] = SegbitsIndex(
+                features=features,
+                columns=tuple(
+                    (
+                        word_column,
+                        tuple(
+                            (word, tuple(word_bits.items()))
+                            for word, word_bits in words.items()),
+                    )
+                    for word_column, words in columns.items()),
+                always_check=tuple(always_check),
+            )
+
+        return self.segbits_index[block_type]
+
+    def get_segbits_matrix(self, block_type):
+        """ Return SegbitsMatrix for block_type, building it on first use.
+
+        Returns None if the tile type has no segbits for block_type.
+
+        """
+        if block_type not in self.segbits:
+            return None
+
+        if block_type not in self.segbits_matrix:
+            self.segbits_matrix[block_type] = segbits_matrix(
+                list(self.segbits[block_type].items()))
 
-                    self.feature_addresses[base_feature][int(
-                        feature[sidx + 1:eidx])] = (block_type, feature)
+        return self.segbits_matrix[block_type]
 
     def match_bitdata(self, block_type, bits, bitdata, match_filter=None):
         """ Return matching features for tile bits data (grid.Bits) and bitdata.
 
         See bitstream.load_bitdata for details on bitdata structure.
 
+        Only features that require no bits set, or that require at least one
+        of the bits set in the tile, are checked against bitdata.  Features are
+        returned in segbits order.
+
         """
 
         if block_type not in self.segbits:
             return
 
-        for feature, segbit in self.segbits[block_type].items():
+        index = self.get_segbits_index(block_type)
+        bit_offset = bits.offset * bitstream.WORD_SIZE_BITS
+
+        candidates = set(index.always_check)
+        for word_column, words in index.columns:
+            frame = bits.base_address + word_column
+            if frame not in bitdata:
+                continue
+
+            set_words, set_bits = bitdata[frame]
+            for word, word_bits in words:
+                if bits.offset + word not in set_words:
+                    continue
+
+                for word_bit, feature_idxs in word_bits:
+                    if bit_offset + word_bit in set_bits:
+                        candidates.update(feature_idxs)
+
+        for idx in sorted(candidates):
+            feature, segbit = index.features[idx]
+
             match = True
             skip = False
             for query_bit in segbit:
@@ -130,7 +335,7 @@ class TileSegbits(object):
                     break
 
                 frame = bits.base_address + query_bit.word_column
-                bitidx = bits.offset * bitstream.WORD_SIZE_BITS + query_bit.word_bit
+                bitidx = bit_offset + query_bit.word_bit
 
                 if frame not in bitdata:
                     match = not query_bit.isset
@@ -152,7 +357,7 @@ class TileSegbits(object):
                 for query_bit in segbit:
                     if query_bit.isset:
                         frame = bits.base_address + query_bit.word_column
-                        bitidx = bits.offset * bitstream.WORD_SIZE_BITS + query_bit.word_bit
+                        bitidx = bit_offset + query_bit.word_bit
                         yield (frame, bitidx)
 
             yield (tuple(inner()), feature)
@@ -165,18 +370,39 @@ class TileSegbits(object):
             isset=bit.isset,
         )
 
+    def feature_block_types(self):
+        """ Return the block types of segbits, already loaded ones first.
+
+        Features are unique across the block types of a tile type, so
+        looking features up in this order finds the same bits, without
+        loading other block types of a LazySegbits for features of a loaded
+        one.
+
+        """
+        block_types = list(self.segbits)
+        if isinstance(self.segbits, LazySegbits):
+            block_types.sort(
+                key=lambda block_type: not self.segbits.is_loaded(block_type))
+
+        return block_types
+
     def feature_to_bits(self, bits_map, feature, address=0):
         if feature in self.ppips:
             return
 
-        for block_type in self.segbits:
-            if address == 0 and feature in self.segbits[block_type]:
-                for bit in self.segbits[block_type][feature]:
-                    yield block_type, self.map_bit_to_frame(
-                        block_type, bits_map[block_type], bit)
-                return
-
-        block_type, feature = self.feature_addresses[feature][address]
-        for bit in self.segbits[block_type][feature]:
-            yield block_type, self.map_bit_to_frame(
-                block_type, bits_map[block_type], bit)
+        for block_type in self.feature_block_types():
+            segbits = self.segbits[block_type]
+            if address == 0 and feature in segbits:
+                address_feature = feature
+            else:
+                address_feature = self.get_feature_addresses(block_type).get(
+                    feature, {}).get(address)
+                if address_feature is None:
+                    continue
+
+            for bit in segbits[address_feature]:
+                yield block_type, self.map_bit_to_frame(
+                    block_type, bits_map[block_type], bit)
+            return
+
+        raise KeyError((feature, address))
@@ -20,10 +20,37 @@ TileSegbitsAlias performs severals functions to achieve the alias:
 
 from prjxray import bitstream
 from prjxray.grid_types import Bits
-from prjxray.tile_segbits import read_ppips
+from prjxray.tile_segbits import Bit, segbits_matrix
+
+
+def alias_key(tile_type, bits_map):
+    """ Return hashable key identifying the alias of a tile.
+
+    Tiles with the same key can share one TileSegbitsAlias.
+
+    """
+    key = [tile_type]
+    for block_type in sorted(bits_map, key=lambda b: b.value):
+        bits = bits_map[block_type]
+        key.append(
+            (
+                block_type, bits.words,
+                bits.alias.tile_type, bits.alias.start_offset,
+                tuple(sorted(bits.alias.sites.items()))))
+
+    return tuple(key)
 
 
 class TileSegbitsAlias(object):
+    """ Alias of tile_type to another tile type.
+
+    The alias only depends on the tile type and the BitAlias and word count
+    of each block type, not on the tile location, so one instance can be
+    shared by all tiles with the same alias, see
+    Database.get_tile_segbits_alias.
+
+    """
+
     def __init__(self, db, tile_type, bits_map):
         # Name of tile_type that is using the alias
         self.tile_type = tile_type
@@ -34,24 +61,15 @@ class TileSegbitsAlias(object):
         # BlockType -> BitAlias map
         self.alias = {}
 
-        self.bits_map = bits_map
-
-        # BlockType -> aliased Bits map
-        self.alias_bits_map = {}
+        # BlockType -> number of words of the tile
+        self.words = {}
 
         # aliased site name to site name map
         self.sites_rev_map = {}
 
         for block_type in bits_map:
             self.alias[block_type] = bits_map[block_type].alias
-            self.alias_bits_map[block_type] = Bits(
-                base_address=bits_map[block_type].base_address,
-                frames=bits_map[block_type].frames,
-                offset=bits_map[block_type].offset -
-                self.alias[block_type].start_offset,
-                words=bits_map[block_type].words,
-                alias=None,
-            )
+            self.words[block_type] = bits_map[block_type].words
 
             if self.alias_tile_type is None:
                 self.alias_tile_type = self.alias[block_type].tile_type
@@ -63,13 +81,19 @@ class TileSegbitsAlias(object):
                 assert alias_site not in self.sites_rev_map[block_type]
                 self.sites_rev_map[block_type][alias_site] = site
 
-        tile_db = db.tile_types[self.tile_type]
-        self.ppips = {}
-
-        if tile_db.ppips is not None:
-            with open(tile_db.ppips) as f:
-                self.ppips = read_ppips(f)
+        self.ppips = db.get_tile_ppips(self.tile_type)
         self.tile_segbits = db.get_tile_segbits(self.alias_tile_type)
+        self.segbits_matrix = {}
+
+    def get_alias_bits(self, block_type, bits):
+        """ Map tile Bits to the Bits of the aliased tile type. """
+        return Bits(
+            base_address=bits.base_address,
+            frames=bits.frames,
+            offset=bits.offset - self.alias[block_type].start_offset,
+            words=bits.words,
+            alias=None,
+        )
 
     def map_feature_to_segbits(self, feature):
         """ Map from the output feature name to the aliased feature name. """
@@ -100,13 +124,13 @@ class TileSegbitsAlias(object):
     def match_filter(self, block_type, query_bit):
         word = query_bit.word_bit // bitstream.WORD_SIZE_BITS
         real_word = word - self.alias[block_type].start_offset
-        if real_word < 0 or real_word >= self.bits_map[block_type].words:
+        if real_word < 0 or real_word >= self.words[block_type]:
             return False
 
         return True
 
     def match_bitdata(self, block_type, bits, bitdata):
-        alias_bits = self.alias_bits_map[block_type]
+        alias_bits = self.get_alias_bits(block_type, bits)
 
         for bits_found, alias_feature in self.tile_segbits.match_bitdata(
                 block_type, alias_bits, bitdata,
@@ -115,11 +139,51 @@ class TileSegbitsAlias(object):
 
             yield (bits_found, feature)
 
+    def get_segbits_matrix(self, block_type):
+        """ Return SegbitsMatrix for block_type, relative to the tile bits.
+
+        Only aliased features with all bits inside the tile are included, as
+        in match_bitdata, with bits shifted by the alias start offset and
+        features renamed to this tile type.
+
+        """
+        if block_type not in self.tile_segbits.segbits:
+            return None
+
+        if block_type not in self.segbits_matrix:
+            start_bit = self.alias[block_type].start_offset * \
+                bitstream.WORD_SIZE_BITS
+
+            features = []
+            for alias_feature, segbit in self.tile_segbits.segbits[
+                    block_type].items():
+                if not all(
+                        self.match_filter(block_type, bit) for bit in segbit):
+                    continue
+
+                features.append(
+                    (
+                        self.map_feature_from_segbits(alias_feature), [
+                            Bit(
+                                word_column=bit.word_column,
+                                word_bit=bit.word_bit - start_bit,
+                                isset=bit.isset) for bit in segbit
+                        ]))
+
+            self.segbits_matrix[block_type] = segbits_matrix(features)
+
+        return self.segbits_matrix[block_type]
+
     def feature_to_bits(self, bits_map, feature, address=0):
         if feature in self.ppips:
             return
 
+        alias_bits_map = {}
+        for block_type in self.alias:
+            alias_bits_map[block_type] = self.get_alias_bits(
+                block_type, bits_map[block_type])
+
         alias_feature = self.map_feature_to_segbits(feature)
         for block_type, bit in self.tile_segbits.feature_to_bits(
-                self.alias_bits_map, alias_feature, address):
+                alias_bits_map, alias_feature, address):
             yield block_type, bit
@@ -26,12 +26,12 @@ setuptools.setup(
     packages=['prjxray'],
     install_requires=[
         'fasm',
-        'intervaltree',
         'numpy',
         # FIXME: remove dependency once https://github.com/SymbiFlow/prjxray/issues/1624
         #        is fixed
         'pyjson5',
         'pyyaml',
+        'scipy',
         'simplejson',
     ],
     classifiers=[
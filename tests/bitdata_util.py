@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+""" bitdata helpers shared by the disassembler tests. """
+
+from prjxray import bitstream
+
+
+def copy_bitdata(bitdata):
+    """ Return a copy of bitdata that can be changed independently. """
+    return {
+        frame: (set(words), set(bits))
+        for frame, (words, bits) in bitdata.items()
+    }
+
+
+def random_bitdata(rng, grid):
+    """ Set bits of random features of every tile, plus some random bits. """
+    bitdata = {}
+
+    def set_bit(frame, bitidx):
+        if bitidx < 0:
+            return
+
+        if frame not in bitdata:
+            bitdata[frame] = set(), set()
+
+        bitdata[frame][0].add(bitidx // bitstream.WORD_SIZE_BITS)
+        bitdata[frame][1].add(bitidx)
+
+    for tile in grid.tiles():
+        gridinfo = grid.gridinfo_at_tilename(tile)
+        tile_segbits = grid.get_tile_segbits_at_tilename(tile)
+
+        for block_type, bits in gridinfo.bits.items():
+            ref_segbits = tile_segbits
+            ref_bits = bits
+            if bits.alias is not None:
+                ref_segbits = tile_segbits.tile_segbits
+                ref_bits = tile_segbits.get_alias_bits(block_type, bits)
+
+            features = list(ref_segbits.segbits[block_type].values())
+            for segbit in rng.sample(features, min(len(features),
+                                                   rng.randint(0, 8))):
+                for bit in segbit:
+                    if bit.isset:
+                        set_bit(
+                            ref_bits.base_address + bit.word_column,
+                            ref_bits.offset * bitstream.WORD_SIZE_BITS +
+                            bit.word_bit)
+
+            for _ in range(rng.randint(0, 3)):
+                set_bit(
+                    bits.base_address + rng.randrange(bits.frames),
+                    (bits.offset + rng.randrange(bits.words)) *
+                    bitstream.WORD_SIZE_BITS + rng.randrange(
+                        bitstream.WORD_SIZE_BITS))
+
+    # Bits outside of any tile.
+    for _ in range(3):
+        set_bit(
+            rng.randrange(1 << 20),
+            rng.randrange(
+                bitstream.FRAME_WORD_COUNT * bitstream.WORD_SIZE_BITS))
+
+    return bitdata
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+
+import random
+from unittest import TestCase, main
+
+import numpy as np
+
+from prjxray import bitstream
+
+
+def random_lines(rng):
+    lines = []
+    for _ in range(500):
+        lines.append(
+            'bit_{:08x}_{:03d}_{:02d}'.format(
+                rng.choice((0x00000000, 0x00000081, 0x00020005, 0x00420100)),
+                rng.randrange(bitstream.FRAME_WORD_COUNT),
+                rng.randrange(bitstream.WORD_SIZE_BITS)))
+
+    return lines
+
+
+def parse_line(line):
+    _, frame, wordidx, bitidx = line.split('_')
+    return int(frame, 16), int(wordidx), int(bitidx)
+
+
+class TestFrameBits(TestCase):
+    def setUp(self):
+        self.lines = random_lines(random.Random(0))
+
+    def test_bitdata(self):
+        expected = {}
+        for frame, wordidx, bitidx in map(parse_line, self.lines):
+            if frame not in expected:
+                expected[frame] = set(), set()
+
+            expected[frame][0].add(wordidx)
+            expected[frame][1].add(wordidx * bitstream.WORD_SIZE_BITS + bitidx)
+
+        bitdata = bitstream.load_bitdata(self.lines)
+        self.assertIs(type(bitdata), dict)
+        self.assertEqual(bitdata, expected)
+        self.assertEqual(sorted(bitdata), sorted(expected))
+        self.assertNotIn(0x00000001, bitdata)
+
+    def test_bitdata2(self):
+        expected = {}
+        for frame, wordidx, bitidx in map(parse_line, self.lines):
+            expected.setdefault(frame, {}).setdefault(wordidx,
+                                                      set()).add(bitidx)
+
+        bitdata = bitstream.load_bitdata2(self.lines)
+        self.assertIs(type(bitdata), dict)
+        self.assertEqual(bitdata, expected)
+
+    def test_views(self):
+        frame_bits = bitstream.FrameBits.load(self.lines)
+        for view, bitdata in ((frame_bits.bitdata_view(),
+                               bitstream.load_bitdata(self.lines)),
+                              (frame_bits.bitdata2_view(),
+                               bitstream.load_bitdata2(self.lines))):
+            self.assertEqual(view, bitdata)
+            self.assertEqual(list(view), sorted(bitdata))
+
+            # Values are not kept by the view.
+            frame = next(iter(view))
+            self.assertIsNot(view[frame], view[frame])
+
+    def test_select(self):
+        frame_bits = bitstream.FrameBits.load(self.lines)
+        self.assertEqual(len(frame_bits), len(set(self.lines)))
+
+        expected = set()
+        for frame, wordidx, bitidx in map(parse_line, self.lines):
+            if 0x00000080 <= frame < 0x00000080 + 36 and 50 <= wordidx < 52:
+                expected.add(
+                    (
+                        frame - 0x00000080,
+                        (wordidx - 50) * bitstream.WORD_SIZE_BITS + bitidx))
+
+        frame_offsets, bits = frame_bits.select(0x00000080, 36, 50, 2)
+        self.assertEqual(
+            set(zip(frame_offsets.tolist(), bits.tolist())), expected)
+
+    def test_from_frame_words(self):
+        rng = np.random.RandomState(0)
+        data = rng.randint(
+            0, 1 << 32, size=(3, bitstream.FRAME_WORD_COUNT),
+            dtype=np.uint64).astype(np.uint32)
+        addresses = [0x00000100, 0x00000000, 0x00020000]
+
+        lines = []
+        for address, words in zip(addresses, data.tolist()):
+            for wordidx, word in enumerate(words):
+                for bitidx in range(bitstream.WORD_SIZE_BITS):
+                    if (word >> bitidx) & 1:
+                        lines.append(
+                            'bit_{:08x}_{:03d}_{:02d}'.format(
+                                address, wordidx, bitidx))
+
+        self.assertEqual(
+            bitstream.FrameBits.from_frame_words(addresses, data).bitdata(),
+            bitstream.load_bitdata(lines))
+
+    def test_empty(self):
+        frame_bits = bitstream.FrameBits([], [])
+        self.assertEqual(len(frame_bits), 0)
+        self.assertEqual(frame_bits.bitdata(), {})
+        self.assertEqual(len(frame_bits.select(0, 36, 0, 2)[0]), 0)
+
+
+if __name__ == '__main__':
+    main()
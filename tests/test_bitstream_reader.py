@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+
+import io
+import random
+from unittest import TestCase, main
+
+from prjxray import bitstream
+from prjxray import bitstream_reader
+from prjxray import bitstream_writer
+
+from test_bitstream_writer import PART_JSON, random_frame
+
+
+def write_bitstream(frames, part):
+    f = io.BytesIO()
+    bitstream_writer.write_bitstream(f, frames, part, part_name='test')
+    return f.getvalue()
+
+
+def reference_bitdata(frames):
+    """ bitdata through the bitread -y text format. """
+    lines = []
+    for frame in sorted(frames):
+        for word_idx, word in enumerate(frames[frame]):
+            for bit_idx in range(bitstream.WORD_SIZE_BITS):
+                if word_idx == bitstream_writer.ECC_WORD and bit_idx <= 12:
+                    continue
+
+                if (int(word) >> bit_idx) & 1:
+                    lines.append(
+                        'bit_{:08x}_{:03d}_{:02d}'.format(
+                            frame, word_idx, bit_idx))
+
+    return bitstream.load_bitdata(lines)
+
+
+class TestBitstreamReader(TestCase):
+    def setUp(self):
+        self.part = bitstream.Part.from_json(PART_JSON)
+
+        rng = random.Random(0)
+        self.frames = {
+            0x00000001: random_frame(rng),
+            0x00000081: random_frame(rng),
+            0x00020000: random_frame(rng),
+            0x00C00001: random_frame(rng),
+        }
+
+    def test_read_bitstream(self):
+        frames = bitstream_reader.read_bitstream(
+            write_bitstream(self.frames, self.part), self.part)
+
+        self.assertEqual(
+            list(frames.keys()), self.part.frame_addresses.tolist())
+
+        for address, words in frames.items():
+            expected = list(self.frames.get(address, [0] * 101))
+            expected[bitstream_writer.ECC_WORD] &= ~bitstream_writer.ECC_MASK
+
+            words = words.tolist()
+            words[bitstream_writer.ECC_WORD] &= ~bitstream_writer.ECC_MASK
+            self.assertEqual(words, expected)
+
+    def test_idcode_mismatch(self):
+        data = write_bitstream(self.frames, self.part)
+        other_part = bitstream.Part(
+            self.part.idcode + 1, self.part.frame_addresses)
+
+        with self.assertRaises(bitstream_reader.BitstreamError):
+            bitstream_reader.read_bitstream(data, other_part)
+
+    def test_frames_to_bitdata(self):
+        frames = bitstream_reader.read_bitstream(
+            write_bitstream(self.frames, self.part), self.part)
+
+        self.assertEqual(
+            bitstream_reader.frames_to_bitdata(frames),
+            reference_bitdata(frames))
+
+        frame_range = bitstream_reader.parse_frame_range('0x80:0x20000')
+        self.assertEqual(frame_range, (0x80, 0x20001))
+        self.assertEqual(
+            sorted(
+                bitstream_reader.frames_to_bitdata(
+                    frames, frame_range=frame_range)),
+            [0x00000081, 0x00020000])
+
+        for bitdata in (
+                bitstream_reader.frames_to_bitdata(frames),
+                bitstream_reader.frames_to_frame_bits(frames).bitdata_view()):
+            f = io.StringIO()
+            bitstream_reader.write_bits(f, bitdata)
+            self.assertEqual(
+                bitstream.load_bitdata(f.getvalue().splitlines()),
+                reference_bitdata(frames))
+
+
+if __name__ == '__main__':
+    main()
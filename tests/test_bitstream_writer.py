@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+
+import io
+import random
+from unittest import TestCase, main
+
+import numpy as np
+
+from prjxray import bitstream
+from prjxray import bitstream_writer as bw
+
+PART_JSON = {
+    "idcode": 0x362d093,
+    "global_clock_regions": {
+        "top": {
+            "rows": {
+                "0": {
+                    "configuration_buses": {
+                        "CLB_IO_CLK": {
+                            "configuration_columns": {
+                                "0": {
+                                    "frame_count": 3
+                                },
+                                "1": {
+                                    "frame_count": 2
+                                },
+                            }
+                        },
+                    }
+                },
+                "1": {
+                    "configuration_buses": {
+                        "CLB_IO_CLK": {
+                            "configuration_columns": {
+                                "0": {
+                                    "frame_count": 2
+                                },
+                            }
+                        },
+                    }
+                },
+            }
+        },
+        "bottom": {
+            "rows": {
+                "0": {
+                    "configuration_buses": {
+                        "BLOCK_RAM": {
+                            "configuration_columns": {
+                                "0": {
+                                    "frame_count": 2
+                                },
+                            }
+                        },
+                    }
+                },
+            }
+        },
+    },
+}
+
+
+def reference_ecc(words):
+    ecc = 0
+    for idx, word in enumerate(words):
+        ecc = bw.icap_ecc(idx, int(word), ecc)
+
+    return ecc & bw.ECC_MASK
+
+
+def random_frame(rng):
+    return [
+        rng.getrandbits(32) if rng.random() < 0.2 else 0
+        for _ in range(bitstream.FRAME_WORD_COUNT)
+    ]
+
+
+class TestBitstreamWriter(TestCase):
+    def test_icap_crc(self):
+        # Same vectors as lib/xilinx/tests/xc7series/crc_test.cc
+        self.assertEqual(bw.icap_crc(0, 0, 0), 0)
+        self.assertEqual(bw.icap_crc(1 << 4, 0, 0), 0x82F63B78)
+        self.assertEqual(bw.icap_crc(0x1F, 0xFFFFFFFF, 0), 0xBF86D4DF)
+        self.assertEqual(bw.icap_crc(0, 0, 0xFFFFFFFF), 0xC631E365)
+
+    def test_icap_crc_words(self):
+        rng = random.Random(0)
+        for count in (0, 1, 2, 3, 5, 64, 1000):
+            words = [rng.getrandbits(32) for _ in range(count)]
+            prev = rng.getrandbits(32)
+
+            crc = prev
+            for word in words:
+                crc = bw.icap_crc(bw.REG_FDRI, word, crc)
+
+            self.assertEqual(bw.icap_crc_words(bw.REG_FDRI, words, prev), crc)
+
+    def test_icap_ecc(self):
+        # Same vectors as lib/xilinx/tests/xc7series/ecc_test.cc
+        self.assertEqual(bw.icap_ecc(0, 0, 0), 0)
+        self.assertEqual(bw.icap_ecc(0, 1, 0), 0x1320)
+        self.assertEqual(bw.icap_ecc(0x7, 1, 0), 0x1420)
+        self.assertEqual(bw.icap_ecc(0x26, 1, 0), 0x1820)
+        self.assertEqual(bw.icap_ecc(0x32, 0xFFFFFFFF, 0), 0x19AC)
+        self.assertEqual(bw.icap_ecc(0x64, 0, 1), 0x1001)
+
+    def test_update_ecc(self):
+        rng = random.Random(0)
+        data = np.array(
+            [random_frame(rng) for _ in range(100)] +
+            [[0] * bitstream.FRAME_WORD_COUNT],
+            dtype=np.uint32)
+        expected = [reference_ecc(words) for words in data]
+
+        bw.update_ecc(data, chunk_size=16)
+
+        self.assertEqual(
+            (data[:, bw.ECC_WORD] & bw.ECC_MASK).tolist(), expected)
+
+    def test_write_bitstream(self):
+        part = bitstream.Part.from_json(PART_JSON)
+        self.assertEqual(
+            part.frame_addresses.tolist(), [
+                0x00000000, 0x00000001, 0x00000002, 0x00000080, 0x00000081,
+                0x00020000, 0x00020001, 0x00C00000, 0x00C00001
+            ])
+
+        rng = random.Random(0)
+        frames = {
+            0x00000001: random_frame(rng),
+            0x00000081: random_frame(rng),
+            0x00C00001: random_frame(rng),
+        }
+
+        f = io.BytesIO()
+        bw.write_bitstream(
+            f,
+            frames,
+            part,
+            part_name='xc7a50tfgg484-1',
+            source_name='design.fasm',
+            generator='test')
+        data = f.getvalue()
+
+        self.assertTrue(data.startswith(b'\x00\x09\x0f\xf0'))
+        self.assertIn(b'a\x00\x1bdesign.fasm;Generator=test\x00', data)
+        self.assertIn(b'b\x00\x10xc7a50tfgg484-1\x00', data)
+
+        length_pos = data.index(b'e', data.index(b'd\x00\x09')) + 1
+        length = int.from_bytes(data[length_pos:length_pos + 4], 'big')
+        words = np.frombuffer(data[length_pos + 4:], dtype='>u4')
+        self.assertEqual(len(words) * 4, length)
+
+        self.assertEqual(
+            words[:len(bw.SYNC_HEADER)].tolist(), list(bw.SYNC_HEADER))
+
+        words = words.tolist()
+        idcode = words.index(
+            bw.type1_header(bw.OPCODE_WRITE, bw.REG_IDCODE, 1))
+        self.assertEqual(words[idcode + 1], PART_JSON['idcode'])
+
+        fdri = words.index(bw.type1_header(bw.OPCODE_WRITE, bw.REG_FDRI, 0))
+        header = words[fdri + 1]
+        self.assertEqual(header >> 29, 2)
+        fdri_words = words[fdri + 2:fdri + 2 + (header & 0x7FFFFFF)]
+
+        # 9 frames, two zero frames after top row 0, after top row 1 (next
+        # is the bottom BLOCK_RAM row) and at the end.
+        self.assertEqual(
+            len(fdri_words), (9 + 3 * 2) * bitstream.FRAME_WORD_COUNT)
+
+        def frame_at(row):
+            start = row * bitstream.FRAME_WORD_COUNT
+            return fdri_words[start:start + bitstream.FRAME_WORD_COUNT]
+
+        rows = {0x00000001: 1, 0x00000081: 4, 0x00C00001: 12}
+        for address, row in rows.items():
+            expected = list(frames[address])
+            ecc = reference_ecc(expected)
+            expected[bw.ECC_WORD] &= ~bw.ECC_MASK
+            expected[bw.ECC_WORD] |= ecc
+            self.assertEqual(frame_at(row), expected)
+
+        for row in range(15):
+            if row not in rows.values():
+                self.assertFalse(any(frame_at(row)), row)
+
+    def test_crc_check(self):
+        part = bitstream.Part.from_json(PART_JSON)
+        rng = random.Random(0)
+        frames = {
+            0x00000001: random_frame(rng),
+            0x00C00001: random_frame(rng),
+        }
+
+        def crc_writes(crc_check):
+            words = bw.configuration_words(
+                frames, part, crc_check=crc_check).tolist()
+
+            # Replay the register writes, the CRC is reset by RCRC.
+            crc = 0
+            writes = []
+            pos = len(bw.SYNC_HEADER)
+            register = None
+            while pos < len(words):
+                header = words[pos]
+                pos += 1
+                if header >> 29 == 1:
+                    register = (header >> 13) & 0x3FFF
+                    count = header & 0x7FF
+                elif header >> 29 == 2:
+                    count = header & 0x7FFFFFF
+                else:
+                    self.fail(hex(header))
+
+                for value in words[pos:pos + count]:
+                    if register == bw.REG_CRC:
+                        writes.append((value, crc))
+                    else:
+                        crc = bw.icap_crc(register, value, crc)
+                    if register == bw.REG_CMD and value == bw.CMD_RCRC:
+                        crc = 0
+                pos += count
+
+            return writes
+
+        self.assertEqual(crc_writes(False), [])
+
+        writes = crc_writes(True)
+        self.assertEqual(len(writes), 1)
+        value, expected = writes[0]
+        self.assertNotEqual(value, 0)
+        self.assertEqual(value, expected)
+
+
+if __name__ == '__main__':
+    main()
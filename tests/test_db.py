@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+
+import json
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from prjxray import bitstream
+from prjxray.db import Database
+
+DB_ROOT = os.path.join(
+    os.path.dirname(__file__), '..', 'utils', 'test_data', 'db')
+PART = 'xc7a200tffg1156-1'
+
+PART_JSON = {
+    "idcode": 0x3636093,
+    "global_clock_regions": {
+        "top": {
+            "rows": {
+                "0": {
+                    "configuration_buses": {
+                        "CLB_IO_CLK": {
+                            "configuration_columns": {
+                                "0": {
+                                    "frame_count": 2
+                                },
+                            }
+                        },
+                    }
+                },
+            }
+        },
+    },
+}
+
+
+class TestDatabase(TestCase):
+    def test_grid_shared(self):
+        db = Database(DB_ROOT, PART)
+        grid = db.grid()
+        self.assertIs(db.grid(), grid)
+
+        # Same Grid as built without the cache.
+        fresh_db = Database(DB_ROOT, PART)
+        fresh_db._read_tilegrid()
+        self.assertEqual(
+            sorted(grid.tiles()),
+            sorted(type(grid)(fresh_db, fresh_db.tilegrid).tiles()))
+
+        with tempfile.TemporaryDirectory() as d:
+            compiled_db = os.path.join(d, 'db.bin')
+            db.write_compiled(compiled_db)
+
+            db = Database.open_compiled(compiled_db)
+            grid = db.grid()
+            self.assertIs(db.grid(), grid)
+            self.assertIs(grid.db, db)
+
+    def test_get_part(self):
+        with tempfile.TemporaryDirectory() as d:
+            db_root = os.path.join(d, 'db')
+            shutil.copytree(DB_ROOT, db_root)
+            compiled_db = os.path.join(d, 'db.bin')
+
+            # The test database part.json has no frame data.
+            with self.assertRaises(bitstream.PartDataError):
+                Database(db_root, PART).get_part()
+
+            Database(db_root, PART).write_compiled(compiled_db)
+            with self.assertRaisesRegex(bitstream.PartDataError,
+                                        'db.bin: part.json has no idcode'):
+                Database.open_compiled(compiled_db).get_part()
+
+            with open(os.path.join(db_root, PART, 'part.json'), 'w') as f:
+                json.dump(PART_JSON, f)
+
+            expected = Database(db_root, PART).get_part()
+            self.assertEqual(expected.idcode, PART_JSON['idcode'])
+
+            Database(db_root, PART).write_compiled(compiled_db)
+
+            # Read from the snapshot, not the database directory.
+            shutil.rmtree(db_root)
+            part = Database.open_compiled(compiled_db).get_part()
+            self.assertEqual(part.idcode, expected.idcode)
+            self.assertEqual(
+                part.frame_addresses.tolist(),
+                expected.frame_addresses.tolist())
+
+
+if __name__ == '__main__':
+    main()
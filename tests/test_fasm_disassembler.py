@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+
+import os.path
+import random
+from unittest import TestCase, main
+
+from prjxray import bitstream
+from prjxray.db import Database
+from prjxray.fasm_disassembler import FasmDisassembler, \
+    MatrixFasmDisassembler, partition_frames, FRAME_ROW_SHIFT
+from tests.bitdata_util import copy_bitdata, random_bitdata
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), '..', 'utils', 'test_data')
+DB_ROOT = os.path.join(TEST_DATA, 'db')
+PART = 'xc7a200tffg1156-1'
+
+
+class TestMatrixFasmDisassembler(TestCase):
+    def assert_same_fasm(self, db, bitdata):
+        for verbose in (False, True):
+            expected = set(
+                FasmDisassembler(db).find_features_in_bitstream(
+                    copy_bitdata(bitdata), verbose=verbose))
+            actual = set(
+                MatrixFasmDisassembler(
+                    db, chunk_size=3).find_features_in_bitstream(
+                        bitdata, verbose=verbose))
+
+            self.assertEqual(actual, expected)
+
+    def test_designs(self):
+        db = Database(DB_ROOT, PART)
+        for design in ('ff_int', 'lut_int'):
+            with open(os.path.join(TEST_DATA, design, 'design.bits')) as f:
+                frame_bits = bitstream.FrameBits.load(f)
+
+            self.assert_same_fasm(db, frame_bits.bitdata())
+            self.assert_same_fasm(db, frame_bits.bitdata_view())
+
+    def test_random_bitdata(self):
+        db = Database(DB_ROOT, PART)
+        rng = random.Random(0)
+        for _ in range(10):
+            self.assert_same_fasm(db, random_bitdata(rng, db.grid()))
+
+
+class TestParallelFasmDisassembler(TestCase):
+    def test_partition_frames(self):
+        db = Database(DB_ROOT, PART)
+        bitdata = random_bitdata(random.Random(0), db.grid())
+
+        partitions = partition_frames(bitdata, 3)
+        self.assertEqual(len(partitions), 3)
+        self.assertEqual(
+            sorted(frame for frames in partitions for frame in frames),
+            sorted(bitdata))
+
+        rows = [
+            set(frame >> FRAME_ROW_SHIFT
+                for frame in frames)
+            for frames in partitions
+        ]
+        for idx, partition_rows in enumerate(rows):
+            for other_rows in rows[idx + 1:]:
+                self.assertFalse(partition_rows & other_rows)
+
+    def test_same_output(self):
+        db = Database(DB_ROOT, PART)
+        rng = random.Random(0)
+        for _ in range(3):
+            bitdata = random_bitdata(rng, db.grid())
+            for verbose in (False, True):
+                expected = list(
+                    FasmDisassembler(db).find_features_in_bitstream(
+                        copy_bitdata(bitdata), verbose=verbose))
+                actual = list(
+                    FasmDisassembler(db).find_features_in_bitstream(
+                        copy_bitdata(bitdata), verbose=verbose, jobs=3))
+
+                self.assertEqual(actual, expected)
+
+
+def reference_is_zero_feature(db, feature):
+    """ FasmDisassembler.is_zero_feature before it was memoized. """
+    grid = db.grid()
+    parts = feature.split('.')
+    tile = parts[0]
+    gridinfo = grid.gridinfo_at_tilename(tile)
+    feature = '.'.join(parts[1:])
+
+    db_k = '%s.%s' % (gridinfo.tile_type, feature)
+    segbits = grid.get_tile_segbits_at_tilename(tile)
+    any_bits = False
+    for block_type, bit in segbits.feature_to_bits(gridinfo.bits, db_k):
+        if bit.isset:
+            any_bits = True
+            break
+
+    return not any_bits
+
+
+class TestIsZeroFeature(TestCase):
+    def test_memoized(self):
+        db = Database(DB_ROOT, PART)
+        bitdata = random_bitdata(random.Random(0), db.grid())
+
+        features = set(
+            fasm_line.set_feature.feature for fasm_line in FasmDisassembler(
+                db).find_features_in_bitstream(copy_bitdata(bitdata)))
+        self.assertGreater(len(features), 0)
+
+        expected = {
+            feature: reference_is_zero_feature(db, feature)
+            for feature in features
+        }
+
+        disassembler = FasmDisassembler(db)
+        for _ in range(2):
+            for feature in sorted(features):
+                self.assertEqual(
+                    disassembler.is_zero_feature(feature), expected[feature],
+                    feature)
+
+        self.assertLess(
+            len(disassembler.zero_tables), len(disassembler.zero_table_keys))
+
+
+if __name__ == '__main__':
+    main()
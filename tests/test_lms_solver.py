@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+
+import contextlib
+import io
+import math
+import os.path
+import random
+import sys
+import tempfile
+from unittest import TestCase, main, mock
+
+import numpy as np
+
+from prjxray import lms_solver
+
+
+def random_segdata(rng, count=40, bit_count=30, tag_count=6):
+    """ Segdata where each tag drives one bit, plus some noise bits. """
+    bits = ['{}_{:02d}'.format(rng.randrange(4), b) for b in range(bit_count)]
+    tags = ['TAG{}'.format(t) for t in range(tag_count)]
+
+    segdata = []
+    for seg in range(count):
+        data = {'seg': 'seg{}'.format(seg), 'bit': [], 'tag': []}
+        for t, tag in enumerate(tags):
+            if rng.random() < 0.2:
+                continue
+
+            value = rng.randint(0, 1)
+            data['tag'].append((tag, value))
+            if value:
+                data['bit'].append(bits[t])
+
+        data['bit'].extend(rng.sample(bits[tag_count:], 3))
+        segdata.append(data)
+
+    return tags, sorted(set(bits), key=lms_solver.sort_bits), segdata
+
+
+def reference_matrices(all_tags, all_bits, segdata, bias=0.0):
+    """ Cell by cell construction of A and B. """
+    A = np.zeros((len(segdata), len(all_bits)))
+    B = np.zeros((len(segdata), len(all_tags)))
+
+    for r, data in enumerate(segdata):
+        for c, bit in enumerate(all_bits):
+            A[r, c] = +1.0 if bit in data['bit'] else -1.0
+        for c, tag in enumerate(all_tags):
+            for t, x in data['tag']:
+                if t == tag:
+                    B[r, c] = (+1.0 if x > 0 else -1.0) + bias
+
+    return A, B
+
+
+def reference_correlations(all_tags, all_bits, segdata, W):
+    """ Segdata by segdata bit correlations and exceptions. """
+    C = np.zeros(W.shape)
+    exceptions = {}
+
+    for i, tag in enumerate(all_tags):
+        exceptions[tag] = {}
+        tag_segdata = [
+            data for data in segdata if tag in [t for t, x in data['tag']]
+        ]
+
+        for j, bit in enumerate(all_bits):
+            if W[i, j] == 0:
+                continue
+
+            corr_sum = 0
+            for data in tag_segdata:
+                vt = [x for t, x in data['tag'] if t == tag][0]
+                if W[i, j] < 0:
+                    vt = 1 - vt
+                vb = 1 if bit in data['bit'] else 0
+
+                if vt == vb:
+                    corr_sum += 1
+                else:
+                    exceptions[tag].setdefault(bit, []).append(
+                        (vb, vt, data['seg']))
+
+            C[i, j] = corr_sum / len(tag_segdata)
+
+    return C, exceptions
+
+
+class TestBuildMatrices(TestCase):
+    def test_same_as_reference(self):
+        rng = random.Random(0)
+        for bias in (0.0, 0.25):
+            all_tags, all_bits, segdata = random_segdata(rng)
+
+            # Tags and bits not considered, and repeated tags.
+            segdata[0]['tag'].append(('OTHER', 1))
+            segdata[1]['tag'].extend([('TAG0', 0), ('TAG0', 1)])
+            all_bits = all_bits[1:]
+
+            A, B = lms_solver.build_matrices(
+                all_tags, all_bits, segdata, bias=bias)
+            A_ref, B_ref = reference_matrices(
+                all_tags, all_bits, segdata, bias=bias)
+
+            np.testing.assert_array_equal(A, A_ref)
+            np.testing.assert_array_equal(B, B_ref)
+
+
+class TestCorrelations(TestCase):
+    def test_same_as_reference(self):
+        rng = random.Random(4)
+        all_tags, all_bits, segdata = random_segdata(rng)
+        W = np.random.RandomState(4).randint(
+            -1, 2, (len(all_tags), len(all_bits)))
+
+        C, exceptions = lms_solver.compute_bit_correlations(
+            all_tags, all_bits, segdata, W)
+        C_ref, exceptions_ref = reference_correlations(
+            all_tags, all_bits, segdata, W)
+
+        np.testing.assert_array_equal(C, C_ref)
+        self.assertEqual(exceptions, exceptions_ref)
+
+    def test_tag_stats(self):
+        rng = random.Random(5)
+        all_tags, all_bits, segdata = random_segdata(rng)
+
+        # Repeated tags count every time.
+        segdata[0]['tag'].extend([('TAG0', 0), ('TAG0', 1), ('TAG1', 1)])
+
+        stats = lms_solver.compute_tag_stats(all_tags, segdata)
+        for tag in all_tags:
+            values = [
+                x for data in segdata for t, x in data['tag'] if t == tag
+            ]
+            self.assertEqual(stats[tag], (values.count(0), values.count(1)))
+
+        tag_count = lms_solver.summarize_segdata(segdata)['tag_count']
+        self.assertEqual(
+            stats, {tag: tuple(tag_count[tag])
+                    for tag in all_tags})
+
+
+class TestSparseSolver(TestCase):
+    def test_same_as_dense(self):
+        rng = random.Random(1)
+        all_tags, all_bits, segdata = random_segdata(rng)
+
+        for bias, a in ((0.0, 0.01), (0.1, 1.0)):
+            X, E = lms_solver.solve_tichonov(
+                all_tags, all_bits, segdata, bias=bias, a=a)
+            X_sparse, E_sparse = lms_solver.solve_tichonov_sparse(
+                all_tags, all_bits, segdata, bias=bias, a=a, chunk_size=7)
+
+            np.testing.assert_allclose(X_sparse, X, atol=1e-9)
+            np.testing.assert_allclose(E_sparse, E, atol=1e-6)
+
+
+class TestSolveOneByOne(TestCase):
+    def test_same_as_single_tags(self):
+        rng = random.Random(2)
+        all_tags, all_bits, segdata = random_segdata(rng)
+
+        # TAG0 and SHARED are in the same rows, so are solved together.
+        for data in segdata:
+            for t, x in list(data['tag']):
+                if t == 'TAG0':
+                    data['tag'].append(('SHARED', 1 - x))
+        all_tags = all_tags + ['SHARED']
+
+        expected = []
+        for tag in all_tags:
+            tag_segdata = [
+                data for data in segdata if tag in [t for t, x in data['tag']]
+            ]
+            expected.append(
+                lms_solver.solve_tichonov([tag], all_bits, tag_segdata, a=0.1))
+
+        for solver in (lms_solver.solve_tichonov,
+                       lms_solver.solve_tichonov_sparse):
+            for jobs in (1, 2):
+                with contextlib.redirect_stdout(io.StringIO()) as out:
+                    X, E = lms_solver.solve_onebyone(
+                        all_tags,
+                        all_bits,
+                        segdata,
+                        solver=solver,
+                        jobs=jobs,
+                        a=0.1)
+
+                self.assertIn('shared by 2 tags', out.getvalue())
+                for i, (X1, E1) in enumerate(expected):
+                    np.testing.assert_allclose(X[:, i], X1[:, 0], atol=1e-9)
+                    np.testing.assert_allclose(E[i], E1[0], atol=1e-6)
+
+
+class TestPhaseTimer(TestCase):
+    def test_peak_rss(self):
+        usage = mock.Mock(ru_maxrss=3 * 1024 * 1024)
+        with mock.patch('resource.getrusage', return_value=usage):
+            for platform, mb in (('linux', 3 * 1024), ('darwin', 3)):
+                with mock.patch.object(lms_solver.sys, 'platform', platform):
+                    timer = lms_solver.PhaseTimer()
+                    with timer.phase('load'):
+                        pass
+
+                self.assertEqual(timer.peak_rss['load'], mb)
+
+    def test_peak_rss_unavailable(self):
+        # import resource raises ImportError, as on Windows.
+        with mock.patch.dict(sys.modules, {'resource': None}):
+            self.assertTrue(math.isnan(lms_solver.peak_rss_mb()))
+
+
+def write_segdata(file_name, segdata):
+    with open(file_name, 'w') as f:
+        for data in segdata:
+            print('seg ' + data['seg'], file=f)
+            for bit in data['bit']:
+                print('bit ' + bit, file=f)
+            for tag, value in data['tag']:
+                print('tag %s %d' % (tag, value), file=f)
+
+
+def shared_rows_segdata(rng, count=30, tag_count=40):
+    """ Segdata where groups of many tags are present in the same rows. """
+    bits = ['{}_{:02d}'.format(b // 20, b % 20) for b in range(60)]
+
+    segdata = []
+    for seg in range(count):
+        data = {'seg': 'seg{}'.format(seg), 'bit': [], 'tag': []}
+
+        groups = ['A']
+        if seg % 3:
+            groups.append('B')
+
+        for group in groups:
+            for t in range(tag_count):
+                value = rng.randint(0, 1)
+                data['tag'].append(('%s%d' % (group, t), value))
+                if value:
+                    data['bit'].append(bits[t])
+
+        data['bit'] = sorted(
+            set(data['bit'] + rng.sample(bits[tag_count:], 3)))
+        segdata.append(data)
+
+    return segdata
+
+
+class TestStream(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+        rng = random.Random(3)
+        self.write_files([random_segdata(rng)[2] for i in range(3)])
+
+    def write_files(self, file_segdata):
+        self.file_names = []
+        for i, segdata in enumerate(file_segdata):
+            file_name = os.path.join(self.tmpdir.name, 'segdata_%d.txt' % i)
+            write_segdata(file_name, segdata)
+            self.file_names.append(file_name)
+
+        self.segdata = []
+        for file_name in self.file_names:
+            self.segdata.extend(lms_solver.load_data(file_name))
+
+        summary = lms_solver.summarize_segdata(self.segdata)
+        self.all_tags = sorted(summary['tag_count'].keys())
+        self.all_bits = sorted(summary['bits'], key=lms_solver.sort_bits)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def stream_equations(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            summary, equations = lms_solver.stream_equations(
+                self.file_names, lambda tag: True, None, **kwargs)
+
+        # Summarized while accumulating, files are read once.
+        self.assertEqual(out.getvalue().split(), self.file_names)
+        self.assertEqual(summary, lms_solver.summarize_segdata(self.segdata))
+
+        return lms_solver.select_equations(
+            equations, self.all_tags, self.all_bits)
+
+    def test_solve(self):
+        for jobs in (1, 2):
+            equations = self.stream_equations(bias=0.1, jobs=jobs)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                X, E = lms_solver.solve_equations_onebyone(
+                    equations, self.all_tags, self.all_bits, a=0.1)
+                X_ref, E_ref = lms_solver.solve_onebyone(
+                    self.all_tags,
+                    self.all_bits,
+                    self.segdata,
+                    solver=lms_solver.solve_tichonov,
+                    bias=0.1,
+                    a=0.1)
+            np.testing.assert_allclose(X, X_ref, atol=1e-9)
+            np.testing.assert_allclose(E, E_ref, atol=1e-6)
+
+            equations = self.stream_equations(
+                bias=0.1, solve_all=True, jobs=jobs)
+
+            X, E = lms_solver.solve_normal_equations(equations, a=0.1)
+            X_ref, E_ref = lms_solver.solve_tichonov(
+                self.all_tags, self.all_bits, self.segdata, bias=0.1, a=0.1)
+            np.testing.assert_allclose(X, X_ref, atol=1e-9)
+            np.testing.assert_allclose(E, E_ref, atol=1e-6)
+
+    def test_select(self):
+        # Solving a subset of the tags and bits, as main does for const
+        # tags and bits.
+        self.all_tags = self.all_tags[1:-1]
+        self.all_bits = self.all_bits[2:]
+
+        equations = self.stream_equations(bias=0.1, solve_all=True)
+        self.assertEqual(equations.all_tags, self.all_tags)
+        self.assertEqual(equations.all_bits, self.all_bits)
+
+        X, E = lms_solver.solve_normal_equations(equations, a=0.1)
+        X_ref, E_ref = lms_solver.solve_tichonov(
+            self.all_tags, self.all_bits, self.segdata, bias=0.1, a=0.1)
+        np.testing.assert_allclose(X, X_ref, atol=1e-9)
+        np.testing.assert_allclose(E, E_ref, atol=1e-6)
+
+    def test_shared_rows(self):
+        rng = random.Random(6)
+        self.write_files([shared_rows_segdata(rng) for i in range(3)])
+
+        for jobs in (1, 2):
+            equations = self.stream_equations(jobs=jobs)
+
+            # One StS for the A tags and one for the B tags.
+            self.assertEqual(len(equations), 2)
+            self.assertEqual(
+                len(set(id(e.StS) for e in equations.values())), 2)
+            self.assertEqual(
+                sorted(len(e.all_tags) for e in equations.values()), [40, 40])
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                X, E = lms_solver.solve_equations_onebyone(
+                    equations, self.all_tags, self.all_bits, a=0.1)
+                X_ref, E_ref = lms_solver.solve_onebyone(
+                    self.all_tags,
+                    self.all_bits,
+                    self.segdata,
+                    solver=lms_solver.solve_tichonov,
+                    a=0.1)
+            np.testing.assert_allclose(X, X_ref, atol=1e-9)
+            np.testing.assert_allclose(E, E_ref, atol=1e-6)
+
+    def test_bit_correlations(self):
+        rng = np.random.RandomState(0)
+        W = rng.randint(-1, 2, (len(self.all_tags), len(self.all_bits)))
+
+        C, exceptions = lms_solver.stream_bit_correlations(
+            self.file_names, lambda tag: True, None, self.all_tags,
+            self.all_bits, W, 2)
+        C_ref, exceptions_ref = lms_solver.compute_bit_correlations(
+            self.all_tags, self.all_bits, self.segdata, W)
+
+        np.testing.assert_array_equal(C, C_ref)
+        self.assertEqual(exceptions, exceptions_ref)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+
+import contextlib
+import io
+import os.path
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from prjxray import segmaker
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), '..', 'utils', 'test_data')
+DB_ROOT = os.path.join(TEST_DATA, 'db')
+FABRIC = 'xc7a200t'
+BITS_FILE = os.path.join(TEST_DATA, 'ff_int', 'design.bits')
+
+# segdata_*.txt written by Segmaker.compile before it was vectorized.
+GOLDEN_DIR = os.path.join(TEST_DATA, 'segmaker')
+
+
+def tag_specimen(segmk):
+    """ Add the tags listed in tags.txt of the specimen. """
+    with open('tags.txt') as f:
+        for line in f:
+            site, name, value = line.split()
+            segmk.add_site_tag(site, name, int(value))
+
+
+def read_segdata(segdata_dir):
+    """ Return map of segdata_*.txt file name to contents in segdata_dir. """
+    segdata = {}
+    for fname in sorted(os.listdir(segdata_dir)):
+        if fname.startswith('segdata_'):
+            with open(os.path.join(segdata_dir, fname)) as f:
+                segdata[fname] = f.read()
+
+    return segdata
+
+
+def make_segmaker():
+    with contextlib.redirect_stdout(io.StringIO()):
+        return segmaker.Segmaker(BITS_FILE, db_root=DB_ROOT, fabric=FABRIC)
+
+
+class TestSegmaker(TestCase):
+    def test_context_shared(self):
+        segmk = make_segmaker()
+        other = make_segmaker()
+        self.assertIs(segmk.context, other.context)
+        self.assertEqual(segmk.sites['SLICE_X12Y102'], 'CLBLM_L_X10Y102')
+        self.assertEqual(
+            segmk.context.tile_blocks['CLBLM_L_X10Y102']['CLB_IO_CLK'],
+            segmaker.TileBlock(
+                base_address=0x00020500,
+                frames=36,
+                offset=4,
+                words=2,
+                segname='00020500_004'))
+
+    def test_context_pickle(self):
+        context = segmaker.get_segmaker_context(DB_ROOT, FABRIC)
+        context = pickle.loads(pickle.dumps(context))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            segmk = segmaker.Segmaker(BITS_FILE, context=context)
+        self.assertIs(segmk.context, context)
+        self.assertEqual(segmk.db_root, DB_ROOT)
+        self.assertEqual(segmk.fabric, FABRIC)
+
+    def test_compile_tagged_tiles(self):
+        segmk = make_segmaker()
+        segmk.add_site_tag('SLICE_X12Y102', 'AFF.ZINI', 1)
+        segmk.add_site_tag('SLICE_X13Y102', 'AFF.ZINI', 0)
+        segmk.add_tile_tag('INT_L_X10Y102', 'FOO', 1)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            segmk.compile()
+
+        # Every tile type has an entry, only tagged tiles have segments.
+        self.assertEqual(
+            set(segmk.segments_by_type),
+            set(tile['type'] for tile in segmk.grid.values()))
+
+        segments = {
+            tile_type: segments
+            for tile_type, segments in segmk.segments_by_type.items()
+            if segments
+        }
+        self.assertEqual(sorted(segments), ['CLBLM_L', 'INT_L'])
+
+        clb_segment, = segments['CLBLM_L'].values()
+        self.assertEqual(
+            clb_segment['tags'], {
+                'CLB.SLICE_X0.AFF.ZINI': 1,
+                'CLB.SLICE_X1.AFF.ZINI': 0,
+            })
+        self.assertGreater(len(clb_segment['bits']), 0)
+
+        int_segment, = segments['INT_L'].values()
+        self.assertEqual(int_segment['tags'], {'INT.FOO': 1})
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.chdir(tmpdir)
+            try:
+                segmk.write()
+            finally:
+                os.chdir(cwd)
+
+            self.assertEqual(
+                read_segdata(tmpdir),
+                read_segdata(os.path.join(GOLDEN_DIR, 'tagged_tiles')))
+
+    def test_unused_tags(self):
+        segmk = make_segmaker()
+        segmk.add_tile_tag('NO_SUCH_TILE_X0Y0', 'FOO', 1)
+
+        with self.assertRaises(AssertionError):
+            with contextlib.redirect_stdout(io.StringIO()):
+                segmk.compile()
+
+
+class TestRunSpecimens(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+        self.specimen_dirs = []
+        for idx, design in enumerate(('ff_int', 'lut_int', 'ff_int')):
+            specimen_dir = os.path.join(
+                self.tmpdir.name, 'specimen_{:03d}'.format(idx))
+            os.mkdir(specimen_dir)
+            shutil.copy(
+                os.path.join(TEST_DATA, design, 'design.bits'), specimen_dir)
+            with open(os.path.join(specimen_dir, 'tags.txt'), 'w') as f:
+                print('SLICE_X12Y102 AFF.ZINI {}'.format(idx % 2), file=f)
+                print('SLICE_X13Y102 AFF.ZINI 1', file=f)
+
+            self.specimen_dirs.append(specimen_dir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read_segdata(self):
+        """ Return map of specimen name to its segdata, and remove it. """
+        segdata = {}
+        for specimen_dir in self.specimen_dirs:
+            specimen = os.path.basename(specimen_dir)
+            segdata[specimen] = read_segdata(specimen_dir)
+            for fname in segdata[specimen]:
+                os.unlink(os.path.join(specimen_dir, fname))
+
+        return segdata
+
+    def test_same_segdata(self):
+        expected = {
+            os.path.basename(specimen_dir): read_segdata(
+                os.path.join(GOLDEN_DIR, os.path.basename(specimen_dir)))
+            for specimen_dir in self.specimen_dirs
+        }
+
+        cwd = os.getcwd()
+        for specimen_dir in self.specimen_dirs:
+            os.chdir(specimen_dir)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    segmk = segmaker.Segmaker(
+                        'design.bits', db_root=DB_ROOT, fabric=FABRIC)
+                    tag_specimen(segmk)
+                    segmk.compile()
+                    segmk.write()
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual(self.read_segdata(), expected)
+
+        for jobs in (1, 2):
+            with contextlib.redirect_stdout(io.StringIO()):
+                segmaker.run_specimens(
+                    self.specimen_dirs,
+                    tag_specimen,
+                    jobs=jobs,
+                    db_root=DB_ROOT,
+                    fabric=FABRIC)
+
+            self.assertEqual(self.read_segdata(), expected)
+            self.assertEqual(os.getcwd(), cwd)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+
+import os.path
+import random
+from unittest import TestCase, main
+
+from prjxray import bitstream
+from prjxray import tile_segbits
+from prjxray.db import Database
+from prjxray.fasm_disassembler import FasmDisassembler
+from prjxray.grid_types import BlockType
+
+DB_ROOT = os.path.join(
+    os.path.dirname(__file__), '..', 'utils', 'test_data', 'db')
+BITS_FILE = os.path.join(
+    os.path.dirname(__file__), '..', 'utils', 'test_data', 'ff_int',
+    'design.bits')
+PART = 'xc7a200tffg1156-1'
+
+
+def scan_bitdata(tile_segbits, block_type, bits, bitdata, match_filter=None):
+    """ Reference matcher, checks every feature of the tile type. """
+    for feature, segbit in tile_segbits.segbits[block_type].items():
+        if match_filter is not None and not all(match_filter(block_type, bit)
+                                                for bit in segbit):
+            continue
+
+        ones = []
+        for bit in segbit:
+            frame = bits.base_address + bit.word_column
+            bitidx = bits.offset * bitstream.WORD_SIZE_BITS + bit.word_bit
+            is_set = frame in bitdata and bitidx in bitdata[frame][1]
+            if is_set != bit.isset:
+                break
+
+            if bit.isset:
+                ones.append((frame, bitidx))
+        else:
+            yield tuple(ones), feature
+
+
+def random_bitdata(rng, tile_segbits, block_type, bits):
+    """ Set the bits of a random selection of features of the tile. """
+    bitdata = {}
+    features = list(tile_segbits.segbits[block_type].values())
+    for segbit in rng.sample(features, min(len(features), 20)):
+        for bit in segbit:
+            if not bit.isset:
+                continue
+
+            frame = bits.base_address + bit.word_column
+            bitidx = bits.offset * bitstream.WORD_SIZE_BITS + bit.word_bit
+            if frame not in bitdata:
+                bitdata[frame] = set(), set()
+
+            bitdata[frame][0].add(bitidx // bitstream.WORD_SIZE_BITS)
+            bitdata[frame][1].add(bitidx)
+
+    return bitdata
+
+
+class TestTileSegbits(TestCase):
+    def test_match_bitdata(self):
+        db = Database(DB_ROOT, PART)
+        grid = db.grid()
+        rng = random.Random(0)
+
+        for tile in grid.tiles():
+            gridinfo = grid.gridinfo_at_tilename(tile)
+            tile_segbits = grid.get_tile_segbits_at_tilename(tile)
+            for block_type, bits in gridinfo.bits.items():
+                if bits.alias is not None:
+                    ref_segbits = tile_segbits.tile_segbits
+                    ref_bits = tile_segbits.get_alias_bits(block_type, bits)
+                    match_filter = tile_segbits.match_filter
+                else:
+                    ref_segbits = tile_segbits
+                    ref_bits = bits
+                    match_filter = None
+
+                for _ in range(10):
+                    bitdata = random_bitdata(
+                        rng, ref_segbits, block_type, ref_bits)
+
+                    self.assertEqual(
+                        list(
+                            ref_segbits.match_bitdata(
+                                block_type,
+                                ref_bits,
+                                bitdata,
+                                match_filter=match_filter)),
+                        list(
+                            scan_bitdata(
+                                ref_segbits,
+                                block_type,
+                                ref_bits,
+                                bitdata,
+                                match_filter=match_filter)),
+                    )
+
+    def test_lazy_segbits(self):
+        db = Database(DB_ROOT, PART)
+        lazy_db = Database(DB_ROOT, PART, lazy_segbits=True)
+
+        def disassemble(db):
+            with open(BITS_FILE) as f:
+                bitdata = bitstream.load_bitdata(f)
+
+            return [
+                str(line)
+                for line in FasmDisassembler(db).find_features_in_bitstream(
+                    bitdata, verbose=True)
+            ]
+
+        self.assertEqual(disassemble(lazy_db), disassemble(db))
+        self.assertEqual(lazy_db.segbits_files_read, db.segbits_files_read)
+        self.assertGreater(lazy_db.segbits_files_read, 0)
+
+    def test_lazy_block_types(self):
+        db = Database(DB_ROOT, PART)
+        tile_type = 'CLBLM_L'
+        segbits, ppips = tile_segbits.read_tile_segbits(
+            db.tile_types[tile_type])
+
+        loaded = []
+
+        def loader(block_type, segbits):
+            def load():
+                loaded.append(block_type)
+                return segbits
+
+            return load
+
+        lazy = tile_segbits.LazySegbits(
+            {
+                BlockType.CLB_IO_CLK:
+                loader(BlockType.CLB_IO_CLK, segbits[BlockType.CLB_IO_CLK]),
+                BlockType.BLOCK_RAM:
+                loader(BlockType.BLOCK_RAM, {}),
+            })
+        self.assertEqual(
+            list(lazy), [BlockType.CLB_IO_CLK, BlockType.BLOCK_RAM])
+        self.assertEqual(loaded, [])
+
+        lazy_segbits = tile_segbits.TileSegbits(
+            db.tile_types[tile_type], parsed=(lazy, ppips))
+
+        gridinfo = db.grid().gridinfo_at_tilename('CLBLM_L_X10Y102')
+        bits_map = {
+            BlockType.CLB_IO_CLK: gridinfo.bits[BlockType.CLB_IO_CLK],
+        }
+        list(
+            lazy_segbits.feature_to_bits(
+                bits_map, 'CLBLM_L.SLICEM_X0.ALUT.INIT', address=1))
+        self.assertEqual(loaded, [BlockType.CLB_IO_CLK])
+
+        with self.assertRaises(KeyError):
+            list(lazy_segbits.feature_to_bits(bits_map, 'NOT_A_FEATURE[0]'))
+        self.assertEqual(loaded, [BlockType.CLB_IO_CLK, BlockType.BLOCK_RAM])
+
+    def test_partial_bitstream(self):
+        """ Decoding one block type should not load the others. """
+        db = Database(DB_ROOT, PART)
+        tile_type = 'CLBLM_L'
+        segbits, ppips = tile_segbits.read_tile_segbits(
+            db.tile_types[tile_type])
+
+        loaded = []
+
+        def loader(block_type, segbits):
+            def load():
+                loaded.append(block_type)
+                return segbits
+
+            return load
+
+        # Only the BLOCK_RAM frames of the tile are in the bitstream, the
+        # CLB_IO_CLK segbits come first and must stay unloaded.
+        lazy_segbits = tile_segbits.TileSegbits(
+            db.tile_types[tile_type],
+            parsed=(
+                tile_segbits.LazySegbits(
+                    {
+                        BlockType.CLB_IO_CLK:
+                        loader(BlockType.CLB_IO_CLK, {}),
+                        BlockType.BLOCK_RAM:
+                        loader(
+                            BlockType.BLOCK_RAM,
+                            segbits[BlockType.CLB_IO_CLK]),
+                    }), ppips))
+
+        bits = db.grid().gridinfo_at_tilename('CLBLM_L_X10Y102').bits[
+            BlockType.CLB_IO_CLK]
+        bits_map = {BlockType.BLOCK_RAM: bits}
+        bitdata = random_bitdata(
+            random.Random(0), lazy_segbits, BlockType.BLOCK_RAM, bits)
+        self.assertEqual(loaded, [BlockType.BLOCK_RAM])
+
+        features = [
+            feature for _, feature in lazy_segbits.match_bitdata(
+                BlockType.BLOCK_RAM, bits, bitdata)
+        ]
+        self.assertGreater(len(features), 0)
+
+        for feature in features:
+            self.assertEqual(
+                list(lazy_segbits.feature_to_bits(bits_map, feature)), [
+                    (
+                        BlockType.BLOCK_RAM,
+                        lazy_segbits.map_bit_to_frame(
+                            BlockType.BLOCK_RAM, bits, bit))
+                    for bit in segbits[BlockType.CLB_IO_CLK][feature]
+                ])
+
+        self.assertEqual(loaded, [BlockType.BLOCK_RAM])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+""" Compare the bit2fasm feature matching engines.
+
+Decodes a bitstream with each engine of fasm_disassembler.DISASSEMBLERS,
+checks that all engines return the same FasmLines and prints the time each
+engine took.  The database is loaded before timing, so only matching is
+measured.
+
+"""
+import argparse
+import os
+import sys
+import time
+
+from prjxray import bitstream
+from prjxray import fasm_disassembler
+import utils.bit2fasm as bit2fasm
+
+
+def run_engine(db, engine, bitdata, verbose):
+    """ Return (set of FasmLines, seconds) of decoding bitdata. """
+    disassembler = fasm_disassembler.DISASSEMBLERS[engine](db)
+
+    start = time.perf_counter()
+    fasm_lines = set(
+        disassembler.find_features_in_bitstream(bitdata, verbose=verbose))
+    return fasm_lines, time.perf_counter() - start
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    database_dir = os.getenv("XRAY_DATABASE_DIR")
+    database = os.getenv("XRAY_DATABASE")
+    db_root_kwargs = {}
+    if database_dir is None or database is None:
+        db_root_kwargs['required'] = True
+    else:
+        db_root_kwargs['required'] = False
+        db_root_kwargs['default'] = os.path.join(database_dir, database)
+
+    default_part = os.getenv("XRAY_PART")
+    part_kwargs = {}
+    if default_part is None:
+        part_kwargs['required'] = True
+    else:
+        part_kwargs['required'] = False
+        part_kwargs['default'] = default_part
+
+    parser.add_argument('--db-root', help="Database root.", **db_root_kwargs)
+    parser.add_argument(
+        '--part', help="Name of part being targetted.", **part_kwargs)
+    parser.add_argument(
+        '--compiled-db',
+        help="Database snapshot written by compile_db.py, used instead of "
+        "the database in --db-root.")
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help="Number of runs of each engine, the fastest is reported.")
+    parser.add_argument(
+        '--verbose',
+        help="Also compare the annotations of bits that were not decoded.",
+        action='store_true')
+    parser.add_argument(
+        'bit_file',
+        help="Bitstream (.bit or .bin), or bits file (bitread -y output, "
+        ".bits).")
+    args = parser.parse_args()
+
+    db = bit2fasm.open_database(
+        args.db_root, args.part, compiled_db=args.compiled_db)
+
+    if args.bit_file.endswith('.bits'):
+        with open(args.bit_file) as f:
+            bitdata = bitstream.load_bitdata(f)
+    else:
+        bitdata = bit2fasm.bit_to_bitdata(db, args.bit_file)
+
+    print(
+        '{} frames, {} bits set'.format(
+            len(bitdata), sum(len(bits) for _, bits in bitdata.values())))
+
+    # First run of each engine also loads the segbits used by the bitstream.
+    reference = None
+    for engine in sorted(fasm_disassembler.DISASSEMBLERS):
+        fasm_lines, _ = run_engine(db, engine, bitdata, args.verbose)
+        if reference is None:
+            reference = (engine, fasm_lines)
+        elif fasm_lines != reference[1]:
+            print(
+                'Engine {} differs from {}: {} FasmLines only in {}, {} only '
+                'in {}'.format(
+                    engine, reference[0], len(fasm_lines - reference[1]),
+                    engine, len(reference[1] - fasm_lines), reference[0]),
+                file=sys.stderr)
+            sys.exit(1)
+
+    print('{} FasmLines'.format(len(reference[1])))
+
+    timings = {}
+    for engine in sorted(fasm_disassembler.DISASSEMBLERS):
+        timings[engine] = min(
+            run_engine(db, engine, bitdata, args.verbose)[1]
+            for _ in range(args.repeat))
+
+    for engine, seconds in sorted(timings.items(), key=lambda x: x[1]):
+        print(
+            '{:10s} {:10.4f} s {:8.2f}x scalar'.format(
+                engine, seconds, timings['scalar'] / seconds))
+
+
+if __name__ == '__main__':
+    main()
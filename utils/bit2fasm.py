@@ -19,7 +19,9 @@ import fasm.output
 from prjxray.db import Database
 from prjxray import fasm_disassembler
 from prjxray import bitstream
+from prjxray import bitstream_reader
 import subprocess
+import sys
 import tempfile
 
 
@@ -36,21 +38,159 @@ def bit_to_bits(bitread, part_yaml, bit_file, bits_file, frame_range=None):
         shell=True)
 
 
-def bits_to_fasm(db_root, part, bits_file, verbose, canonical):
-    db = Database(db_root, part)
+def open_database(db_root, part, compiled_db=None, lazy_segbits=False):
+    if compiled_db is not None:
+        return Database.open_compiled(compiled_db, lazy_segbits=lazy_segbits)
+    else:
+        return Database(db_root, part, lazy_segbits=lazy_segbits)
+
+
+def in_process_part(db):
+    """ Return the bitstream.Part of db used to read bitstreams in process.
+
+    Returns None if part.json has no idcode / global_clock_regions, e.g. in
+    older databases, which can still be read with bitread.
+
+    """
+    try:
+        return db.get_part()
+    except bitstream.PartDataError:
+        return None
+
+
+def bit_to_frame_bits(db, bit_file, frame_range=None, part=None):
+    """ Read FrameBits from bit file (binary) without calling bitread.
+
+    part: bitstream.Part of db, read from the database if None.
+
+    """
+    if part is None:
+        part = db.get_part()
+    frames = bitstream_reader.read_bitstream_file(bit_file, part)
+
+    if frame_range:
+        frame_range = bitstream_reader.parse_frame_range(frame_range)
+
+    return bitstream_reader.frames_to_frame_bits(
+        frames, frame_range=frame_range)
+
+
+def bit_to_bitdata(db, bit_file, frame_range=None):
+    """ Read bitdata from bit file (binary) without calling bitread. """
+    return bit_to_frame_bits(db, bit_file, frame_range=frame_range).bitdata()
+
+
+def engine_bitdata(frame_bits, engine):
+    """ Return FrameBits as the bitdata to decode with engine.
+
+    The matrix engine reads the FrameBits columns of a BitdataView (see
+    fasm_disassembler.FrameArray), the scalar engine looks up the sets of
+    each frame many times, so gets plain bitdata.
+
+    """
+    if engine == 'matrix':
+        return frame_bits.bitdata_view()
+
+    return frame_bits.bitdata()
+
+
+def stream_fasm(disassembler, bitdata, verbose, canonical, fasm_out=None):
+    """ Print FASM of bitdata as each tile is decoded.
+
+    Prints the same as bits_to_fasm, but tiles are decoded and printed one
+    at a time in output order, see FasmDisassembler.find_features_by_tile.
+
+    """
+    # Canonical FASM is sorted by line, i.e. by tile name first.
+    tile_key = str if canonical else disassembler.grid.tile_key
+
+    any_lines = False
+    for tile, fasm_lines in disassembler.find_features_by_tile(
+            bitdata, tile_key, verbose=verbose and not canonical):
+        zero_function = None
+        if tile is not None:
+            zero_function = disassembler.is_zero_feature
+
+        lines = [
+            line for fasm_line in fasm.output.merge_and_sort(
+                fasm_lines, zero_function=zero_function)
+            for line in fasm.fasm_line_to_string(
+                fasm_line, canonical=canonical)
+        ]
+        if canonical:
+            lines = sorted(set(lines))
+
+        if not lines:
+            continue
+
+        # Blank line between tiles, like merge_and_sort.
+        if any_lines and not canonical:
+            print(file=fasm_out)
+
+        print('\n'.join(lines), file=fasm_out)
+        any_lines = True
+
+    if not any_lines:
+        print(file=fasm_out)
+
+
+def bits_to_fasm(
+        db_root,
+        part,
+        bits_file,
+        verbose,
+        canonical,
+        compiled_db=None,
+        bitdata=None,
+        db=None,
+        lazy_segbits=False,
+        engine='scalar',
+        jobs=1,
+        disassembler=None,
+        fasm_out=None,
+        stream=False):
+    """ Print FASM of bits file, or of bitdata if not None.
+
+    engine: Key of fasm_disassembler.DISASSEMBLERS to decode with.
+    jobs: Number of worker processes to decode with, scalar engine only.
+    disassembler: Optional disassembler of db to reuse, instead of creating
+                  one for engine.
+    fasm_out: File to print to, defaults to stdout.
+    stream: Print each tile as it is decoded, see stream_fasm.  Scalar engine
+            and a single job only.
+
+    """
+    if db is None:
+        db = open_database(
+            db_root, part, compiled_db=compiled_db, lazy_segbits=lazy_segbits)
     grid = db.grid()
-    disassembler = fasm_disassembler.FasmDisassembler(db)
+    if disassembler is None:
+        disassembler = fasm_disassembler.DISASSEMBLERS[engine](db)
 
-    with open(bits_file) as f:
-        bitdata = bitstream.load_bitdata(f)
+    if bitdata is None:
+        with open(bits_file) as f:
+            bitdata = bitstream.load_bitdata(f)
 
-    model = fasm.output.merge_and_sort(
-        disassembler.find_features_in_bitstream(bitdata, verbose=verbose),
-        zero_function=disassembler.is_zero_feature,
-        sort_key=grid.tile_key,
-    )
+    if stream:
+        stream_fasm(
+            disassembler, bitdata, verbose, canonical, fasm_out=fasm_out)
+    else:
+        model = fasm.output.merge_and_sort(
+            disassembler.find_features_in_bitstream(
+                bitdata, verbose=verbose, jobs=jobs),
+            zero_function=disassembler.is_zero_feature,
+            sort_key=grid.tile_key,
+        )
+
+        print(
+            fasm.fasm_tuple_to_string(model, canonical=canonical),
+            end='',
+            file=fasm_out)
 
-    print(fasm.fasm_tuple_to_string(model, canonical=canonical), end='')
+    if verbose:
+        print(
+            'Read {} segbits files'.format(db.segbits_files_read),
+            file=sys.stderr)
 
 
 def main():
@@ -82,18 +222,25 @@ def main():
         default_bitread = os.path.join(os.getenv("XRAY_TOOLS_DIR"), 'bitread')
 
     parser.add_argument('--db-root', help="Database root.", **db_root_kwargs)
+    parser.add_argument(
+        '--compiled-db',
+        help="Database snapshot written by compile_db.py, used instead of "
+        "the database in --db-root.")
     parser.add_argument(
         '--bits-file',
-        help="Output filename for bitread output, default is deleted tempfile.",
+        help="Also write the bits of the bitstream (bitread -y format) to "
+        "this file.",
         default=None)
     parser.add_argument(
         '--part', help="Name of part being targetted.", **part_kwargs)
     parser.add_argument(
         '--bitread',
-        help="Name of part being targetted.",
-        default=default_bitread)
+        help="Read the bitstream with this bitread binary.  By default the "
+        "bitstream is read in process, or with {} if part.json has no "
+        "idcode / global_clock_regions.".format(default_bitread))
     parser.add_argument(
-        '--frame_range', help="Frame range to use with bitread.")
+        '--frame_range',
+        help="Only decode frames in this range, e.g. 0x00000000:0x0000ffff")
     parser.add_argument('bit_file', help='')
     parser.add_argument(
         '--verbose',
@@ -101,8 +248,75 @@ def main():
         action='store_true')
     parser.add_argument(
         '--canonical', help='Output canonical bitstream.', action='store_true')
+    parser.add_argument(
+        '--lazy-segbits',
+        help="Only read the segbits of block types with frames present in "
+        "the bitstream, useful for partial bitstreams.",
+        action='store_true')
+    parser.add_argument(
+        '--engine',
+        choices=sorted(fasm_disassembler.DISASSEMBLERS),
+        default='scalar',
+        help="Feature matching engine.  'matrix' evaluates all tiles of a "
+        "tile type at once, which is faster on large bitstreams.")
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help="Decode the bitstream in this many worker processes, split by "
+        "configuration row.  Output is identical to a single process.  Only "
+        "supported by the scalar engine.")
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help="Decode and print one tile at a time in output order, so "
+        "output starts right away and is not held in memory.  Output is "
+        "identical.  Only supported by the scalar engine with one job.")
     args = parser.parse_args()
 
+    if args.jobs > 1 and args.engine != 'scalar':
+        parser.error('--jobs is only supported by the scalar engine')
+
+    if args.stream and (args.jobs > 1 or args.engine != 'scalar'):
+        parser.error(
+            '--stream is only supported by the scalar engine with one job')
+
+    db = open_database(
+        args.db_root,
+        args.part,
+        compiled_db=args.compiled_db,
+        lazy_segbits=args.lazy_segbits)
+
+    part = None
+    bitread = args.bitread
+    if bitread is None:
+        part = in_process_part(db)
+        if part is None:
+            bitread = default_bitread
+
+    if part is not None:
+        bitdata = engine_bitdata(
+            bit_to_frame_bits(
+                db, args.bit_file, frame_range=args.frame_range, part=part),
+            args.engine)
+
+        if args.bits_file:
+            with open(args.bits_file, 'w') as f:
+                bitstream_reader.write_bits(f, bitdata)
+
+        bits_to_fasm(
+            args.db_root,
+            args.part,
+            None,
+            args.verbose,
+            args.canonical,
+            bitdata=bitdata,
+            db=db,
+            engine=args.engine,
+            jobs=args.jobs,
+            stream=args.stream)
+        return
+
     with contextlib.ExitStack() as stack:
         if args.bits_file:
             bits_file = stack.enter_context(open(args.bits_file, 'wb'))
@@ -110,7 +324,7 @@ def main():
             bits_file = stack.enter_context(tempfile.NamedTemporaryFile())
 
         bit_to_bits(
-            bitread=args.bitread,
+            bitread=bitread,
             part_yaml=os.path.join(args.db_root, args.part, "part.yaml"),
             bit_file=args.bit_file,
             bits_file=bits_file.name,
@@ -118,8 +332,15 @@ def main():
         )
 
         bits_to_fasm(
-            args.db_root, args.part, bits_file.name, args.verbose,
-            args.canonical)
+            args.db_root,
+            args.part,
+            bits_file.name,
+            args.verbose,
+            args.canonical,
+            db=db,
+            engine=args.engine,
+            jobs=args.jobs,
+            stream=args.stream)
 
 
 if __name__ == '__main__':
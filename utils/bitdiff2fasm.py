@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+""" Print the FASM features that differ between two bitstreams.
+
+Equivalent to running bit2fasm on both bitstreams and diffing the output,
+but only tiles using words that differ between the bitstreams are decoded.
+Features only in the first bitstream are printed as "-TILE.FEATURE", and
+features only in the second as "+TILE.FEATURE", sorted by tile.
+
+"""
+import argparse
+import os
+import sys
+
+import fasm
+import numpy as np
+
+from prjxray import bitstream
+from prjxray.fasm_disassembler import FasmDisassembler, FrameArray
+import utils.bit2fasm as bit2fasm
+
+
+def read_bitdata(db, fname):
+    """ Read bitdata of a bitstream (.bit / .bin) or bits file (.bits). """
+    if fname.endswith('.bits'):
+        with open(fname) as f:
+            return bitstream.load_bitdata(f)
+
+    return bit2fasm.bit_to_bitdata(db, fname)
+
+
+def changed_words(frames_a, frames_b):
+    """ Return a dict of frame address to array of words that differ.
+
+    frames_a, frames_b: FrameArray of the two bitstreams.
+
+    """
+    addresses = np.union1d(frames_a.addresses, frames_b.addresses)
+    word_count = max(frames_a.words.shape[1], frames_b.words.shape[1])
+
+    diff = np.zeros((len(addresses), word_count), dtype=np.uint32)
+    for frame_array in (frames_a, frames_b):
+        words = frame_array.words[frame_array.rows(addresses)]
+        diff[:, :words.shape[1]] ^= words
+
+    frame_idx, word_idx = np.nonzero(diff)
+    bounds = np.searchsorted(frame_idx, np.arange(len(addresses) + 1))
+
+    changed = {}
+    for idx in np.unique(frame_idx).tolist():
+        changed[int(addresses[idx])] = word_idx[bounds[idx]:bounds[idx + 1]]
+
+    return changed
+
+
+def changed_tiles(segment_map, changed):
+    """ Return the set of (tile, block type) using words in changed. """
+    tiles = set()
+    for frame, bits_infos in segment_map.segment_info_for_frames(
+            changed.keys()).items():
+        words = changed[frame]
+        for bits_info in bits_infos:
+            offset = bits_info.bits.offset
+            if np.any((words >= offset) &
+                      (words < offset + bits_info.bits.words)):
+                tiles.add((bits_info.tile, bits_info.block_type))
+
+    return tiles
+
+
+def tile_has_data(frame_array, bits):
+    """ Return True if any word of the tile block bits is non-zero. """
+    rows = frame_array.rows(
+        np.arange(bits.base_address, bits.base_address + bits.frames))
+    words_set = frame_array.words_set
+    end = min(bits.offset + bits.words, words_set.shape[1] - 1)
+    return bool(np.any(words_set[rows, end] > words_set[rows, bits.offset]))
+
+
+def tile_features(disassembler, tiles, bitdata, frame_array):
+    """ Return a dict of tile to the set of FASM features set in bitdata.
+
+    Like bit2fasm, only tile blocks with data are decoded, and tiles with
+    only features without bits set are left out.
+
+    """
+    grid = disassembler.grid
+
+    features = {}
+    for tile, block_type in tiles:
+        bits = grid.gridinfo_at_tilename(tile).bits[block_type]
+        if not tile_has_data(frame_array, bits):
+            continue
+
+        for fasm_line in disassembler.find_features_in_tile(tile, block_type,
+                                                            bits, {}, bitdata):
+            if tile not in features:
+                features[tile] = set()
+            features[tile].add(fasm_line.set_feature)
+
+    return {
+        tile: set(
+            fasm.set_feature_to_str(set_feature)
+            for set_feature in set_features)
+        for tile, set_features in features.items()
+        if not all(
+            disassembler.is_zero_feature(set_feature.feature)
+            for set_feature in set_features)
+    }
+
+
+def diff_features(db, bitdata_a, bitdata_b, disassembler=None):
+    """ Yield (tile, removed features, added features) of tiles that differ.
+
+    Tiles are in grid order, features are sorted.
+
+    """
+    if disassembler is None:
+        disassembler = FasmDisassembler(db)
+    grid = disassembler.grid
+
+    frames_a = FrameArray(bitdata_a)
+    frames_b = FrameArray(bitdata_b)
+
+    tiles = changed_tiles(
+        disassembler.segment_map, changed_words(frames_a, frames_b))
+
+    features_a = tile_features(disassembler, tiles, bitdata_a, frames_a)
+    features_b = tile_features(disassembler, tiles, bitdata_b, frames_b)
+
+    for tile in sorted(set(tile for tile, _ in tiles), key=grid.tile_key):
+        removed = features_a.get(tile, set()) - features_b.get(tile, set())
+        added = features_b.get(tile, set()) - features_a.get(tile, set())
+        if removed or added:
+            yield tile, sorted(removed), sorted(added)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    database_dir = os.getenv("XRAY_DATABASE_DIR")
+    database = os.getenv("XRAY_DATABASE")
+    db_root_kwargs = {}
+    if database_dir is None or database is None:
+        db_root_kwargs['required'] = True
+    else:
+        db_root_kwargs['required'] = False
+        db_root_kwargs['default'] = os.path.join(database_dir, database)
+
+    default_part = os.getenv("XRAY_PART")
+    part_kwargs = {}
+    if default_part is None:
+        part_kwargs['required'] = True
+    else:
+        part_kwargs['required'] = False
+        part_kwargs['default'] = default_part
+
+    parser.add_argument('--db-root', help="Database root.", **db_root_kwargs)
+    parser.add_argument(
+        '--part', help="Name of part being targetted.", **part_kwargs)
+    parser.add_argument(
+        '--compiled-db',
+        help="Database snapshot written by compile_db.py, used instead of "
+        "the database in --db-root.")
+    parser.add_argument(
+        '--verbose',
+        help="Print the number of frames and words that differ to stderr.",
+        action='store_true')
+    parser.add_argument(
+        'bit_file_a',
+        help="First bitstream (.bit or .bin), or bits file (.bits).")
+    parser.add_argument(
+        'bit_file_b',
+        help="Second bitstream (.bit or .bin), or bits file (.bits).")
+    args = parser.parse_args()
+
+    db = bit2fasm.open_database(
+        args.db_root, args.part, compiled_db=args.compiled_db)
+
+    bitdata_a = read_bitdata(db, args.bit_file_a)
+    bitdata_b = read_bitdata(db, args.bit_file_b)
+
+    if args.verbose:
+        changed = changed_words(FrameArray(bitdata_a), FrameArray(bitdata_b))
+        print(
+            '{} frames, {} words differ'.format(
+                len(changed), sum(len(words) for words in changed.values())),
+            file=sys.stderr)
+
+    for _, removed, added in diff_features(db, bitdata_a, bitdata_b):
+        for feature in removed:
+            print('-' + feature)
+        for feature in added:
+            print('+' + feature)
+
+
+if __name__ == '__main__':
+    main()
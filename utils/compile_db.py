@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+'''
+Pack the database of a part into a single binary snapshot file.
+
+The snapshot can be passed to bit2fasm and fasm2frames with --compiled-db,
+or opened with prjxray.db.Database.open_compiled.
+'''
+
+import argparse
+
+from prjxray import util
+from prjxray.db import Database
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compile the database of a part into a snapshot file.')
+
+    util.db_root_arg(parser)
+    util.part_arg(parser)
+    parser.add_argument('fn_out', help='Output snapshot file')
+
+    args = parser.parse_args()
+
+    db = Database(args.db_root, args.part)
+    db.write_compiled(args.fn_out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+""" Submit bit2fasm / fasm2frames conversions to conversion_server.py.
+
+Only uses the standard library, so starts quickly, see conversion_server.py
+for the protocol.
+
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+
+
+class ServerError(Exception):
+    pass
+
+
+def submit(socket_path, request):
+    """ Send request to the server at socket_path, return the response. """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        with s.makefile('rwb') as f:
+            f.write(json.dumps(request).encode('utf-8') + b'\n')
+            f.flush()
+            line = f.readline()
+
+    if not line:
+        raise ServerError('Server closed the connection')
+
+    return json.loads(line)
+
+
+def abspath(path):
+    if path is None:
+        return None
+
+    return os.path.abspath(path)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--socket',
+        default=os.getenv('XRAY_SERVER_SOCKET', 'prjxray.sock'),
+        help="Unix domain socket of the server.")
+
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    database_dir = os.getenv("XRAY_DATABASE_DIR")
+    database = os.getenv("XRAY_DATABASE")
+    db_root_default = None
+    if database_dir is not None and database is not None:
+        db_root_default = os.path.join(database_dir, database)
+
+    def add_database_arguments(subparser):
+        subparser.add_argument(
+            '--db-root',
+            required=db_root_default is None,
+            default=db_root_default,
+            help="Database root.")
+        subparser.add_argument(
+            '--part',
+            required=os.getenv("XRAY_PART") is None,
+            default=os.getenv("XRAY_PART"),
+            help="Name of part being targetted.")
+        subparser.add_argument(
+            '--compiled-db',
+            help="Database snapshot written by compile_db.py, used instead "
+            "of the database in --db-root.")
+        subparser.add_argument(
+            '--timing',
+            action='store_true',
+            help="Print the timing of the request to stderr.")
+
+    bit2fasm_parser = subparsers.add_parser(
+        'bit2fasm', help="Convert a bitstream to FASM.")
+    add_database_arguments(bit2fasm_parser)
+    bit2fasm_parser.add_argument(
+        '--frame_range',
+        help="Only decode frames in this range, e.g. 0x00000000:0x0000ffff")
+    bit2fasm_parser.add_argument(
+        '--verbose',
+        help='Print lines for unknown tiles and bits',
+        action='store_true')
+    bit2fasm_parser.add_argument(
+        '--canonical', help='Output canonical bitstream.', action='store_true')
+    bit2fasm_parser.add_argument(
+        '--engine', default='scalar', help="Feature matching engine.")
+    bit2fasm_parser.add_argument(
+        '--output', help="Write the FASM to this file instead of stdout.")
+    bit2fasm_parser.add_argument(
+        'bit_file', help="Bitstream, or bits file if it ends in .bits.")
+
+    fasm2frames_parser = subparsers.add_parser(
+        'fasm2frames', help="Convert FASM to frames.")
+    add_database_arguments(fasm2frames_parser)
+    fasm2frames_parser.add_argument(
+        '--sparse', action='store_true', help="Don't zero fill all frames")
+    fasm2frames_parser.add_argument(
+        '--roi',
+        help="ROI design.json file defining which tiles are within the ROI.")
+    fasm2frames_parser.add_argument(
+        '--emit_pudc_b_pullup',
+        help="Emit an IBUF and PULLUP on the PUDC_B pin if unused",
+        action='store_true')
+    fasm2frames_parser.add_argument(
+        '--bitstream', help="Also write the frames as a bitstream.")
+    fasm2frames_parser.add_argument(
+        'fn_in', help='Input FPGA assembly (.fasm) file')
+    fasm2frames_parser.add_argument(
+        'fn_out',
+        nargs='?',
+        help="Output FPGA frame (.frm) file, stdout if neither it nor "
+        "--bitstream is given.")
+
+    subparsers.add_parser('stats', help="Print server statistics.")
+    subparsers.add_parser('shutdown', help="Stop the server.")
+
+    args = parser.parse_args()
+
+    request = {'op': args.command}
+    if args.command == 'bit2fasm':
+        bit_file = abspath(args.bit_file)
+        is_bits = bit_file.endswith('.bits')
+        request.update(
+            bit_file=None if is_bits else bit_file,
+            bits_file=bit_file if is_bits else None,
+            frame_range=args.frame_range,
+            verbose=args.verbose,
+            canonical=args.canonical,
+            engine=args.engine,
+            fasm_file=abspath(args.output))
+    elif args.command == 'fasm2frames':
+        request.update(
+            fasm_file=abspath(args.fn_in),
+            frm_file=abspath(args.fn_out),
+            sparse=args.sparse,
+            roi=abspath(args.roi),
+            emit_pudc_b_pullup=args.emit_pudc_b_pullup,
+            bitstream=abspath(args.bitstream))
+
+    if args.command in ('bit2fasm', 'fasm2frames'):
+        request.update(
+            db_root=abspath(args.db_root),
+            part=args.part,
+            compiled_db=abspath(args.compiled_db))
+
+    response = submit(args.socket, request)
+    if not response['ok']:
+        print(response['error'], file=sys.stderr)
+        sys.exit(1)
+
+    if args.command == 'stats':
+        print(json.dumps(response, indent=2))
+        return
+
+    if response.get('result') is not None:
+        sys.stdout.write(response['result'])
+
+    if getattr(args, 'timing', False):
+        print(
+            ' '.join(
+                '{}={:.3f}s'.format(name, seconds)
+                for name, seconds in response['timing'].items()),
+            file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+""" Long running bit2fasm / fasm2frames server with warm databases.
+
+Every bit2fasm and fasm2frames invocation loads the Database, Grid,
+SegmentMap and segbits of the part again, which dominates the run time of
+small conversions.  The server keeps them loaded for the most recently used
+parts and runs conversions submitted over a Unix domain socket.
+
+Protocol: the client sends one JSON object per line and gets one JSON object
+per line back, in order, on the same connection.  Requests have an "op":
+
+  bit2fasm:    db_root, part, compiled_db (optional), bit_file (.bit / .bin)
+               or bits_file (bitread -y output), frame_range, verbose,
+               canonical, engine, fasm_file (optional output).
+  fasm2frames: db_root, part, compiled_db (optional), fasm_file, sparse,
+               roi, emit_pudc_b_pullup, frm_file and bitstream (optional
+               outputs).
+  stats:       Loaded parts and request counters.
+  shutdown:    Stop the server.
+
+See conversion_client.py for a client.  Paths are used as is by the
+server, so should be absolute.  Outputs not written to a file are returned
+in "result".  Responses have "ok", "error" if not ok, and "timing" with the
+seconds spent waiting for a free slot and for the part ("wait"), loading the
+part ("load"), converting ("run") and in total ("total").
+
+Requests on the same part are run one at a time, as a Database is not
+thread safe.  At most --max-jobs requests load a part or run at once, and the
+--max-parts most recently used parts are kept loaded.
+
+Requests run in threads of the server process, so conversions of different
+parts share the GIL: they overlap on I/O and numpy work, but the Python
+decoding and assembly of only one part runs at a time.  Run several servers
+for more throughput on CPU bound workloads.
+
+"""
+import argparse
+import collections
+import io
+import json
+import os
+import socketserver
+import threading
+import time
+
+from prjxray import bitstream
+from prjxray import fasm_assembler
+from prjxray import fasm_disassembler
+import utils.bit2fasm as bit2fasm
+import utils.fasm2frames as fasm2frames
+
+
+class RequestError(Exception):
+    pass
+
+
+class WarmPart(object):
+    """ Database of one part, with everything conversions reuse. """
+
+    def __init__(self, db_root, part, compiled_db=None):
+        self.db = bit2fasm.open_database(
+            db_root, part, compiled_db=compiled_db)
+
+        # Database.grid() keeps the Grid once built.
+        self.db.grid()
+
+        # Engine -> disassembler, the SegmentMap is built by the first one.
+        self.disassemblers = {}
+        self.feature_bits = fasm_assembler.FeatureBitsCache()
+
+        # Only one request uses the part at a time.
+        self.lock = threading.Lock()
+
+    def get_disassembler(self, engine):
+        if engine not in fasm_disassembler.DISASSEMBLERS:
+            raise RequestError('Unknown engine {}'.format(engine))
+
+        if engine not in self.disassemblers:
+            disassembler_class = fasm_disassembler.DISASSEMBLERS[engine]
+            self.disassemblers[engine] = disassembler_class(self.db)
+
+        return self.disassemblers[engine]
+
+
+class PartCache(object):
+    """ LRU of WarmPart, keyed by (db_root, part, compiled_db). """
+
+    def __init__(self, max_parts):
+        self.max_parts = max_parts
+        self.parts = collections.OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def get(self, db_root, part, compiled_db=None):
+        """ Return (WarmPart, seconds spent loading it). """
+        key = (db_root, part, compiled_db)
+
+        with self.lock:
+            if key in self.parts:
+                self.parts.move_to_end(key)
+                return self.parts[key], 0.0
+
+            # Only one request loads a part, others wait for it.
+            if key not in self.loading:
+                self.loading[key] = threading.Lock()
+            load_lock = self.loading[key]
+
+        with load_lock:
+            with self.lock:
+                if key in self.parts:
+                    self.parts.move_to_end(key)
+                    return self.parts[key], 0.0
+
+            try:
+                start = time.perf_counter()
+                warm_part = WarmPart(db_root, part, compiled_db=compiled_db)
+                load_time = time.perf_counter() - start
+
+                with self.lock:
+                    self.parts[key] = warm_part
+
+                    # Requests still using an evicted part keep it alive
+                    # until they finish.
+                    while len(self.parts) > self.max_parts:
+                        self.parts.popitem(last=False)
+            finally:
+                # A failed load must not leave its lock behind, otherwise
+                # the next request for this part retries under a stale lock.
+                with self.lock:
+                    self.loading.pop(key, None)
+
+        return warm_part, load_time
+
+    def keys(self):
+        with self.lock:
+            return list(self.parts.keys())
+
+
+def run_bit2fasm(warm_part, request):
+    db = warm_part.db
+    if request.get('bit_file') is not None:
+        bitdata = bit2fasm.engine_bitdata(
+            bit2fasm.bit_to_frame_bits(
+                db,
+                request['bit_file'],
+                frame_range=request.get('frame_range')),
+            request.get('engine', 'scalar'))
+    elif request.get('bits_file') is not None:
+        with open(request['bits_file']) as f:
+            bitdata = bitstream.load_bitdata(f)
+    else:
+        raise RequestError('bit2fasm needs bit_file or bits_file')
+
+    f = io.StringIO()
+    bit2fasm.bits_to_fasm(
+        db.db_root,
+        db.part,
+        None,
+        request.get('verbose', False),
+        request.get('canonical', False),
+        bitdata=bitdata,
+        db=db,
+        disassembler=warm_part.get_disassembler(
+            request.get('engine', 'scalar')),
+        fasm_out=f)
+
+    if request.get('fasm_file') is not None:
+        with open(request['fasm_file'], 'w') as fasm_out:
+            fasm_out.write(f.getvalue())
+        return None
+
+    return f.getvalue()
+
+
+def run_fasm2frames(warm_part, request):
+    if request.get('fasm_file') is None:
+        raise RequestError('fasm2frames needs fasm_file')
+
+    frm_file = request.get('frm_file')
+    f = io.StringIO()
+    if frm_file is None and request.get('bitstream') is not None:
+        f = None
+
+    db = warm_part.db
+    fasm2frames.run(
+        db.db_root,
+        db.part,
+        request['fasm_file'],
+        f,
+        sparse=request.get('sparse', False),
+        roi=request.get('roi'),
+        emit_pudc_b_pullup=request.get('emit_pudc_b_pullup', False),
+        bitstream_out=request.get('bitstream'),
+        db=db,
+        feature_bits=warm_part.feature_bits)
+
+    if f is None:
+        return None
+
+    if frm_file is not None:
+        with open(frm_file, 'w') as frm_out:
+            frm_out.write(f.getvalue())
+        return None
+
+    return f.getvalue()
+
+
+CONVERSIONS = {
+    'bit2fasm': run_bit2fasm,
+    'fasm2frames': run_fasm2frames,
+}
+
+
+class ConversionServer(socketserver.ThreadingMixIn,
+                       socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, max_parts=4, max_jobs=4):
+        self.parts = PartCache(max_parts)
+        self.jobs = threading.BoundedSemaphore(max_jobs)
+
+        self.counters_lock = threading.Lock()
+        self.counters = collections.Counter()
+
+        super().__init__(socket_path, ConversionHandler)
+
+    def count(self, name):
+        with self.counters_lock:
+            self.counters[name] += 1
+
+    def handle_request_object(self, request):
+        """ Run one request, return the response object. """
+        op = request.get('op')
+        if op == 'stats':
+            with self.counters_lock:
+                counters = dict(self.counters)
+            return {
+                'ok': True,
+                'parts': [list(key) for key in self.parts.keys()],
+                'counters': counters,
+            }
+        elif op == 'shutdown':
+            threading.Thread(target=self.shutdown).start()
+            return {'ok': True}
+        elif op not in CONVERSIONS:
+            raise RequestError('Unknown op {}'.format(op))
+
+        start = time.perf_counter()
+        with self.jobs:
+            warm_part, load_time = self.parts.get(
+                request.get('db_root'), request.get('part'),
+                request.get('compiled_db'))
+
+        # Wait for the part before taking a slot, so requests queued on a
+        # busy part do not hold slots that requests on other parts could
+        # use.
+        with warm_part.lock, self.jobs:
+            run_start = time.perf_counter()
+            result = CONVERSIONS[op](warm_part, request)
+            end = time.perf_counter()
+
+        self.count(op)
+        return {
+            'ok': True,
+            'result': result,
+            'timing': {
+                'wait': run_start - start - load_time,
+                'load': load_time,
+                'run': end - run_start,
+                'total': end - start,
+            },
+        }
+
+
+class ConversionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise RequestError('Request must be a JSON object')
+
+                response = self.server.handle_request_object(request)
+            except Exception as e:
+                self.server.count('errors')
+                response = {
+                    'ok': False,
+                    'error': '{}: {}'.format(type(e).__name__, e),
+                }
+
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+def serve(socket_path, max_parts, max_jobs):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    with ConversionServer(socket_path, max_parts=max_parts,
+                          max_jobs=max_jobs) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--socket',
+        default=os.getenv('XRAY_SERVER_SOCKET', 'prjxray.sock'),
+        help="Unix domain socket to listen on.")
+    parser.add_argument(
+        '--max-parts',
+        type=int,
+        default=4,
+        help="Number of parts kept loaded.")
+    parser.add_argument(
+        '--max-jobs',
+        type=int,
+        default=4,
+        help="Number of requests run at once, on different parts.")
+    args = parser.parse_args()
+
+    serve(args.socket, args.max_parts, args.max_jobs)
+
+
+if __name__ == '__main__':
+    main()
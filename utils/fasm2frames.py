@@ -20,7 +20,7 @@ import csv
 
 from collections import defaultdict
 
-from prjxray import fasm_assembler, util
+from prjxray import bitstream_writer, fasm_assembler, util
 from prjxray.db import Database
 from prjxray.roi import Roi
 
@@ -109,6 +109,25 @@ def get_iob_sites(db, tile_name):
         yield "IOB_Y{}".format(site_y)
 
 
+def write_bitstream(db, frames, filename_in, fn_out, crc_check=False):
+    '''Write frames as a .bit file, or a .bin file if fn_out ends in .bin
+
+    With crc_check, the bitstream includes a CRC check of the frame data.
+
+    '''
+    part = db.get_part()
+    with open(fn_out, 'wb') as f:
+        bitstream_writer.write_bitstream(
+            f,
+            frames,
+            part,
+            part_name=db.part,
+            source_name=os.path.basename(filename_in),
+            generator='fasm2frames',
+            bit_header_enabled=not fn_out.endswith('.bin'),
+            crc_check=crc_check)
+
+
 def run(
         db_root,
         part,
@@ -117,9 +136,34 @@ def run(
         sparse=False,
         roi=None,
         debug=False,
-        emit_pudc_b_pullup=False):
-    db = Database(db_root, part)
-    assembler = fasm_assembler.FasmAssembler(db)
+        emit_pudc_b_pullup=False,
+        compiled_db=None,
+        feature_cache=None,
+        jobs=1,
+        bitstream_out=None,
+        crc_check=False,
+        db=None,
+        feature_bits=None):
+    ''' Assemble FASM file filename_in into frames.
+
+    db: Optional already open Database of part to use.
+    feature_bits: Optional FeatureBitsCache to use and extend, e.g. shared
+                  between runs on the same db.
+
+    '''
+    if db is None and compiled_db is not None:
+        db = Database.open_compiled(compiled_db)
+    elif db is None:
+        db = Database(db_root, part)
+
+    if feature_bits is None:
+        feature_bits = fasm_assembler.FeatureBitsCache()
+
+    if feature_cache is not None:
+        db_signature = fasm_assembler.database_signature(db)
+        feature_bits.load(feature_cache, db_signature)
+
+    assembler = fasm_assembler.FasmAssembler(db, feature_bits=feature_bits)
 
     set_features = set()
 
@@ -185,7 +229,8 @@ def run(
     extra_features += list(
         fasm.parse_fasm_string('\n'.join(required_features)))
 
-    assembler.parse_fasm_filename(filename_in, extra_features=extra_features)
+    assembler.parse_fasm_filename(
+        filename_in, extra_features=extra_features, jobs=jobs)
 
     if emit_pudc_b_pullup and not pudc_b_in_use and pudc_b_tile_site is not None:
         # Enable IN-only and PULLUP on PUDC_B IOB.
@@ -265,12 +310,20 @@ def run(
         if missing_features:
             raise fasm_assembler.FasmLookupError('\n'.join(missing_features))
 
+    if feature_cache is not None:
+        feature_bits.save(feature_cache, db_signature)
+
     frames = assembler.get_frames(sparse=sparse)
 
     if debug:
         dump_frames_sparse(frames)
 
-    dump_frm(f_out, frames)
+    if f_out is not None:
+        dump_frm(f_out, frames)
+
+    if bitstream_out is not None:
+        write_bitstream(
+            db, frames, filename_in, bitstream_out, crc_check=crc_check)
 
 
 def main():
@@ -281,6 +334,14 @@ def main():
 
     util.db_root_arg(parser)
     util.part_arg(parser)
+    parser.add_argument(
+        '--compiled-db',
+        help="Database snapshot written by compile_db.py, used instead of "
+        "the database in --db-root.")
+    parser.add_argument(
+        '--feature-cache',
+        help="File caching the bits of features between runs, e.g. placed "
+        "next to the database.  Rebuilt when the database changes.")
     parser.add_argument(
         '--sparse', action='store_true', help="Don't zero fill all frames")
     parser.add_argument(
@@ -292,23 +353,48 @@ def main():
         action='store_true')
     parser.add_argument(
         '--debug', action='store_true', help="Print debug dump")
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help="Assemble the FASM file in this many worker processes, "
+        "sharded by tile.")
+    parser.add_argument(
+        '--bitstream',
+        help="Also write the frames as a bitstream to this file, without "
+        "going through xc7frames2bit.  Written without the .bit header if "
+        "the name ends in .bin.")
+    parser.add_argument(
+        '--crc',
+        action='store_true',
+        help="Have the device check the CRC of the frame data written by "
+        "--bitstream.")
     parser.add_argument('fn_in', help='Input FPGA assembly (.fasm) file')
     parser.add_argument(
         'fn_out',
-        default='/dev/stdout',
         nargs='?',
-        help='Output FPGA frame (.frm) file')
+        help='Output FPGA frame (.frm) file, defaults to stdout unless '
+        '--bitstream is given')
 
     args = parser.parse_args()
+
+    fn_out = args.fn_out
+    if fn_out is None and args.bitstream is None:
+        fn_out = '/dev/stdout'
     run(
         db_root=args.db_root,
         part=args.part,
         filename_in=args.fn_in,
-        f_out=open(args.fn_out, 'w'),
+        f_out=open(fn_out, 'w') if fn_out is not None else None,
         sparse=args.sparse,
         roi=args.roi,
         debug=args.debug,
-        emit_pudc_b_pullup=args.emit_pudc_b_pullup)
+        emit_pudc_b_pullup=args.emit_pudc_b_pullup,
+        compiled_db=args.compiled_db,
+        feature_cache=args.feature_cache,
+        jobs=args.jobs,
+        bitstream_out=args.bitstream,
+        crc_check=args.crc)
 
 
 if __name__ == '__main__':
@@ -16,7 +16,6 @@ Ex: BRAM_L_X6Y100:CLB_IO_CLK
 '''
 
 import sys, os, json, re
-import copy
 from prjxray import bitstream
 from prjxray import db as prjxraydb
 from prjxray import util
@@ -74,35 +73,20 @@ def get_database(db, tile_type, bit_only=False, verbose=False):
     return tags
 
 
-def mk_segbits(seginfo, bitdata):
+def mk_segbits(seginfo, frame_bits):
     '''
     Given a tile memory region (seginfo), return list of bits in that region
 
     seginfo: mk_segments()s object supplying address range
-    bitdata: all bits in the entire bitstream
+    frame_bits: bitstream.FrameBits of the entire bitstream
     '''
 
-    segbits = set()
-
     block = seginfo["block"]
-    baseaddr = int(block["baseaddr"], 0)
-    frames = block["frames"]
-    word_offset = block["offset"]
-    words = block["words"]
-
-    for frame in range(baseaddr, baseaddr + frames):
-        if frame not in bitdata:
-            continue
-        for wordidx in range(word_offset, word_offset + words):
-            if wordidx not in bitdata[frame]:
-                continue
-            for bitidx in bitdata[frame][wordidx]:
-                frame_addr = frame - baseaddr
-                bit_addr = 32 * (wordidx - word_offset) + bitidx
-                #segbits.add( "%02d_%02d" % (frame_addr, word_addr))
-                segbits.add((frame_addr, bit_addr))
+    frame_offsets, bit_offsets = frame_bits.select(
+        int(block["baseaddr"], 0), block["frames"], block["offset"],
+        block["words"])
 
-    return segbits
+    return set(zip(frame_offsets.tolist(), bit_offsets.tolist()))
 
 
 def gen_tilegrid_masks(tiles):
@@ -124,7 +108,7 @@ def print_unknown_bits(tiles, bitdata):
     bitdata[addr][word] = set of bit indices (0 to 31)
     '''
     # Start with an open set and remove elements as we find them
-    tocheck = copy.deepcopy(bitdata)
+    tocheck = {frame: dict(words) for frame, words in bitdata.items()}
 
     for addr_min, addr_max_p1, word_min, word_max_p1 in gen_tilegrid_masks(
             tiles):
@@ -297,7 +281,7 @@ def print_seg(
 def handle_segment(
         db,
         segname,
-        bitdata,
+        frame_bits,
         decode_emit,
         decode_omit,
         omit_empty_segs,
@@ -307,7 +291,7 @@ def handle_segment(
 
     seginfo = segments[segname]
 
-    segbits = mk_segbits(seginfo, bitdata)
+    segbits = mk_segbits(seginfo, frame_bits)
     nbits = len(segbits)
 
     if decode_emit or decode_omit:
@@ -449,10 +433,11 @@ def run(
     db = prjxraydb.Database(db_root, part)
     tiles = load_tiles(db_root, part)
     segments = mk_segments(tiles)
-    bitdata = bitstream.load_bitdata2(open(bits_file, "r"))
+    with open(bits_file, "r") as f:
+        frame_bits = bitstream.FrameBits.load(f)
 
     if flag_unknown_bits:
-        print_unknown_bits(tiles, bitdata)
+        print_unknown_bits(tiles, frame_bits.bitdata2())
         print("")
 
     # Default: print all
@@ -471,7 +456,7 @@ def run(
         handle_segment(
             db,
             segname,
-            bitdata,
+            frame_bits,
             flag_decode_emit,
             flag_decode_omit,
             omit_empty_segs,
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+
+from io import StringIO
+import contextlib
+import json
+import os.path
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from prjxray import bitstream
+from prjxray.db import Database
+from tests.bitdata_util import copy_bitdata, random_bitdata
+import utils.bit2fasm as bit2fasm
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+DB_ROOT = os.path.join(TEST_DATA, 'db')
+PART = 'xc7a200tffg1156-1'
+
+
+class TestStreamFasm(unittest.TestCase):
+    def assert_same_fasm(self, db, bitdata):
+        for verbose in (False, True):
+            for canonical in (False, True):
+                fasm = {}
+                for stream in (False, True):
+                    fasm[stream] = StringIO()
+                    bit2fasm.bits_to_fasm(
+                        DB_ROOT,
+                        PART,
+                        None,
+                        verbose,
+                        canonical,
+                        bitdata=copy_bitdata(bitdata),
+                        db=db,
+                        fasm_out=fasm[stream],
+                        stream=stream)
+
+                self.assertEqual(fasm[True].getvalue(), fasm[False].getvalue())
+
+    def test_designs(self):
+        db = Database(DB_ROOT, PART)
+        for design in ('ff_int', 'lut_int'):
+            with open(os.path.join(TEST_DATA, design, 'design.bits')) as f:
+                self.assert_same_fasm(db, bitstream.load_bitdata(f))
+
+    def test_random_bitdata(self):
+        db = Database(DB_ROOT, PART)
+        rng = random.Random(0)
+        for _ in range(5):
+            self.assert_same_fasm(db, random_bitdata(rng, db.grid()))
+
+    def test_empty(self):
+        self.assert_same_fasm(Database(DB_ROOT, PART), {})
+
+
+class TestBitread(unittest.TestCase):
+    def test_in_process_part(self):
+        # The test database part.json has no frame data.
+        self.assertIsNone(bit2fasm.in_process_part(Database(DB_ROOT, PART)))
+
+        with tempfile.TemporaryDirectory() as d:
+            db_root = os.path.join(d, 'db')
+            shutil.copytree(DB_ROOT, db_root)
+            with open(os.path.join(db_root, PART, 'part.json'), 'w') as f:
+                json.dump({'idcode': 0x3636093, 'global_clock_regions': {}}, f)
+
+            part = bit2fasm.in_process_part(Database(db_root, PART))
+            self.assertEqual(part.idcode, 0x3636093)
+
+    def test_bitread_fallback(self):
+        design_bits = os.path.join(TEST_DATA, 'ff_int', 'design.bits')
+
+        with tempfile.TemporaryDirectory() as d:
+            # Stands in for bitread, writes design.bits to the -o file.
+            bitread = os.path.join(d, 'bitread')
+            with open(bitread, 'w') as f:
+                f.write(
+                    '#!/bin/sh\n'
+                    'while [ "$1" != -o ]; do shift; done\n'
+                    'cp {} "$2"\n'.format(design_bits))
+            os.chmod(bitread, 0o755)
+
+            fasm_out = StringIO()
+            argv = [
+                'bit2fasm.py', '--db-root', DB_ROOT, '--part', PART,
+                os.path.join(d, 'design.bit')
+            ]
+            with mock.patch.dict(os.environ, {'XRAY_TOOLS_DIR': d}), \
+                    mock.patch.object(sys, 'argv', argv), \
+                    contextlib.redirect_stdout(fasm_out):
+                bit2fasm.main()
+
+        expected = StringIO()
+        with open(design_bits) as f:
+            bit2fasm.bits_to_fasm(
+                DB_ROOT,
+                PART,
+                None,
+                False,
+                False,
+                bitdata=bitstream.load_bitdata(f),
+                fasm_out=expected)
+
+        self.assertEqual(fasm_out.getvalue(), expected.getvalue())
+        self.assertIn('CLBLM_L_X10Y102', fasm_out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+
+import os.path
+import random
+import unittest
+
+import fasm
+
+from prjxray import bitstream
+from prjxray.db import Database
+from prjxray.fasm_disassembler import FasmDisassembler
+from tests.bitdata_util import copy_bitdata, random_bitdata
+import utils.bitdiff2fasm as bitdiff2fasm
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+DB_ROOT = os.path.join(TEST_DATA, 'db')
+PART = 'xc7a200tffg1156-1'
+
+
+def all_tile_features(db, bitdata):
+    """ Tile features of bit2fasm decoding all of bitdata. """
+    disassembler = FasmDisassembler(db)
+
+    features = {}
+    for fasm_line in disassembler.find_features_in_bitstream(
+            copy_bitdata(bitdata)):
+        set_feature = fasm_line.set_feature
+        tile = set_feature.feature.split('.')[0]
+        if tile not in features:
+            features[tile] = set()
+        features[tile].add(set_feature)
+
+    return {
+        tile: set(fasm.set_feature_to_str(f) for f in set_features)
+        for tile, set_features in features.items()
+        if not all(
+            disassembler.is_zero_feature(f.feature) for f in set_features)
+    }
+
+
+class TestBitdiff2Fasm(unittest.TestCase):
+    def assert_same_diff(self, db, bitdata_a, bitdata_b):
+        features_a = all_tile_features(db, bitdata_a)
+        features_b = all_tile_features(db, bitdata_b)
+
+        expected = {}
+        for tile in set(features_a) | set(features_b):
+            removed = features_a.get(tile, set()) - features_b.get(tile, set())
+            added = features_b.get(tile, set()) - features_a.get(tile, set())
+            if removed or added:
+                expected[tile] = (sorted(removed), sorted(added))
+
+        actual = {
+            tile: (removed, added)
+            for tile, removed, added in bitdiff2fasm.diff_features(
+                db, bitdata_a, bitdata_b)
+        }
+
+        self.assertEqual(actual, expected)
+
+    def test_designs(self):
+        db = Database(DB_ROOT, PART)
+        bitdata = {}
+        for design in ('ff_int', 'lut_int'):
+            with open(os.path.join(TEST_DATA, design, 'design.bits')) as f:
+                bitdata[design] = bitstream.load_bitdata(f)
+
+        self.assert_same_diff(db, bitdata['ff_int'], bitdata['lut_int'])
+        self.assertEqual(
+            list(
+                bitdiff2fasm.diff_features(
+                    db, bitdata['ff_int'], bitdata['ff_int'])), [])
+
+    def test_random_bitdata(self):
+        db = Database(DB_ROOT, PART)
+        rng = random.Random(0)
+        for _ in range(5):
+            bitdata_a = random_bitdata(rng, db.grid())
+            bitdata_b = copy_bitdata(bitdata_a)
+
+            # Flip some bits of frames of bitdata_a.
+            for frame in rng.sample(sorted(bitdata_a), 10):
+                for bit in rng.sample(sorted(bitdata_a[frame][1]), 1):
+                    bitdata_b[frame][1].symmetric_difference_update({bit})
+                bitdata_b[frame] = (
+                    set(
+                        bit // bitstream.WORD_SIZE_BITS
+                        for bit in bitdata_b[frame][1]), bitdata_b[frame][1])
+
+            self.assert_same_diff(db, bitdata_a, bitdata_b)
+            self.assert_same_diff(
+                db, bitdata_a, random_bitdata(rng, db.grid()))
+
+
+if __name__ == '__main__':
+    unittest.main()
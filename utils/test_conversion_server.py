@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017-2020  The Project X-Ray Authors.
+#
+# Use of this source code is governed by a ISC-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/ISC
+#
+# SPDX-License-Identifier: ISC
+
+from io import StringIO
+import contextlib
+import os.path
+import tempfile
+import threading
+import time
+import unittest
+
+from prjxray import bitstream
+import utils.bit2fasm as bit2fasm
+import utils.conversion_client as conversion_client
+import utils.conversion_server as conversion_server
+import utils.fasm2frames as fasm2frames
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+DB_ROOT = os.path.abspath(os.path.join(TEST_DATA, 'db'))
+PART = 'xc7a200tffg1156-1'
+
+
+class TestConversionServer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.socket = os.path.join(self.tmpdir.name, 'server.sock')
+
+        self.server = conversion_server.ConversionServer(
+            self.socket, max_parts=1, max_jobs=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        response = self.submit({'op': 'shutdown'})
+        self.assertTrue(response['ok'])
+
+        self.thread.join()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def submit(self, request):
+        return conversion_client.submit(self.socket, request)
+
+    def test_bit2fasm(self):
+        bits_file = os.path.join(TEST_DATA, 'ff_int', 'design.bits')
+        with open(bits_file) as f:
+            bitdata = bitstream.load_bitdata(f)
+
+        expected = StringIO()
+        with contextlib.redirect_stdout(expected):
+            bit2fasm.bits_to_fasm(
+                DB_ROOT, PART, None, False, False, bitdata=bitdata)
+
+        request = {
+            'op': 'bit2fasm',
+            'db_root': DB_ROOT,
+            'part': PART,
+            'bits_file': bits_file,
+        }
+
+        response = self.submit(request)
+        self.assertTrue(response['ok'], response.get('error'))
+        self.assertEqual(response['result'], expected.getvalue())
+        self.assertGreater(response['timing']['load'], 0)
+
+        # Second request reuses the loaded part.
+        response = self.submit(dict(request, engine='matrix'))
+        self.assertTrue(response['ok'], response.get('error'))
+        self.assertEqual(response['result'], expected.getvalue())
+        self.assertEqual(response['timing']['load'], 0)
+
+    def test_fasm2frames(self):
+        fasm_file = os.path.join(TEST_DATA, 'lut_int.fasm')
+
+        expected = StringIO()
+        fasm2frames.run(DB_ROOT, PART, fasm_file, expected)
+
+        for _ in range(2):
+            response = self.submit(
+                {
+                    'op': 'fasm2frames',
+                    'db_root': DB_ROOT,
+                    'part': PART,
+                    'fasm_file': fasm_file,
+                })
+            self.assertTrue(response['ok'], response.get('error'))
+            self.assertEqual(response['result'], expected.getvalue())
+
+    def test_part_lru(self):
+        request = {
+            'op': 'fasm2frames',
+            'part': PART,
+            'fasm_file': os.path.join(TEST_DATA, 'lut.fasm'),
+        }
+
+        for db_root in (DB_ROOT, DB_ROOT + '/', DB_ROOT):
+            response = self.submit(dict(request, db_root=db_root))
+            self.assertTrue(response['ok'], response.get('error'))
+            self.assertGreater(response['timing']['load'], 0)
+
+        response = self.submit({'op': 'stats'})
+        self.assertEqual(response['parts'], [[DB_ROOT, PART, None]])
+        self.assertEqual(response['counters'], {'fasm2frames': 3})
+
+    def test_busy_part(self):
+        """ Requests waiting on a busy part should not block other parts. """
+        request = {
+            'op': 'fasm2frames',
+            'part': PART,
+            'fasm_file': os.path.join(TEST_DATA, 'lut.fasm'),
+        }
+
+        busy_part, _ = self.server.parts.get(DB_ROOT, PART)
+        responses = []
+        with busy_part.lock:
+            threads = [
+                threading.Thread(
+                    target=lambda: responses.append(
+                        self.submit(dict(request, db_root=DB_ROOT))))
+                for _ in range(2)
+            ]
+            for thread in threads:
+                thread.start()
+
+            # Both job slots would be taken by requests on the busy part.
+            time.sleep(0.2)
+
+            response = self.submit(dict(request, db_root=DB_ROOT + '/'))
+            self.assertTrue(response['ok'], response.get('error'))
+            self.assertEqual(responses, [])
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(
+            [response['ok'] for response in responses], [True, True])
+
+    def test_errors(self):
+        response = self.submit({'op': 'unknown'})
+        self.assertFalse(response['ok'])
+        self.assertIn('Unknown op', response['error'])
+
+        response = self.submit(
+            {
+                'op': 'fasm2frames',
+                'db_root': DB_ROOT,
+                'part': PART,
+                'fasm_file': os.path.join(self.tmpdir.name, 'missing.fasm'),
+            })
+        self.assertFalse(response['ok'])
+
+    def test_failed_load(self):
+        """ A part that fails to load should not leave its lock behind. """
+        request = {
+            'op': 'fasm2frames',
+            'db_root': DB_ROOT,
+            'fasm_file': os.path.join(TEST_DATA, 'lut.fasm'),
+        }
+
+        for _ in range(2):
+            response = self.submit(dict(request, part='xc7missing'))
+            self.assertFalse(response['ok'])
+            self.assertEqual(self.server.parts.loading, {})
+
+        response = self.submit(dict(request, part=PART))
+        self.assertTrue(response['ok'], response.get('error'))
+        self.assertEqual(self.server.parts.loading, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,10 +14,16 @@ from io import StringIO
 import os
 import os.path
 import re
+import shutil
 import unittest
 import tempfile
+import zlib
+
+import fasm
 
 import prjxray
+import prjxray.db
+import prjxray.fasm_assembler
 import utils.fasm2frames as fasm2frames
 
 from textx.exceptions import TextXSyntaxError
@@ -177,6 +183,159 @@ CLBLM_L_X10Y102.SLICEM_X0.SRUSEDMUX 1
         # It will still be decent size though since even sparse occupies all columns in that area
         self.assertGreaterEqual(len(fout_full_txt), len(fout_sparse_txt) * 4)
 
+    def test_inconsistent_bits(self):
+        '''Features disagreeing on a bit should report both FASM lines'''
+        with self.assertRaisesRegex(
+                prjxray.fasm_assembler.FasmInconsistentBits,
+                'FASM line "CLBLM_L_X10Y102.SLICEM_X0.AFFMUX.CY" wanted to '
+                'clear bit .* but was set by FASM line '
+                '"CLBLM_L_X10Y102.SLICEM_X0.AFFMUX.AX"'):
+            self.fasm2frames(
+                """\
+CLBLM_L_X10Y102.SLICEM_X0.AFFMUX.AX
+CLBLM_L_X10Y102.SLICEM_X0.AFFMUX.CY
+""")
+
+    def test_jobs(self):
+        '''Sharded assembly should match serial assembly'''
+        for fname in ('lut_int.fasm', 'ff_int.fasm', 'iob/liob_stepdown.fasm',
+                      'iob/riob_stepdown.fasm'):
+            fasm_data = self.get_test_data(fname)
+            self.assertEqual(
+                self.fasm2frames(fasm_data), self.fasm2frames(
+                    fasm_data, jobs=3))
+
+    def test_jobs_inconsistent_bits(self):
+        '''Conflicts across shards should report the serial error'''
+        fasm_data = """\
+CLBLM_L_X10Y102.SLICEM_X0.AFFMUX.AX
+INT_L_X10Y102.BYP_ALT0.EE2END0
+CLBLM_L_X10Y102.SLICEM_X0.AFFMUX.CY
+"""
+        with self.assertRaises(
+                prjxray.fasm_assembler.FasmInconsistentBits) as serial:
+            self.fasm2frames(fasm_data)
+
+        with self.assertRaises(
+                prjxray.fasm_assembler.FasmInconsistentBits) as sharded:
+            self.fasm2frames(fasm_data, jobs=2)
+
+        self.assertEqual(str(serial.exception), str(sharded.exception))
+
+    def test_jobs_line_order(self):
+        '''Bits written by several shards should keep the first line'''
+        with tempfile.TemporaryDirectory() as d:
+            db_root = os.path.join(d, 'db')
+            shutil.copytree(self.filename_test_data('db'), db_root)
+
+            # Same bit as CLBLM_L.SLICEM_X0.A5FF.ZINI of CLBLM_L_X10Y102.
+            with open(os.path.join(db_root, 'segbits_int_l.db'), 'a') as f:
+                f.write('INT_L.TEST_SET 31_06\n')
+                f.write('INT_L.TEST_CLEAR !31_06\n')
+
+            # With 2 jobs, the later CLBLM_L line is in the lower shard.
+            self.assertEqual(
+                [
+                    zlib.crc32(tile.encode('utf-8')) % 2
+                    for tile in ('INT_L_X10Y102', 'CLBLM_L_X10Y102')
+                ], [1, 0])
+            lines = list(
+                fasm.parse_fasm_string(
+                    'INT_L_X10Y102.TEST_SET\n'
+                    'CLBLM_L_X10Y102.SLICEM_X0.A5FF.ZINI\n'))
+            clear_line, = fasm.parse_fasm_string('INT_L_X10Y102.TEST_CLEAR\n')
+
+            messages = []
+            for jobs in (1, 2):
+                assembler = prjxray.fasm_assembler.FasmAssembler(
+                    prjxray.db.Database(db_root, "xc7a200tffg1156-1"))
+                if jobs == 1:
+                    for line in lines:
+                        assembler.add_fasm_line(line, [])
+                else:
+                    assembler.parse_fasm_lines(lines, jobs)
+
+                with self.assertRaises(
+                        prjxray.fasm_assembler.FasmInconsistentBits) as e:
+                    assembler.add_fasm_line(clear_line, [])
+                messages.append(str(e.exception))
+
+            self.assertIn('by FASM line "INT_L_X10Y102.TEST_SET"', messages[0])
+            self.assertEqual(messages[1], messages[0])
+
+    def test_inconsistent_feature(self):
+        '''A feature setting and clearing one bit should name its own line'''
+        with tempfile.TemporaryDirectory() as d:
+            db_root = os.path.join(d, 'db')
+            shutil.copytree(self.filename_test_data('db'), db_root)
+
+            with open(os.path.join(db_root, 'segbits_int_l.db'), 'a') as f:
+                f.write('INT_L.TEST_BOTH 30_06 31_06 !31_06\n')
+
+            assembler = prjxray.fasm_assembler.FasmAssembler(
+                prjxray.db.Database(db_root, "xc7a200tffg1156-1"))
+            line, = fasm.parse_fasm_string('INT_L_X10Y102.TEST_BOTH\n')
+            with self.assertRaisesRegex(
+                    prjxray.fasm_assembler.FasmInconsistentBits,
+                    'FASM line "INT_L_X10Y102.TEST_BOTH" wanted to clear bit '
+                    '.* but was set by FASM line "INT_L_X10Y102.TEST_BOTH"'):
+                assembler.add_fasm_line(line, [])
+
+            # Nothing is written by the inconsistent feature.
+            self.assertEqual(assembler.get_frames(sparse=True), {})
+
+    def test_compiled_db(self):
+        '''Compiled database snapshot should produce the same frames'''
+        db = prjxray.db.Database(
+            self.filename_test_data('db'), "xc7a200tffg1156-1")
+
+        with tempfile.TemporaryDirectory() as d:
+            compiled_db = os.path.join(d, 'db.bin')
+            db.write_compiled(compiled_db)
+
+            fasm_data = self.get_test_data('ff_int.fasm')
+            self.assertEqual(
+                self.fasm2frames(fasm_data),
+                self.fasm2frames(fasm_data, compiled_db=compiled_db))
+
+    def test_feature_cache(self):
+        '''Persisted feature bits should produce the same frames'''
+        with tempfile.TemporaryDirectory() as d:
+            feature_cache = os.path.join(d, 'feature_bits.cache')
+
+            for fname in ('ff_int.fasm', 'iob/liob_stepdown.fasm'):
+                fasm_data = self.get_test_data(fname)
+                expected = self.fasm2frames(fasm_data)
+
+                # First run fills the cache, second run uses it.
+                for _ in range(2):
+                    self.assertEqual(
+                        expected,
+                        self.fasm2frames(
+                            fasm_data, feature_cache=feature_cache))
+
+    def test_database_signature(self):
+        '''Signature should change when a segbits file changes size'''
+        with tempfile.TemporaryDirectory() as d:
+            db_root = os.path.join(d, 'db')
+            shutil.copytree(self.filename_test_data('db'), db_root)
+
+            def signature():
+                return prjxray.fasm_assembler.database_signature(
+                    prjxray.db.Database(db_root, "xc7a200tffg1156-1"))
+
+            expected = signature()
+            self.assertEqual(signature(), expected)
+
+            # Same mtime, one more line.
+            segbits = os.path.join(db_root, 'segbits_int_l.db')
+            stat = os.stat(segbits)
+            with open(segbits, 'a') as f:
+                f.write('INT_L.NOT_A_FEATURE 00_00\n')
+            os.utime(segbits, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+            self.assertNotEqual(signature(), expected)
+
     def test_stepdown_1(self):
         self.bitread_frm_equals(
             'iob/liob_stepdown.fasm', 'iob/liob_stepdown.bits')